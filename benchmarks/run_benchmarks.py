@@ -0,0 +1,244 @@
+"""
+Benchmark suite for network_diagnostics.
+
+Runs full passes of every test that can be served locally (everything but Speedtest)
+against the stub servers in stubs.py, with diagnostic commands replaced by fake runners
+and the traceroute engine answered by simulated routers (unless --commands is given),
+under configurable latency, loss, bandwidth and bottleneck queue size. It measures:
+  - end-to-end pass time (median over the passes)
+  - per-test time, and the part of it not spent in a traced phase (overhead)
+  - scheduler overhead per test, from passes of tests that do nothing
+  - processes spawned per pass
+  - peak traced memory during a pass and the peak resident set size
+  - cold import and headless single-test start-up time (see startup.py)
+  - latency added under load and the responsiveness (RPM) the Latency Under Load test
+    reports, which mostly follow --queue
+
+and compares every metric with a stored baseline. A metric is a regression when it is
+more than --tolerance worse than the baseline and the difference is above the noise floor
+of its unit. Exit status is 1 if any metric regressed, or if any test failed without
+simulated loss (with loss, failed tests are expected and only reported).
+
+Usage:
+  python benchmarks/run_benchmarks.py [--passes N] [--latency MS] [--loss PCT] [--bandwidth MBPS] [--queue MS]
+  python benchmarks/run_benchmarks.py --save-baseline    (record this machine's numbers)
+"""
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+from stubs import NetworkConditions, StubNetwork, fake_command_popen, simulated_hop_transport, stub_ssl_context
+
+import network_diagnostics  # noqa: E402  (put on the path by stubs)
+import startup
+
+BENCHMARK_DIRECTORY = Path(__file__).resolve().parent
+DEFAULT_BASELINE = BENCHMARK_DIRECTORY / 'baseline.json'
+STUB_TESTS = ['Ping', 'Traceroute', 'IP Configuration', 'Current Public IP', 'DNS Flush', 'Nslookup',
+              'HTTP Probe', 'Netstat', 'Throughput', 'Latency Under Load']
+NOOP_TESTS = 50
+
+# Differences below these are noise whatever the tolerance, keyed by metric name suffix
+NOISE_FLOORS = {'_ms': 2.0, '_us': 50.0, '_kib': 512.0, '_count': 0.0, '_rpm': 100.0}
+HIGHER_IS_BETTER = ('_rpm',)
+
+
+def run_pass(settings, test_names):
+    start_ns = time.perf_counter_ns()
+    results = network_diagnostics.schedule_tests(test_names, settings, network_diagnostics.HeadlessProgress())
+    return results, (time.perf_counter_ns() - start_ns) / 1e6
+
+
+def untraced_ms(result):
+    """Time a test spent outside its traced phases: parsing, bookkeeping and scheduling glue."""
+    phases = dict(result.get('Phases', {}))
+    total = phases.pop('total', 0.0)
+    return max(0.0, total - sum(phases.values()))
+
+
+def measure_passes(settings, passes, test_names):
+    pass_times, per_test, failures = [], {}, {}
+    spawns_before = network_diagnostics.process_spawn_count
+    for _ in range(passes):
+        results, elapsed_ms = run_pass(settings, test_names)
+        pass_times.append(elapsed_ms)
+        for test, data in results.items():
+            per_test.setdefault(test, {'total': [], 'overhead': []})
+            per_test[test]['total'].append(data.get('Phases', {}).get('total', 0.0))
+            per_test[test]['overhead'].append(untraced_ms(data))
+            if data.get('result') not in ('Passed', 'Completed'):
+                failures[test] = data.get('Error', data.get('result'))
+            for direction, added in data.get('Added Latency', {}).items():
+                per_test[test].setdefault(f"{direction}_added_latency", []).append(added)
+            if data.get('RPM'):
+                per_test[test].setdefault('rpm', []).append(data['RPM'])
+    spawns = (network_diagnostics.process_spawn_count - spawns_before) / passes
+
+    metrics = {'pass_ms': statistics.median(pass_times), 'spawns_per_pass_count': spawns}
+    for test, samples in per_test.items():
+        slug = network_diagnostics.metric_slug(test)
+        metrics[f"test.{slug}.total_ms"] = statistics.median(samples['total'])
+        metrics[f"test.{slug}.overhead_ms"] = statistics.median(samples['overhead'])
+        for direction in ('download', 'upload'):
+            if f"{direction}_added_latency" in samples:
+                metrics[f"test.{slug}.{direction}_added_latency_ms"] = statistics.median(samples[f"{direction}_added_latency"])
+        if 'rpm' in samples:
+            metrics[f"test.{slug}.loaded_rpm"] = statistics.median(samples['rpm'])
+    return metrics, failures
+
+
+def measure_memory(settings, test_names):
+    tracemalloc.start()
+    try:
+        run_pass(settings, test_names)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    metrics = {'pass_peak_traced_kib': peak / 1024}
+    try:
+        import resource
+        metrics['peak_rss_kib'] = float(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+    except ImportError:
+        pass  # No resource module on Windows
+    return metrics
+
+
+def measure_scheduler_overhead():
+    """Microseconds the scheduler adds per test, from a pass of tests that return at once."""
+    noop_tests = [{'name': f"Noop {index}", 'cli_name': f"noop{index}", 'result_key': f"Noop {index}",
+                   'runner': lambda progress, settings: {'result': 'Passed', 'duration': '0:00:00'}, 'after': []}
+                  for index in range(NOOP_TESTS)]
+    original_tests = network_diagnostics.NETWORK_TESTS
+    network_diagnostics.NETWORK_TESTS = noop_tests
+    try:
+        samples = []
+        for _ in range(5):
+            _, elapsed_ms = run_pass({'cache_settings': {'persist': False}, 'statistics_settings': {'persist': False}},
+                                      [test['name'] for test in noop_tests])
+            samples.append(elapsed_ms * 1000 / NOOP_TESTS)
+    finally:
+        network_diagnostics.NETWORK_TESTS = original_tests
+    return {'scheduler_per_test_us': statistics.median(samples)}
+
+
+def measure_startup(runs):
+    import_times = [startup.import_profile()[0] / 1000 for _ in range(runs)]
+    run_times = [startup.single_test_wall_time() * 1000 for _ in range(runs)]
+    return {'startup_import_ms': statistics.median(import_times),
+            'startup_single_test_ms': statistics.median(run_times)}
+
+
+def compare_with_baseline(metrics, baseline, tolerance):
+    """Returns (lines describing each metric, names of regressed metrics)."""
+    lines, regressions = [], []
+    for name, value in sorted(metrics.items()):
+        reference = baseline.get(name)
+        if reference is None:
+            lines.append(f"  {name:<45} {value:12.3f}")
+            continue
+        floor = next((floor for suffix, floor in NOISE_FLOORS.items() if name.endswith(suffix)), 0.0)
+        change = (value - reference) / reference if reference else 0.0
+        worse = reference - value if name.endswith(HIGHER_IS_BETTER) else value - reference
+        regressed = bool(reference) and worse > floor and worse / abs(reference) > tolerance
+        if regressed:
+            regressions.append(name)
+        lines.append(f"  {name:<45} {value:12.3f}  baseline {reference:12.3f}  {change:+7.1%}"
+                     + ('  REGRESSION' if regressed else ''))
+    return lines, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--passes', type=int, default=5, help='measured passes (default: 5)')
+    parser.add_argument('--latency', type=float, default=5.0, help='simulated one-way delay in ms (default: 5)')
+    parser.add_argument('--jitter', type=float, default=1.0, help='simulated extra random delay in ms (default: 1)')
+    parser.add_argument('--loss', type=float, default=0.0, help='simulated loss in percent (default: 0)')
+    parser.add_argument('--bandwidth', type=float, default=100.0,
+                        help='simulated bandwidth in Mbit/s, 0 for unlimited (default: 100)')
+    parser.add_argument('--queue', type=float, default=0.0,
+                        help='simulated bottleneck buffer in ms at the bandwidth limit (default: 0)')
+    parser.add_argument('--tests', help=f"comma-separated tests to run (default: {', '.join(STUB_TESTS)})")
+    parser.add_argument('--commands', action='store_true',
+                        help='use the command-based traceroute (fake tracert) instead of the in-process engine')
+    parser.add_argument('--startup-runs', type=int, default=5, help='cold starts to sample (default: 5)')
+    parser.add_argument('--baseline', type=Path, default=DEFAULT_BASELINE, help='baseline file to compare with')
+    parser.add_argument('--save-baseline', action='store_true', help='write the measured metrics to --baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='relative slowdown allowed before a metric counts as regressed (default: 0.25)')
+    parser.add_argument('--json', type=Path, help='also write the report to this file')
+    arguments = parser.parse_args()
+
+    network_diagnostics.console_output = False
+    test_names = [name.strip() for name in arguments.tests.split(',')] if arguments.tests else STUB_TESTS
+    conditions = NetworkConditions(arguments.latency, arguments.jitter, arguments.loss, arguments.bandwidth or None,
+                                   arguments.queue)
+    original_popen = subprocess.Popen
+    original_native_traceroute = network_diagnostics.native_traceroute_available
+    original_transport = network_diagnostics.open_recverr_transport
+    original_pool = network_diagnostics.http_pool
+    subprocess.Popen = fake_command_popen(conditions)
+    network_diagnostics.http_pool = network_diagnostics.HttpConnectionPool(context=stub_ssl_context())
+    if arguments.commands:
+        network_diagnostics.native_traceroute_available = lambda: False
+    else:
+        # Routers in front of the target instead of loopback's single hop, on any platform
+        network_diagnostics.native_traceroute_available = lambda: True
+        network_diagnostics.open_recverr_transport = simulated_hop_transport(conditions)
+    try:
+        with StubNetwork(conditions) as network:
+            settings = network.settings()
+            run_pass(settings, test_names)  # Warm-up: first-run caches and the IP Configuration snapshot
+            metrics, failures = measure_passes(settings, arguments.passes, test_names)
+            metrics.update(measure_memory(settings, test_names))
+    finally:
+        subprocess.Popen = original_popen
+        network_diagnostics.native_traceroute_available = original_native_traceroute
+        network_diagnostics.open_recverr_transport = original_transport
+        network_diagnostics.http_pool.close()
+        network_diagnostics.http_pool = original_pool
+    metrics.update(measure_scheduler_overhead())
+    metrics.update(measure_startup(arguments.startup_runs))
+    metrics = {name: round(value, 3) for name, value in metrics.items()}
+
+    report = {'timestamp': time.time(), 'python': platform.python_version(), 'platform': platform.platform(),
+              'conditions': conditions.as_dict(), 'passes': arguments.passes, 'tests': test_names,
+              'commands': arguments.commands, 'metrics': metrics, 'failures': failures}
+    baseline = {}
+    if arguments.baseline.exists() and not arguments.save_baseline:
+        stored = json.loads(arguments.baseline.read_text())
+        if stored.get('conditions') == report['conditions'] and stored.get('tests') == test_names \
+                and stored.get('commands') == arguments.commands:
+            baseline = stored['metrics']
+        else:
+            print(f"Baseline {arguments.baseline} was recorded under other conditions; not comparing")
+
+    print(f"{arguments.passes} passes of {len(test_names)} tests, latency {arguments.latency} ms, "
+          f"loss {arguments.loss}%, bandwidth {arguments.bandwidth or 'unlimited'} Mbit/s, queue {arguments.queue} ms")
+    lines, regressions = compare_with_baseline(metrics, baseline, arguments.tolerance)
+    print('\n'.join(lines))
+    if arguments.json:
+        arguments.json.write_text(json.dumps(report, indent=2) + '\n')
+    if arguments.save_baseline:
+        arguments.baseline.write_text(json.dumps(report, indent=2) + '\n')
+        print(f"Baseline saved to {arguments.baseline}")
+
+    failures_fatal = not arguments.loss
+    for test, error in failures.items():
+        print(f"{'FAIL' if failures_fatal else 'Failed under loss'}: {test}: {error}")
+    if regressions:
+        print(f"FAIL: {len(regressions)} metrics regressed more than {arguments.tolerance:.0%}: {', '.join(regressions)}")
+    if (failures and failures_fatal) or regressions:
+        return 1
+    print(f"OK: {len(test_names) - len(failures)} of {len(test_names)} tests passed"
+          + (" and no metric regressed" if baseline else ""))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
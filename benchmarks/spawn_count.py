@@ -0,0 +1,78 @@
+"""
+Process spawn harness for network_diagnostics.
+
+Replaces subprocess.Popen with the fake command runner from stubs.py, counting every
+command line, and runs one full pass of the command-based tests with their in-process
+replacements turned off: the native traceroute engine reports itself unavailable and
+/sys/class/net and /proc/net/tcp appear absent, as on Windows. Fails (exit status 1)
+unless every command-based test started exactly one diagnostic command.
+
+Usage: python benchmarks/spawn_count.py
+"""
+import os
+import subprocess
+import sys
+import threading
+from collections import Counter
+
+from stubs import NetworkConditions, fake_command_popen
+
+import network_diagnostics  # noqa: E402  (put on the path by stubs)
+
+# Tests whose runners shell out where no in-process replacement applies; Speedtest and
+# the HTTP-based tests talk to the network directly.
+COMMAND_TESTS = ['Traceroute', 'IP Configuration', 'DNS Flush', 'Netstat']
+HIDDEN_PATHS = ('/sys/class/net', '/proc/net/tcp')
+
+
+def hiding(check):
+    """Wraps os.path.isdir/exists so the paths the in-process collectors look for seem absent."""
+    return lambda path: False if str(path).startswith(HIDDEN_PATHS) else check(path)
+
+
+def count_spawns_for_pass():
+    settings = {'test_preferences': {name: 'Enabled' for name in COMMAND_TESTS},
+                'scheduler_settings': {'max_concurrency': 4, 'exclusive_tests': []},
+                'traceroute_settings': {'target': '127.0.0.1', 'max_hops': 2, 'probes_per_hop': 1, 'timeout': 0.2},
+                'cache_settings': {'enabled': False, 'persist': False},
+                'statistics_settings': {'persist': False},
+                'timeseries_settings': {'enabled': False}}
+    spawned = Counter()
+    lock = threading.Lock()
+
+    def record(args):
+        with lock:
+            spawned[' '.join(args)] += 1
+
+    spawns_before = network_diagnostics.process_spawn_count
+    originals = (subprocess.Popen, network_diagnostics.native_traceroute_available, os.path.isdir, os.path.exists)
+    subprocess.Popen = fake_command_popen(NetworkConditions(), on_spawn=record)
+    network_diagnostics.native_traceroute_available = lambda: False
+    os.path.isdir, os.path.exists = hiding(os.path.isdir), hiding(os.path.exists)
+    try:
+        results = network_diagnostics.schedule_tests(COMMAND_TESTS, settings, network_diagnostics.HeadlessProgress())
+    finally:
+        subprocess.Popen, network_diagnostics.native_traceroute_available, os.path.isdir, os.path.exists = originals
+    return results, dict(spawned), network_diagnostics.process_spawn_count - spawns_before
+
+
+def main():
+    results, spawned, counted = count_spawns_for_pass()
+    print(f"Tests run: {len(results)}")
+    print(f"Processes spawned: {sum(spawned.values())} (counted by run_command_with_progress: {counted})")
+    duplicates = {command: count for command, count in spawned.items() if count > 1}
+    for command, count in sorted(spawned.items()):
+        print(f"  {count} x {command}")
+    if duplicates or sum(spawned.values()) != counted:
+        print(f"FAIL: commands executed more than once or outside the single execution path: {duplicates}")
+        return 1
+    if len(spawned) != len(COMMAND_TESTS):
+        print(f"FAIL: expected one command per test ({len(COMMAND_TESTS)}), saw {len(spawned)}; "
+              "a test took an in-process path the harness did not disable")
+        return 1
+    print("OK: every diagnostic command was executed exactly once")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,84 @@
+"""
+Cold-start benchmark for network_diagnostics.
+
+Measures, in fresh interpreters:
+  - the cumulative import time of the module, using `python -X importtime`
+  - the wall time of a headless single-test run (one loopback probe through the
+    Ping test), from interpreter start to exit
+
+and lists the slowest imports, so third-party packages creeping back onto the
+import path show up immediately.
+
+Usage: python benchmarks/startup.py [--runs N]
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+REPO_DIRECTORY = Path(__file__).resolve().parent.parent
+HEAVY_MODULES = ('art', 'requests', 'plyer', 'speedtest', 'colorama', 'rich', 'pyshortcuts')
+
+SINGLE_TEST_RUN = (
+    "import network_diagnostics as nd; "
+    "nd.schedule_tests(['Ping'], {'ping_settings': {'targets': ['127.0.0.1:9'], 'count': 1, 'method': 'tcp'}, "
+    "'cache_settings': {'persist': False}, 'statistics_settings': {'persist': False}}, "
+    "nd.HeadlessProgress())"
+)
+
+
+def import_profile():
+    """Returns (total import time in microseconds, [(cumulative us, module)]) for one cold import."""
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import network_diagnostics'],
+                               cwd=REPO_DIRECTORY, capture_output=True, text=True, check=True)
+    modules = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative_us, name = line[len('import time:'):].split('|')
+        modules.append((int(cumulative_us), name.rstrip()))
+    total = next(cumulative for cumulative, name in modules if name.strip() == 'network_diagnostics')
+    return total, modules
+
+
+def single_test_wall_time():
+    start_time = time.perf_counter()
+    subprocess.run([sys.executable, '-c', SINGLE_TEST_RUN], cwd=REPO_DIRECTORY, capture_output=True, check=True)
+    return time.perf_counter() - start_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10, help='cold starts to sample (default: 10)')
+    arguments = parser.parse_args()
+
+    import_times = []
+    for _ in range(arguments.runs):
+        total, modules = import_profile()
+        import_times.append(total)
+    run_times = [single_test_wall_time() for _ in range(arguments.runs)]
+    interpreter_times = []
+    for _ in range(arguments.runs):
+        start_time = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'pass'], check=True)
+        interpreter_times.append(time.perf_counter() - start_time)
+
+    print(f"Import of network_diagnostics: median {statistics.median(import_times) / 1000:.1f} ms over {arguments.runs} runs")
+    print(f"Headless single-test run:      median {statistics.median(run_times) * 1000:.1f} ms "
+          f"(bare interpreter {statistics.median(interpreter_times) * 1000:.1f} ms)")
+    print("Slowest imports (cumulative):")
+    for cumulative, name in sorted(modules, reverse=True)[:10]:
+        print(f"  {cumulative / 1000:8.1f} ms  {name.strip()}")
+
+    loaded_heavy = sorted({name.strip().split('.')[0] for _, name in modules} & set(HEAVY_MODULES))
+    if loaded_heavy:
+        print(f"FAIL: third-party modules imported at startup: {', '.join(loaded_heavy)}")
+        return 1
+    print("OK: no third-party modules imported at startup")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
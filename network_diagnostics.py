@@ -3,6 +3,8 @@ import subprocess
 import sys
 import os
 import json
+import copy
+import csv
 
 def install_required_packages():
         packages = ["art", "requests", "speedtest-cli", "plyer", "colorama", "rich", "pyshortcuts", "pywin32"]
@@ -13,312 +15,4147 @@ def install_required_packages():
                 subprocess.check_call([sys.executable, "-m", "pip", "install", package])
             else:
                 print(f"Requirement already satisfied: {package}")
+        print("Package installation completed. Running the script...")
 
+# --- Imports ---
+# Only the standard library is imported here. Third-party packages (art, plyer,
+# speedtest, colorama, rich, pyshortcuts) are imported inside the functions that use
+# them, so a headless run of one test never pays for the banner, menus or Speedtest.
+from datetime import datetime, timedelta
+import time
+import threading
+import heapq
+import bisect
+import atexit
+from array import array
+import signal
+import asyncio
+import socket
+import struct
+import math
+import errno
+import queue
+from collections import Counter, deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from pathlib import Path
+   
+# --- Logging Setup ---
+import logging
+
+# Nothing is logged until configure_logging() attaches the queue handler; the null
+# handler keeps records from reaching Python's last-resort stderr handler before that.
+logging.getLogger().addHandler(logging.NullHandler())
+
+# --- Lazy colorama ---
+colorama_initialized = False
+
+class LazyColor:
+    """
+    Stands in for colorama's Fore or Style: colorama is imported and initialized on the
+    first attribute lookup, and each looked-up code is cached on the instance.
+    """
+
+    def __init__(self, group):
+        self._group = group
+
+    def __getattr__(self, name):
+        global colorama_initialized
+        import colorama
+        if not colorama_initialized:
+            colorama.init(autoreset=True)
+            colorama_initialized = True
+        value = getattr(getattr(colorama, self._group), name)
+        setattr(self, name, value)
+        return value
+
+Fore = LazyColor('Fore')
+Style = LazyColor('Style')
+
+# --- Clear Screen Function ---
+def clear_screen():
+    logging.debug("Clearing the screen")
+    try:
+        if os.name == 'nt':
+            _ = os.system('cls')
+        else:
+            _ = os.system('clear')
+    except Exception as e:
+        logging.error("Error clearing screen: %s", e)
+    finally:
+        display_script_name()
+        
+# --- Create Shortcut ---
+def create_shortcut(shortcut_name):
+    logging.info("Creating shortcut: %s", shortcut_name)
+    try:
+        from pyshortcuts import make_shortcut
+        script_path = Path(__file__).resolve()
+        icon_path = script_path.parent / "icon.ico"
+
+        make_shortcut(
+            script=str(script_path),
+            name=shortcut_name,
+            icon=str(icon_path),
+            terminal=False,  
+            desktop=True,  
+        )
+        logging.info("Shortcut '%s' created successfully on the desktop.", shortcut_name)
+    except Exception as e:
+        logging.error("Error in shortcut creation process: %s", e)
+
+# --- Display Script Name ---
+SCRIPT_BANNER = None  # text2art output, rendered on first use since every menu screen repeats it
+
+def display_script_name():
+    global SCRIPT_BANNER
+    if SCRIPT_BANNER is None:
+        from art import text2art
+        SCRIPT_BANNER = text2art("Network Diagnostics")
+    title_color = Fore.LIGHTYELLOW_EX
+    author_color = Fore.MAGENTA
+    print(title_color + SCRIPT_BANNER, end='')
+    print(author_color + "By AztecViper\n")
+    
+# --- Status Output ---
+# Set to False for machine-readable runs so per-test status lines never mix with
+# the structured output written to stdout.
+console_output = True
+
+def print_status(message, color=None):
+    if console_output:
+        print((getattr(Fore, color) if color else '') + message)
+
+# --- Process Spawn Counter ---
+# Incremented once per child process started by run_command_with_progress, so a pass
+# can be checked for commands that are executed more than once.
+process_spawn_count = 0
+process_spawn_lock = threading.Lock()
+
+def count_process_spawn():
+    global process_spawn_count
+    with process_spawn_lock:
+        process_spawn_count += 1
+
+# --- Tracing ---
+class TraceSpan:
+    __slots__ = ('tracer', 'name', 'category', 'args', 'start_ns')
+
+    def __init__(self, tracer, name, category, args):
+        self.tracer, self.name, self.category, self.args = tracer, name, category, args
+
+    def __enter__(self):
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.tracer.add(self.name, self.start_ns, time.perf_counter_ns(), self.category, args=self.args)
+
+class Tracer:
+    """
+    Collects perf_counter_ns spans. Spans in the 'phase' category are added to the phase
+    totals of the test running on the current thread (between begin_test and end_test),
+    which the scheduler attaches to the result as 'Phases'. While 'recording' is on every
+    span is also kept as a Chrome trace event, for export() to write in a format that
+    chrome://tracing and Perfetto open directly.
+    """
+    def __init__(self, max_events=200000):
+        self.recording = False
+        self.events = deque(maxlen=max_events)
+        self.thread_names = {}
+        self.origin_ns = time.perf_counter_ns()
+        self._local = threading.local()
+
+    def span(self, name, category='phase', **args):
+        return TraceSpan(self, name, category, args)
+
+    def add(self, name, start_ns, end_ns, category='phase', thread=None, args=None):
+        """Records a finished span; 'thread' is the thread it ran on, if not the current one."""
+        phases = getattr(self._local, 'phases', None)
+        if phases is not None and category == 'phase':
+            phases[name] = phases.get(name, 0) + end_ns - start_ns
+        if self.recording:
+            thread = thread or threading.current_thread()
+            self.thread_names[thread.ident] = thread.name
+            event = {'name': name, 'cat': category, 'ph': 'X', 'pid': os.getpid(), 'tid': thread.ident,
+                     'ts': (start_ns - self.origin_ns) / 1000, 'dur': (end_ns - start_ns) / 1000}
+            if args:
+                event['args'] = args
+            self.events.append(event)
+
+    def begin_test(self):
+        self._local.phases = {}
+
+    def end_test(self):
+        """Returns the phase totals of the current thread's test in milliseconds."""
+        phases = getattr(self._local, 'phases', None) or {}
+        self._local.phases = None
+        return {name: round(total_ns / 1e6, 3) for name, total_ns in phases.items()}
+
+    def export(self, path):
+        metadata = [{'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': ident, 'args': {'name': name}}
+                    for ident, name in self.thread_names.items()]
+        with open(path, 'w') as file:
+            json.dump({'traceEvents': metadata + list(self.events), 'displayTimeUnit': 'ms'}, file)
+
+tracer = Tracer()
+
+# cProfile only sees the thread it was enabled on, so while a CPU profile is running each
+# test gets its own profiler on its worker thread and the statistics are merged at the end
+cpu_profiles = {'enabled': False, 'stats': None, 'lock': threading.Lock()}
+
+def call_profiled(function, *args):
+    """
+    Calls function under its own profiler while CPU profiling is on, then folds the
+    profile into the shared pstats.Stats, so memory stays bounded by the number of
+    distinct functions however many tests a monitor session runs.
+    """
+    if not cpu_profiles['enabled']:
+        return function(*args)
+    import cProfile
+    import pstats
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(function, *args)
+    finally:
+        with cpu_profiles['lock']:
+            if cpu_profiles['stats'] is None:
+                cpu_profiles['stats'] = pstats.Stats(profiler)
+            else:
+                cpu_profiles['stats'].add(profiler)
+
+# --- Test Deadlines ---
+# Each scheduled test runs with a TestDeadline bound to its thread. When the scheduler
+# gives up on a test it calls cancel(), which runs every registered canceller: commands
+# have their whole process group killed and event loops have their main task cancelled,
+# so the worker thread unwinds quickly instead of holding on to sockets and children.
+test_deadlines = threading.local()
+
+class TestDeadline:
+    def __init__(self, name, seconds=None):
+        self.name = name
+        self.seconds = seconds
+        self.started = time.perf_counter()
+        self.expires = self.started + seconds if seconds else math.inf
+        self.cancelled = threading.Event()
+        self.partial = {}  # Results gathered so far, reported if the test times out
+        self._cancellers = {}
+        self._lock = threading.Lock()
+
+    def remaining(self):
+        """Seconds left before the deadline (None when the test has no limit)."""
+        return None if self.expires == math.inf else max(0.0, self.expires - time.perf_counter())
+
+    def on_cancel(self, key, canceller):
+        """Registers a callable that stops some in-flight work; it runs at once if already cancelled."""
+        with self._lock:
+            if not self.cancelled.is_set():
+                self._cancellers[key] = canceller
+                return
+        canceller()
+
+    def discard(self, key):
+        with self._lock:
+            self._cancellers.pop(key, None)
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled.set()
+            cancellers, self._cancellers = list(self._cancellers.values()), {}
+        for canceller in cancellers:
+            try:
+                canceller()
+            except Exception as e:
+                logging.debug("Cancelling part of the %s test failed: %s", self.name, e)
+
+def current_deadline():
+    """The TestDeadline of the test running on this thread, or None outside the scheduler."""
+    return getattr(test_deadlines, 'current', None)
+
+def deadline_cancelled():
+    """
+    True once the scheduler has given up on the test running on this thread. Its result
+    has already been reported, so whatever the worker still produces is dropped rather
+    than written into the progress display, the cache or the statistics of later passes.
+    """
+    deadline = current_deadline()
+    return deadline is not None and deadline.cancelled.is_set()
+
+class DeadlineProgress:
+    """Forwards calls to the progress display until the test's deadline is cancelled, then drops them."""
+    def __init__(self, progress, deadline):
+        self._progress = progress
+        self._deadline = deadline
+
+    def __getattr__(self, name):
+        attribute = getattr(self._progress, name)
+        if not callable(attribute):
+            return attribute
+
+        def forward(*args, **kwargs):
+            if self._deadline.cancelled.is_set():
+                return None
+            return attribute(*args, **kwargs)
+        return forward
+
+def record_partial(**values):
+    """Stores results gathered so far, so a test that times out still reports them."""
+    deadline = current_deadline()
+    if deadline is not None:
+        deadline.partial.update(values)
+
+def run_until_deadline(coroutine):
+    """
+    asyncio.run() bounded by the current test's deadline. Raises TimeoutError when the
+    deadline passes or the scheduler cancels the test.
+    """
+    deadline = current_deadline()
+    if deadline is None:
+        return asyncio.run(coroutine)
+
+    async def guarded():
+        loop = asyncio.get_running_loop()
+        task = asyncio.ensure_future(coroutine)
+        deadline.on_cancel(task, lambda: loop.call_soon_threadsafe(task.cancel))
+        try:
+            return await asyncio.wait_for(task, deadline.remaining())
+        finally:
+            deadline.discard(task)
+
+    try:
+        return asyncio.run(guarded())
+    except asyncio.CancelledError:
+        raise TimeoutError(f"{deadline.name} test was cancelled") from None
+
+# Children start in their own process group (session on POSIX), so a timeout can kill
+# everything a command started, not just the command itself
+if os.name == 'posix':
+    PROCESS_GROUP_OPTIONS = {'start_new_session': True}
+else:
+    PROCESS_GROUP_OPTIONS = {'creationflags': getattr(subprocess, 'CREATE_NEW_PROCESS_GROUP', 0)}
+
+def kill_process_group(process):
+    if process.poll() is not None:
+        return
+    if os.name == 'posix':
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    else:
+        subprocess.run(['taskkill', '/F', '/T', '/PID', str(process.pid)], capture_output=True)
+
+# --- Progress Function ---
+def iter_command_lines(process):
+    """
+    Yields (stream, line) for every line a process writes to 'stdout' or 'stderr', as soon
+    as it arrives, until both pipes are closed. On POSIX the pipes are read without blocking
+    through a selector; Windows cannot select on pipes, so there a reader thread per pipe
+    feeds a queue. Either way the caller is woken by output, never by a timer.
+    """
+    import locale
+    encoding = locale.getpreferredencoding(False)
+    if os.name == 'posix':
+        import selectors
+        with selectors.DefaultSelector() as selector:
+            partial = {}
+            for pipe, name in ((process.stdout, 'stdout'), (process.stderr, 'stderr')):
+                os.set_blocking(pipe.fileno(), False)
+                selector.register(pipe.fileno(), selectors.EVENT_READ, name)
+                partial[name] = b''
+            while selector.get_map():
+                for key, _ in selector.select():
+                    try:
+                        chunk = os.read(key.fd, 65536)
+                    except BlockingIOError:
+                        continue
+                    if not chunk:
+                        selector.unregister(key.fd)
+                        chunk = b'\n' if partial[key.data] else b''  # Flush an unterminated last line
+                    lines = (partial[key.data] + chunk).split(b'\n')
+                    partial[key.data] = lines.pop()
+                    for line in lines:
+                        yield key.data, line.rstrip(b'\r').decode(encoding, 'replace')
+        return
+
+    arrived = queue.Queue()
+
+    def read_pipe(pipe, name):
+        for line in pipe:
+            arrived.put((name, line))
+        arrived.put((name, None))
+
+    for pipe, name in ((process.stdout, 'stdout'), (process.stderr, 'stderr')):
+        threading.Thread(target=read_pipe, args=(pipe, name), daemon=True).start()
+    open_pipes = 2
+    while open_pipes:
+        name, line = arrived.get()
+        if line is None:
+            open_pipes -= 1
+        else:
+            yield name, line.rstrip(b'\r\n').decode(encoding, 'replace')
+
+def run_command_with_progress(command, progress_task, progress, on_line=None):
+    """
+    Runs a command and streams its output line by line as it is produced.
+    :param command: Command to be executed as a list.
+    :param progress_task: Task ID for the progress bar.
+    :param progress: Progress object from Rich library.
+    :param on_line: Optional callback given each stdout line as it arrives; callers parse
+                    results and advance the progress bar from it. Returning True stops the
+                    command early, e.g. once a traceroute has reached its destination.
+    :return: Dictionary with the command's 'returncode', 'stdout', 'stderr', 'duration'
+             (seconds, measured around the process only), 'stopped' (True when on_line
+             ended the command) and 'error' (None unless the command could not be started).
+    """
+    command_line = ' '.join(command)
+    outcome = {'command': command, 'returncode': None, 'stdout': '', 'stderr': '', 'duration': 0.0,
+               'stopped': False, 'error': None}
+    output = {'stdout': [], 'stderr': []}
+
+    logging.info("Starting command: %s", command_line)
+    deadline = current_deadline()
+    started = time.perf_counter_ns()
+    spawned = None
+    try:
+        count_process_spawn()
+        with subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, **PROCESS_GROUP_OPTIONS) as process:
+            spawned = time.perf_counter_ns()
+            if deadline is not None:
+                # Killing the group closes the pipes, which ends the read loop below
+                deadline.on_cancel(process, lambda: kill_process_group(process))
+            try:
+                lines = iter_command_lines(process)
+                for stream, line in lines:
+                    output[stream].append(line)
+                    if stream == 'stdout' and on_line is not None and on_line(line):
+                        outcome['stopped'] = True
+                        # Kill the whole group so no helper the command started outlives it
+                        kill_process_group(process)
+                        break
+                lines.close()
+                outcome['returncode'] = process.wait()
+            finally:
+                if deadline is not None:
+                    deadline.discard(process)
+        if deadline is not None and deadline.cancelled.is_set():
+            outcome['error'] = f"killed when the {deadline.name} test timed out"
+        timing = {'phase': 'command', 'command': command_line, 'returncode': outcome['returncode'],
+                  'duration_ms': round((time.perf_counter_ns() - started) / 1e6, 3)}
+        if outcome['stopped']:
+            logging.debug("Command stopped once it had produced enough output: %s", command_line, extra=timing)
+        elif outcome['returncode'] != 0:
+            logging.warning("Command '%s' returned a non-zero exit status: %s", command_line, outcome['returncode'], extra=timing)
+        else:
+            logging.debug("Command executed successfully: %s", command_line, extra=timing)
+    except Exception as e:
+        outcome['error'] = str(e)
+        logging.error("Error occurred while executing command: %s. Error: %s", command_line, e)
+    finally:
+        ended = time.perf_counter_ns()
+        outcome['duration'] = (ended - started) / 1e9
+        outcome['stdout'] = '\n'.join(output['stdout'])
+        outcome['stderr'] = '\n'.join(output['stderr'])
+        progress.update(progress_task, completed=100)  # Mark as completed even if there's an error
+
+    if spawned is not None:
+        tracer.add('spawn', started, spawned, args={'command': command_line})
+        tracer.add('command', spawned, ended, args={'command': command_line})
+    logging.info("Command completed: %s", command_line)
+    return outcome
+
+# --- Latency Statistics ---
+# Latency distributions are kept in LatencySketch histograms instead of sample lists, so
+# memory stays bounded however long the tool runs. Buckets are spaced logarithmically
+# (the DDSketch layout, which gives the same guarantee as an HDR histogram): every value
+# in a bucket is within 'accuracy' of the value reported for it, so any quantile is off
+# by at most that fraction. Sketches with the same accuracy merge by adding bucket counts.
+SKETCH_MIN_MS = 0.001  # Smaller values (and zero) count as this
+SKETCH_MAX_MS = 1e6  # Larger values count as this; together at most ~1,040 buckets at 1% accuracy
+LATENCY_PERCENTILES = {'p50': 0.50, 'p90': 0.90, 'p95': 0.95, 'p99': 0.99, 'p999': 0.999}
+SUMMARY_PERCENTILES = ('p50', 'p90', 'p99', 'p999')
+
+class LatencySketch:
+    """
+    Mergeable latency histogram (milliseconds) that also counts lost probes and tracks
+    jitter, the mean absolute difference between consecutive samples. Merged sketches
+    add their jitter sums, leaving out the pair that straddles the two.
+    """
+    def __init__(self, accuracy=0.01):
+        self.accuracy = accuracy
+        self.log_gamma = math.log((1 + accuracy) / (1 - accuracy))
+        self.buckets = {}  # bucket index -> count
+        self.count = 0
+        self.lost = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.jitter_total = 0.0
+        self.jitter_count = 0
+        self.last = None
+
+    @classmethod
+    def from_samples(cls, samples, accuracy=0.01):
+        """Builds a sketch from samples in send order; None marks a lost probe."""
+        sketch = cls(accuracy)
+        for sample in samples:
+            sketch.add(sample)
+        return sketch
+
+    def add(self, value):
+        if value is None:
+            self.lost += 1
+            return
+        index = math.ceil(math.log(min(max(value, SKETCH_MIN_MS), SKETCH_MAX_MS)) / self.log_gamma)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        if self.last is not None:
+            self.jitter_total += abs(value - self.last)
+            self.jitter_count += 1
+        self.last = value
+
+    def merge(self, other):
+        if other.accuracy != self.accuracy:
+            raise ValueError(f"cannot merge sketches of accuracy {other.accuracy} and {self.accuracy}")
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += other.count
+        self.lost += other.lost
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.jitter_total += other.jitter_total
+        self.jitter_count += other.jitter_count
+        self.last = other.last if other.last is not None else self.last
+        return self
+
+    def quantiles(self, fractions):
+        """Nearest-rank quantiles for ascending fractions, clamped to the exact min and max."""
+        if not self.count:
+            return [None] * len(fractions)
+        values, seen = [], 0
+        pending = iter(fractions)
+        fraction = next(pending, None)
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            while fraction is not None and seen >= max(1, math.ceil(fraction * self.count)):
+                values.append(min(max(self.bucket_value(index), self.min), self.max))
+                fraction = next(pending, None)
+        return values
+
+    def bucket_value(self, index):
+        """The bucket covers (gamma^(index-1), gamma^index]; this point is within accuracy of both ends."""
+        return 2 * math.exp(index * self.log_gamma) / (1 + math.exp(self.log_gamma))
+
+    def with_accuracy(self, accuracy):
+        """This sketch, or a copy re-bucketed at another accuracy (adding the two errors)."""
+        if accuracy == self.accuracy:
+            return self
+        converted = LatencySketch(accuracy)
+        for index, count in self.buckets.items():
+            converted_index = math.ceil(math.log(self.bucket_value(index)) / converted.log_gamma)
+            converted.buckets[converted_index] = converted.buckets.get(converted_index, 0) + count
+        for field in ('count', 'lost', 'total', 'min', 'max', 'jitter_total', 'jitter_count', 'last'):
+            setattr(converted, field, getattr(self, field))
+        return converted
+
+    def percentiles(self, names=SUMMARY_PERCENTILES):
+        values = self.quantiles([LATENCY_PERCENTILES[name] for name in names])
+        return {name: round(value, 3) if value is not None else None for name, value in zip(names, values)}
+
+    def summary(self, names=SUMMARY_PERCENTILES):
+        """The fields of summarize_rtts plus the named percentiles."""
+        sent = self.count + self.lost
+        summary = {'sent': sent, 'received': self.count,
+                   'loss': round(100.0 * self.lost / sent, 1) if sent else 0.0,
+                   'min': None, 'avg': None, 'max': None, 'jitter': None}
+        if self.count:
+            summary.update({'min': round(self.min, 3), 'avg': round(self.total / self.count, 3),
+                            'max': round(self.max, 3),
+                            'jitter': round(self.jitter_total / self.jitter_count, 3) if self.jitter_count else 0.0})
+        return {**summary, **self.percentiles(names)}
+
+    def to_dict(self):
+        return {'accuracy': self.accuracy, 'buckets': sorted(self.buckets.items()), 'count': self.count,
+                'lost': self.lost, 'total': self.total, 'min': self.min if self.count else None,
+                'max': self.max if self.count else None, 'jitter_total': self.jitter_total,
+                'jitter_count': self.jitter_count}
+
+    @classmethod
+    def from_dict(cls, stored):
+        sketch = cls(stored['accuracy'])
+        sketch.buckets = {int(index): int(count) for index, count in stored['buckets']}
+        sketch.count, sketch.lost, sketch.total = int(stored['count']), int(stored['lost']), float(stored['total'])
+        if sketch.count:
+            sketch.min, sketch.max = float(stored['min']), float(stored['max'])
+        sketch.jitter_total, sketch.jitter_count = float(stored['jitter_total']), int(stored['jitter_count'])
+        return sketch
+
+class Ewma:
+    """Exponentially weighted moving average whose weight decays with time, not sample count."""
+    def __init__(self, half_life):
+        self.half_life = half_life
+        self.value = None
+        self.updated_at = None
+
+    def update(self, sample, now):
+        if sample is None:
+            return
+        if self.value is None:
+            self.value = sample
+        else:
+            weight = 1 - 0.5 ** (max(0.0, now - self.updated_at) / self.half_life)
+            self.value += weight * (sample - self.value)
+        self.updated_at = now
+
+class RollingLatencyWindow:
+    """
+    The last 'seconds' of samples as a ring of per-slot sketches, so old samples drop out
+    a slot at a time and memory never grows past 'slots' sketches.
+    """
+    def __init__(self, seconds, slots=12, accuracy=0.01):
+        self.seconds = seconds
+        self.slot_seconds = seconds / slots
+        self.slots = slots
+        self.accuracy = accuracy
+        self.sketches = {}  # slot number -> sketch
+
+    def add(self, sketch, now):
+        slot = int(now // self.slot_seconds)
+        self.sketches.setdefault(slot, LatencySketch(self.accuracy)).merge(sketch)
+        for old in [old for old in self.sketches if old <= slot - self.slots]:
+            del self.sketches[old]
+
+    def merged(self, now):
+        oldest = int(now // self.slot_seconds) - self.slots
+        window = LatencySketch(self.accuracy)
+        for slot, sketch in self.sketches.items():
+            if slot > oldest:
+                window.merge(sketch)
+        return window
+
+class LatencyStatistics:
+    """
+    Long-running latency statistics per series (a test and a target), fed one sketch per
+    run: an all-time sketch, the rolling windows from 'statistics_settings' and EWMAs of
+    the average RTT and the loss. Series are saved to a JSON file after each pass when
+    persistence is on, so windows and history continue across restarts.
+    """
+    def __init__(self):
+        self.enabled = True
+        self.accuracy = 0.01
+        self.windows = {}
+        self.slots = 12
+        self.half_life = 300.0
+        self.path = None
+        self._series = {}
+        self._loaded_path = None
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    def configure(self, statistics_settings):
+        self.enabled = statistics_settings.get('enabled', True)
+        self.accuracy = float(statistics_settings.get('accuracy', 0.01))
+        self.windows = {name: float(seconds) for name, seconds in
+                        statistics_settings.get('windows', {'5m': 300, '1h': 3600, '1d': 86400}).items()}
+        self.slots = max(1, int(statistics_settings.get('slots', 12)))
+        self.half_life = float(statistics_settings.get('ewma_half_life', 300))
+        persist = statistics_settings.get('persist', True)
+        self.path = Path(__file__).parent / statistics_settings.get('path', 'Results/latency_statistics.json') if persist else None
+
+    def _new_series(self):
+        return {'all': LatencySketch(self.accuracy),
+                'windows': {name: RollingLatencyWindow(seconds, self.slots, self.accuracy)
+                            for name, seconds in self.windows.items()},
+                'ewma': {'rtt_ms': Ewma(self.half_life), 'loss_pct': Ewma(self.half_life)}}
+
+    def _series_for(self, key):
+        """Returns the series for key, creating it or reshaping its windows if the settings changed."""
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = self._new_series()
+        elif series['all'].accuracy != self.accuracy:
+            logging.info("Latency accuracy changed; restarting the statistics for %s", key)
+            series = self._series[key] = self._new_series()
+        for name in ('rtt_ms', 'loss_pct'):
+            series['ewma'].setdefault(name, Ewma(self.half_life))
+        windows = series['windows']
+        for name, seconds in self.windows.items():
+            if name not in windows or windows[name].seconds != seconds or windows[name].slots != self.slots:
+                windows[name] = RollingLatencyWindow(seconds, self.slots, self.accuracy)
+        for name in [name for name in windows if name not in self.windows]:
+            del windows[name]
+        return series
+
+    def _load(self):
+        if self.path is None or self._loaded_path == self.path:
+            return
+        self._loaded_path = self.path
+        try:
+            with open(self.path, 'r') as file:
+                stored = json.load(file)
+            for key, data in stored.items():
+                if key in self._series:
+                    continue
+                series = {'all': LatencySketch.from_dict(data['all']), 'windows': {}, 'ewma': {}}
+                for name, window in data['windows'].items():
+                    rolling = RollingLatencyWindow(window['seconds'], window['slots'], series['all'].accuracy)
+                    rolling.sketches = {int(slot): LatencySketch.from_dict(sketch) for slot, sketch in window['sketches']}
+                    series['windows'][name] = rolling
+                for name, average in data['ewma'].items():
+                    series['ewma'][name] = Ewma(self.half_life)
+                    series['ewma'][name].value, series['ewma'][name].updated_at = average
+                self._series[key] = series
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, TypeError, KeyError, AttributeError) as e:
+            logging.warning("Ignoring unreadable latency statistics %s: %s", self.path, e)
+
+    def merge(self, test, name, sketch, now=None):
+        """Folds one run's sketch into the series for the test and target."""
+        if not self.enabled or deadline_cancelled():
+            return
+        now = time.time() if now is None else now
+        sketch = sketch.with_accuracy(self.accuracy)
+        with self._lock:
+            self._load()
+            series = self._series_for(f"{test}: {name}")
+            series['all'].merge(sketch)
+            for window in series['windows'].values():
+                window.add(sketch, now)
+            if sketch.count:
+                series['ewma']['rtt_ms'].update(sketch.total / sketch.count, now)
+            if sketch.count or sketch.lost:
+                series['ewma']['loss_pct'].update(100.0 * sketch.lost / (sketch.count + sketch.lost), now)
+            self._dirty = True
+
+    def report(self, test, name, now=None):
+        """Summaries of the series for every window and all time, and the EWMAs; None when there is none."""
+        if not self.enabled:
+            return None
+        now = time.time() if now is None else now
+        with self._lock:
+            self._load()
+            series = self._series.get(f"{test}: {name}")
+            if series is None:
+                return None
+            return {'windows': {window_name: window.merged(now).summary() for window_name, window in series['windows'].items()},
+                    'all': series['all'].summary(),
+                    'ewma': {average_name: round(average.value, 3) if average.value is not None else None
+                             for average_name, average in series['ewma'].items()}}
+
+    def save(self):
+        """Writes every series to the statistics file if any changed since the last save."""
+        with self._lock:
+            if not self._dirty or self.path is None:
+                return
+            stored = {key: {'all': series['all'].to_dict(),
+                            'windows': {name: {'seconds': window.seconds, 'slots': window.slots,
+                                               'sketches': [(slot, sketch.to_dict()) for slot, sketch in window.sketches.items()]}
+                                        for name, window in series['windows'].items()},
+                            'ewma': {name: [average.value, average.updated_at] for name, average in series['ewma'].items()}}
+                      for key, series in self._series.items()}
+            self._dirty = False
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            write_json_atomically(self.path, stored)
+        except (OSError, TypeError) as e:
+            logging.error("Error saving the latency statistics: %s", e)
+
+latency_statistics = LatencyStatistics()
+
+def latency_report(test, names):
+    """The 'Statistics' field of a result: the long-running statistics of each named series that has any."""
+    reports = {name: latency_statistics.report(test, name) for name in names}
+    return {name: report for name, report in reports.items() if report is not None}
+
+# --- Probe Engine ---
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+ICMPV6_ECHO_REQUEST = 128
+ICMPV6_ECHO_REPLY = 129
+PROBE_METHODS = ('auto', 'icmp', 'tcp', 'udp')
+icmp_datagram_support = {}
+
+def icmp_checksum(data):
+    """Internet checksum (RFC 1071) of the given bytes."""
+    if len(data) % 2:
+        data += b'\x00'
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+def build_icmp_echo(sequence, family=socket.AF_INET, identifier=0, payload=b'network-diagnostics'):
+    """
+    Builds an ICMP (or ICMPv6) echo request. On datagram ICMP sockets the kernel replaces
+    the identifier with the socket's own and, for ICMPv6, fills in the checksum.
+    """
+    icmp_type = ICMPV6_ECHO_REQUEST if family == socket.AF_INET6 else ICMP_ECHO_REQUEST
+    header = struct.pack("!BBHHH", icmp_type, 0, 0, identifier, sequence)
+    if family == socket.AF_INET6:
+        return header + payload
+    checksum = icmp_checksum(header + payload)
+    return struct.pack("!BBHHH", icmp_type, 0, checksum, identifier, sequence) + payload
+
+def parse_icmp_echo_reply(packet, family=socket.AF_INET):
+    """Returns the sequence number of an echo reply, or None if the packet is anything else."""
+    if family == socket.AF_INET and len(packet) >= 20 and packet[0] >> 4 == 4:
+        packet = packet[(packet[0] & 0x0F) * 4:]  # Some platforms deliver the IP header too
+    if len(packet) < 8:
+        return None
+    icmp_type, _, _, _, sequence = struct.unpack("!BBHHH", packet[:8])
+    expected = ICMPV6_ECHO_REPLY if family == socket.AF_INET6 else ICMP_ECHO_REPLY
+    return sequence if icmp_type == expected else None
+
+def icmp_datagram_available(family=socket.AF_INET):
+    """Checks once per address family whether unprivileged ICMP datagram sockets are allowed."""
+    if family not in icmp_datagram_support:
+        protocol = socket.IPPROTO_ICMPV6 if family == socket.AF_INET6 else socket.IPPROTO_ICMP
+        try:
+            socket.socket(family, socket.SOCK_DGRAM, protocol).close()
+            icmp_datagram_support[family] = True
+        except OSError:
+            icmp_datagram_support[family] = False
+        logging.debug("ICMP datagram sockets available for %r: %s", family, icmp_datagram_support[family])
+    return icmp_datagram_support[family]
+
+def parse_probe_target(target, default_port):
+    """
+    Splits 'host', 'host:port', '[v6addr]' or '[v6addr]:port' into (host, port).
+    Raises ValueError when the port is not a number from 0 to 65535.
+    """
+    target = target.strip()
+    if target.startswith('['):
+        host, _, rest = target[1:].partition(']')
+        port = rest[1:] if rest.startswith(':') else default_port
+    elif target.count(':') == 1:
+        host, port = target.split(':')
+    else:
+        host, port = target, default_port
+    if not str(port).isdigit() or int(port) > 65535:
+        raise ValueError(f"invalid port '{port}' in target '{target}'")
+    return host, int(port)
+
+def summarize_rtts(sent, rtts):
+    """
+    Summarizes RTT samples (milliseconds, in send order) into min/avg/max, jitter and loss.
+    Jitter is the mean absolute difference between consecutive samples.
+    """
+    received = len(rtts)
+    summary = {'sent': sent, 'received': received,
+               'loss': round(100.0 * (sent - received) / sent, 1) if sent else 0.0,
+               'min': None, 'avg': None, 'max': None, 'jitter': None}
+    if rtts:
+        summary['min'] = round(min(rtts), 3)
+        summary['avg'] = round(sum(rtts) / received, 3)
+        summary['max'] = round(max(rtts), 3)
+        summary['jitter'] = round(sum(abs(b - a) for a, b in zip(rtts, rtts[1:])) / (received - 1), 3) if received > 1 else 0.0
+    return summary
+
+async def icmp_probe_target(address, family, count, interval, timeout, on_probe):
+    """
+    Sends count echo requests from one ICMP datagram socket.
+    :return: (RTTs in ms, None for lost probes; the OSError that stopped the socket
+             receiving, or None). Once receiving fails, the remaining probes count as
+             lost straight away instead of each waiting for its timeout.
+    """
+    loop = asyncio.get_running_loop()
+    protocol = socket.IPPROTO_ICMPV6 if family == socket.AF_INET6 else socket.IPPROTO_ICMP
+    sock = socket.socket(family, socket.SOCK_DGRAM, protocol)
+    sock.setblocking(False)
+    waiting = {}
+    receive_errors = []
+
+    async def receive_replies():
+        try:
+            while True:
+                packet = await loop.sock_recv(sock, 2048)
+                received_at = time.perf_counter()
+                sequence = parse_icmp_echo_reply(packet, family)
+                if sequence in waiting and not waiting[sequence].done():
+                    waiting[sequence].set_result(received_at)
+        except OSError as e:
+            logging.error("Receiving ICMP replies from %s failed: %s", address[0], e)
+            receive_errors.append(e)
+            for reply in waiting.values():
+                if not reply.done():
+                    reply.set_exception(e)
+
+    async def send_probe(sequence):
+        if receive_errors:
+            on_probe()
+            return None
+        waiting[sequence] = loop.create_future()
+        sent_at = time.perf_counter()
+        try:
+            await loop.sock_sendto(sock, build_icmp_echo(sequence, family), address)
+            return (await asyncio.wait_for(waiting[sequence], timeout) - sent_at) * 1000
+        except (asyncio.TimeoutError, OSError):
+            return None
+        finally:
+            on_probe()
+
+    receiver = asyncio.ensure_future(receive_replies())
+    try:
+        probes = []
+        for sequence in range(1, count + 1):
+            probes.append(asyncio.ensure_future(send_probe(sequence)))
+            if sequence < count:
+                await asyncio.sleep(interval)
+        return await asyncio.gather(*probes), (receive_errors[0] if receive_errors else None)
+    finally:
+        receiver.cancel()
+        sock.close()
+
+def classify_socket_error(error):
+    """Maps a probe failure to a coarse error class for reports."""
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError)):
+        return 'timeout'
+    if isinstance(error, ConnectionRefusedError):
+        return 'refused'
+    if isinstance(error, socket.gaierror):
+        return 'dns'
+    if isinstance(error, OSError) and error.errno in (errno.EHOSTUNREACH, errno.ENETUNREACH, errno.EHOSTDOWN):
+        return 'unreachable'
+    return 'error'
+
+async def tcp_connect_probe(address, family, timeout):
+    """
+    One TCP handshake.
+    :return: (RTT in ms or None, outcome). A refused connection still proves the host
+             answered, so it carries an RTT with outcome 'refused'.
+    """
+    loop = asyncio.get_running_loop()
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setblocking(False)
+    sent_at = time.perf_counter()
+    try:
+        await asyncio.wait_for(loop.sock_connect(sock, address), timeout)
+        outcome = 'ok'
+    except ConnectionRefusedError:
+        outcome = 'refused'
+    except (asyncio.TimeoutError, OSError) as e:
+        return None, classify_socket_error(e)
+    finally:
+        sock.close()
+    return (time.perf_counter() - sent_at) * 1000, outcome
+
+async def udp_probe(address, family, timeout):
+    """
+    One UDP datagram.
+    :return: (RTT in ms or None, outcome). Either a reply ('ok') or an ICMP
+             port-unreachable ('refused') counts as an answer.
+    """
+    loop = asyncio.get_running_loop()
+    sock = socket.socket(family, socket.SOCK_DGRAM)
+    sock.setblocking(False)
+    try:
+        sock.connect(address)
+        sent_at = time.perf_counter()
+        await loop.sock_sendall(sock, b'network-diagnostics')
+        try:
+            await asyncio.wait_for(loop.sock_recv(sock, 2048), timeout)
+            outcome = 'ok'
+        except ConnectionRefusedError:
+            outcome = 'refused'
+        return (time.perf_counter() - sent_at) * 1000, outcome
+    except (asyncio.TimeoutError, OSError) as e:
+        return None, classify_socket_error(e)
+    finally:
+        sock.close()
+
+async def resolve_address(host, port, use_cache=False):
+    """
+    Returns (family, socket address) for a host. Literal IPv4/IPv6 addresses are parsed
+    directly instead of going through getaddrinfo, which runs in a thread pool.
+    :param use_cache: Reuse and store the answer in the result cache under the 'dns' tag,
+                      so a DNS Flush or a resolver change discards it.
+    """
+    for family in (socket.AF_INET, socket.AF_INET6):
+        try:
+            socket.inet_pton(family, host)
+            return family, (host, port) if family == socket.AF_INET else (host, port, 0, 0)
+        except OSError:
+            continue
+    key = f"resolve {host} {port}"
+    if use_cache:
+        entry = result_cache.get(key)
+        if entry is not None:
+            family, address = entry['value']
+            return family, tuple(address)
+    loop = asyncio.get_running_loop()
+    family, _, _, _, address = (await loop.getaddrinfo(host, port, type=socket.SOCK_DGRAM))[0]
+    if use_cache:
+        result_cache.put(key, [family, list(address)], result_cache.ttl('dns'), tags=('dns', 'interface'))
+    return family, address
+
+async def probe_target(target, count, interval, timeout, method, port, socket_limit, on_probe, on_sketch):
+    try:
+        host, port = parse_probe_target(target, port)
+        family, address = await resolve_address(host, port, use_cache=True)
+    except (OSError, ValueError) as e:
+        for _ in range(count):
+            on_probe()
+        sketch = LatencySketch.from_samples([None] * count)
+        on_sketch(target, sketch)
+        return {**sketch.summary(), 'method': method, 'error': str(e)}
+
+    if method == 'auto':
+        method = 'icmp' if icmp_datagram_available(family) else 'tcp'
+
+    error = None
+    async with socket_limit:
+        if method == 'icmp':
+            samples, error = await icmp_probe_target(address, family, count, interval, timeout, on_probe)
+        else:
+            probe = tcp_connect_probe if method == 'tcp' else udp_probe
+
+            async def timed_probe():
+                try:
+                    rtt, _ = await probe(address, family, timeout)
+                    return rtt
+                finally:
+                    on_probe()
+
+            pending = []
+            for sequence in range(count):
+                pending.append(asyncio.ensure_future(timed_probe()))
+                if sequence < count - 1:
+                    await asyncio.sleep(interval)
+            samples = await asyncio.gather(*pending)
+
+    sketch = LatencySketch.from_samples(samples)
+    on_sketch(target, sketch)
+    summary = {**sketch.summary(), 'method': method, 'address': address[0]}
+    if error is not None:
+        summary['error'] = str(error)
+    return summary
+
+async def probe_targets(targets, count=4, interval=0.2, timeout=1.0, method='auto', port=443,
+                        max_concurrent_targets=256, on_probe=None, on_sketch=None):
+    """
+    Probes every target concurrently from one event loop.
+    :param targets: Hosts as 'host', 'host:port' or '[v6addr]:port'.
+    :param count: Probes sent to each target.
+    :param interval: Seconds between probes to the same target.
+    :param timeout: Seconds to wait for each answer before counting it as lost.
+    :param method: 'icmp', 'tcp', 'udp', or 'auto' (ICMP datagram sockets when allowed, else TCP).
+    :param port: Port used by the TCP and UDP methods when the target does not name one.
+    :param max_concurrent_targets: Upper bound on targets being probed at the same moment.
+    :param on_probe: Optional callback invoked once per finished probe.
+    :param on_sketch: Optional callback invoked with (target, LatencySketch) once a target is done.
+    :return: Dictionary mapping each target to its RTT summary and percentiles (milliseconds) and loss (%).
+    """
+    if method not in PROBE_METHODS:
+        raise ValueError(f"Unknown probe method: {method}")
+    socket_limit = asyncio.Semaphore(max_concurrent_targets)
+    on_probe = on_probe or (lambda: None)
+    on_sketch = on_sketch or (lambda target, sketch: None)
+    summaries = await asyncio.gather(*(probe_target(target, count, interval, timeout, method, port, socket_limit,
+                                                    on_probe, on_sketch)
+                                       for target in targets))
+    return dict(zip(targets, summaries))
+
+# --- Traceroute Engine ---
+# Linux reports ICMP errors for a UDP socket through its error queue when IP_RECVERR is
+# set, which gives unprivileged access to time-exceeded replies from every hop.
+IP_RECVERR = getattr(socket, 'IP_RECVERR', 11)
+IPV6_RECVERR = getattr(socket, 'IPV6_RECVERR', 25)
+MSG_ERRQUEUE = getattr(socket, 'MSG_ERRQUEUE', 0x2000)
+SO_EE_ORIGIN_ICMP = 2
+SO_EE_ORIGIN_ICMP6 = 3
+TRACE_PROBE = struct.Struct("!HH")  # ttl, round; echoed back to us inside the error queue message
+
+def native_traceroute_available():
+    return sys.platform.startswith('linux')
+
+def parse_extended_error(ancdata, family):
+    """
+    Decodes the sock_extended_err control message of an error-queue read.
+    :return: (responder address, whether the error ends the trace) or None for unrelated errors.
+             Time-exceeded replies come from intermediate hops; any destination-unreachable
+             reply (port unreachable from the target, or !H/!N/!X from a router) is final.
+    """
+    for level, kind, data in ancdata:
+        if (level, kind) not in ((socket.IPPROTO_IP, IP_RECVERR), (socket.IPPROTO_IPV6, IPV6_RECVERR)):
+            continue
+        _, origin, icmp_type, icmp_code, _, _, _ = struct.unpack("=IBBBBII", data[:16])
+        offender = data[16:]
+        if origin == SO_EE_ORIGIN_ICMP and len(offender) >= 8:
+            responder = socket.inet_ntop(socket.AF_INET, offender[4:8])
+            return responder, icmp_type == 3
+        if origin == SO_EE_ORIGIN_ICMP6 and len(offender) >= 24:
+            responder = socket.inet_ntop(socket.AF_INET6, offender[8:24])
+            return responder, icmp_type == 1
+    return None
+
+def open_recverr_transport(address, family, on_response):
+    """
+    Opens one connected UDP socket for a whole trace, keeping the flow identifiers constant
+    across TTLs (as paris-traceroute does) so load balancers keep probes on one path.
+    :param on_response: Called as on_response(ttl, round, responder, final, received_at).
+    :return: (send(ttl, round), close()) functions.
+    """
+    loop = asyncio.get_running_loop()
+    sock = socket.socket(family, socket.SOCK_DGRAM)
+    sock.setblocking(False)
+    if family == socket.AF_INET6:
+        sock.setsockopt(socket.IPPROTO_IPV6, IPV6_RECVERR, 1)
+    else:
+        sock.setsockopt(socket.IPPROTO_IP, IP_RECVERR, 1)
+    sock.connect(address)
+
+    def drain_error_queue():
+        while True:
+            try:
+                data, ancdata, _, _ = sock.recvmsg(512, 512, MSG_ERRQUEUE)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                continue
+            received_at = time.perf_counter()
+            decoded = parse_extended_error(ancdata, family)
+            if decoded and len(data) >= TRACE_PROBE.size:
+                ttl, probe_round = TRACE_PROBE.unpack(data[:TRACE_PROBE.size])
+                on_response(ttl, probe_round, decoded[0], decoded[1], received_at)
+
+    def send(ttl, probe_round):
+        if family == socket.AF_INET6:
+            sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_UNICAST_HOPS, ttl)
+        else:
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_TTL, ttl)
+        try:
+            sock.send(TRACE_PROBE.pack(ttl, probe_round))
+        except OSError:
+            pass  # An earlier ICMP error can surface on send; it is still read from the queue
+
+    def close():
+        loop.remove_reader(sock.fileno())
+        sock.close()
+
+    loop.add_reader(sock.fileno(), drain_error_queue)
+    return send, close
+
+async def trace_route(target, max_hops=30, probes_per_hop=3, timeout=1.0, interval=0.05, port=33434,
+                      open_transport=None, on_hop=None):
+    """
+    Traces the path to a target with probes for every TTL in flight at the same time.
+    :param target: Host name or address.
+    :param max_hops: Highest TTL probed.
+    :param probes_per_hop: Probe rounds; each round covers every TTL up to the destination.
+    :param timeout: Seconds to wait for an answer to the last probe sent.
+    :param interval: Seconds between probe rounds.
+    :param port: Destination UDP port.
+    :param open_transport: Factory with the signature of open_recverr_transport, which is
+                           used when none is given.
+    :param on_hop: Optional callback invoked as on_hop(ttl) for every answered probe.
+    :return: Dictionary with 'destination', 'reached' and a 'hops' list; each hop has its
+             'ttl', responding 'address', 'rtts' (ms) and the RTT summary with 'loss' (%).
+    """
+    loop = asyncio.get_running_loop()
+    family, _, _, _, address = (await loop.getaddrinfo(target, port, type=socket.SOCK_DGRAM))[0]
+    sent_at = {}
+    answers = {}
+    state = {'final_ttl': None, 'reached': False}
+    all_answered = asyncio.Event()
+
+    def outstanding():
+        limit = state['final_ttl'] or max_hops
+        return [key for key in sent_at if key[0] <= limit and key not in answers]
+
+    def on_response(ttl, probe_round, responder, final, received_at):
+        key = (ttl, probe_round)
+        if key not in sent_at or key in answers:
+            return
+        answers[key] = (responder, (received_at - sent_at[key]) * 1000)
+        if final and (state['final_ttl'] is None or ttl < state['final_ttl']):
+            state['final_ttl'] = ttl
+            state['reached'] = responder == address[0]
+        if on_hop:
+            on_hop(ttl)
+        if state['final_ttl'] and not outstanding():
+            all_answered.set()
+
+    send, close = (open_transport or open_recverr_transport)(address, family, on_response)
+    try:
+        for probe_round in range(probes_per_hop):
+            for ttl in range(1, (state['final_ttl'] or max_hops) + 1):
+                sent_at[(ttl, probe_round)] = time.perf_counter()
+                send(ttl, probe_round)
+            if probe_round < probes_per_hop - 1:
+                await asyncio.sleep(interval)
+        if outstanding():
+            all_answered.clear()
+            try:
+                await asyncio.wait_for(all_answered.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        close()
+
+    answered_ttls = [ttl for ttl, _ in answers]
+    last_ttl = state['final_ttl'] or (max(answered_ttls) if answered_ttls else 0)
+    hops = []
+    for ttl in range(1, last_ttl + 1):
+        replies = [answers[key] for key in sorted(sent_at) if key[0] == ttl and key in answers]
+        sent = sum(1 for key in sent_at if key[0] == ttl)
+        responders = [responder for responder, _ in replies]
+        hops.append({'ttl': ttl,
+                     'address': max(set(responders), key=responders.count) if responders else None,
+                     'rtts': [round(rtt, 3) for _, rtt in replies],
+                     **summarize_rtts(sent, [rtt for _, rtt in replies])})
+    return {'destination': address[0], 'reached': state['reached'], 'hops': hops}
+
+def parse_tracert_line(line):
+    """Parses one hop line of Windows 'tracert -d' output; returns None for any other line."""
+    fields = line.split()
+    if not fields or not fields[0].isdigit():
+        return None
+    rtts = [float(value.lstrip('<')) for value, unit in zip(fields[1:], fields[2:]) if unit == 'ms']
+    address = fields[-1] if fields[-1][0].isdigit() or ':' in fields[-1] else None
+    probes = sum(1 for value in fields[1:] if value == '*') + len(rtts)
+    return {'ttl': int(fields[0]), 'address': address, 'rtts': rtts, **summarize_rtts(probes, rtts)}
+
+def parse_tracert_output(output):
+    """Extracts hops from Windows 'tracert -d' output for platforms without the native engine."""
+    return [hop for hop in map(parse_tracert_line, output.splitlines()) if hop is not None]
+
+# --- DNS Benchmark Engine ---
+DNS_RECORD_TYPES = {'A': 1, 'NS': 2, 'CNAME': 5, 'MX': 15, 'TXT': 16, 'AAAA': 28}
+DNS_HEADER = struct.Struct("!HHHHHH")
+
+def build_dns_query(query_id, name, record_type='A'):
+    """Builds a recursive DNS query for one name and record type."""
+    question = b''.join(bytes([len(label)]) + label.encode('idna') for label in name.rstrip('.').split('.'))
+    return (DNS_HEADER.pack(query_id, 0x0100, 1, 0, 0, 0) + question + b'\x00'
+            + struct.pack("!HH", DNS_RECORD_TYPES[record_type], 1))
+
+def parse_dns_header(packet):
+    """Returns (query id, response code, answer count) of a DNS response, or None if it is not one."""
+    if len(packet) < DNS_HEADER.size:
+        return None
+    query_id, flags, _, answers, _, _ = DNS_HEADER.unpack(packet[:DNS_HEADER.size])
+    if not flags & 0x8000:
+        return None
+    return query_id, flags & 0x000F, answers
+
+def system_resolvers():
+    """Name servers from /etc/resolv.conf, when the platform has one."""
+    return read_resolver_config()['nameservers']
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+def summarize_latencies(latencies):
+    ordered = sorted(latencies)
+    return {'count': len(ordered),
+            'p50': round(percentile(ordered, 0.50), 3) if ordered else None,
+            'p95': round(percentile(ordered, 0.95), 3) if ordered else None,
+            'p99': round(percentile(ordered, 0.99), 3) if ordered else None}
+
+def summarize_sketch(sketch):
+    """summarize_latencies for a LatencySketch, whose percentiles are within its accuracy."""
+    return {'count': sketch.count, **sketch.percentiles(('p50', 'p95', 'p99'))}
+
+async def benchmark_resolver(resolver, queries, timeout=2.0, max_outstanding=256, port=53, on_query=None,
+                             on_sketch=None):
+    """
+    Sends a batch of DNS queries to one resolver over a single UDP socket, keeping up to
+    max_outstanding queries in flight and matching replies by query id.
+    :param queries: Iterable of (name, record type, phase) tuples; phase labels the sample
+                    (for example 'cold' for the first query of a name and 'warm' for repeats).
+    :param on_sketch: Optional callback invoked with the LatencySketch of every query
+                      (timeouts count as lost) when the batch is done.
+    :return: Dictionary with counts, overall and per-phase latency percentiles (ms) and
+             the achieved queries per second.
+    """
+    loop = asyncio.get_running_loop()
+    family, _, _, _, address = (await loop.getaddrinfo(resolver, port, type=socket.SOCK_DGRAM))[0]
+    sock = socket.socket(family, socket.SOCK_DGRAM)
+    sock.setblocking(False)
+    sock.connect(address)
+    in_flight = {}
+    slots = asyncio.Semaphore(max_outstanding)
+    latencies = {}  # phase -> LatencySketch
+    counts = {'queries': 0, 'answered': 0, 'timeouts': 0, 'errors': 0}
+
+    def finish(query_id, outcome, received_at=None):
+        entry = in_flight.pop(query_id, None)
+        if entry is None:
+            return
+        sent_at, phase, timer, done = entry
+        timer.cancel()
+        if outcome == 'answered':
+            latencies.setdefault(phase, LatencySketch()).add((received_at - sent_at) * 1000)
+        counts[outcome] += 1
+        slots.release()
+        if on_query:
+            on_query()
+        if not in_flight:
+            done.set()
+
+    def read_responses():
+        while True:
+            try:
+                packet = sock.recv(4096)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                continue  # ICMP errors surface here; the query will time out
+            received_at = time.perf_counter()
+            header = parse_dns_header(packet)
+            if header and header[0] in in_flight:
+                finish(header[0], 'answered' if header[1] in (0, 3) else 'errors', received_at)
+
+    all_done = asyncio.Event()
+    loop.add_reader(sock.fileno(), read_responses)
+    started = time.perf_counter()
+    try:
+        query_id = 0
+        for name, record_type, phase in queries:
+            await slots.acquire()
+            query_id = (query_id + 1) & 0xFFFF
+            while query_id in in_flight or query_id == 0:
+                query_id = (query_id + 1) & 0xFFFF
+            all_done.clear()
+            timer = loop.call_later(timeout, finish, query_id, 'timeouts')
+            in_flight[query_id] = (time.perf_counter(), phase, timer, all_done)
+            counts['queries'] += 1
+            try:
+                sock.send(build_dns_query(query_id, name, record_type))
+            except OSError:
+                finish(query_id, 'errors')
+        if in_flight:
+            await all_done.wait()
+    finally:
+        loop.remove_reader(sock.fileno())
+        sock.close()
+
+    elapsed = time.perf_counter() - started
+    overall = LatencySketch()
+    for sketch in latencies.values():
+        overall.merge(sketch)
+    overall.lost = counts['timeouts']
+    if on_sketch:
+        on_sketch(overall)
+    summary = {**counts, **summarize_sketch(overall), 'qps': round(counts['queries'] / elapsed, 1) if elapsed else None}
+    for phase, sketch in latencies.items():
+        summary[phase] = summarize_sketch(sketch)
+    return summary
+
+async def time_system_lookups(names):
+    """
+    Resolves each name twice through the operating system resolver. Run right after a DNS
+    flush, the first lookup shows the uncached cost and the second the cached one (ms).
+    """
+    loop = asyncio.get_running_loop()
+    timings = {}
+    for name in names:
+        samples = []
+        for _ in range(2):
+            start_time = time.perf_counter()
+            try:
+                await loop.getaddrinfo(name, None)
+                samples.append(round((time.perf_counter() - start_time) * 1000, 3))
+            except OSError:
+                samples.append(None)
+        timings[name] = {'uncached': samples[0], 'cached': samples[1]}
+    return timings
+
+async def benchmark_dns(resolvers, names, record_types=('A', 'AAAA'), rounds=3, timeout=2.0,
+                        max_outstanding=256, port=53, on_query=None, on_sketch=None):
+    """
+    Benchmarks every resolver concurrently. The first round of queries for a name is
+    labelled 'cold' (likely a resolver cache miss) and later rounds 'warm'.
+    :param resolvers: Resolver addresses; 'host:port' or '[v6addr]:port' overrides port.
+    :param on_sketch: Optional callback invoked with (resolver, LatencySketch) per resolver.
+    :return: Dictionary mapping each resolver to the summary from benchmark_resolver.
+    """
+    queries = [(name, record_type, 'cold' if round_index == 0 else 'warm')
+               for round_index in range(rounds) for name in names for record_type in record_types]
+
+    async def run_one(resolver):
+        try:
+            host, resolver_port = parse_probe_target(resolver, port)
+            return await benchmark_resolver(host, queries, timeout, max_outstanding, resolver_port, on_query,
+                                            on_sketch and (lambda sketch: on_sketch(resolver, sketch)))
+        except (OSError, ValueError) as e:
+            return {'queries': 0, 'answered': 0, 'timeouts': 0, 'errors': len(queries), 'error': str(e)}
+
+    summaries = await asyncio.gather(*(run_one(resolver) for resolver in resolvers))
+    return dict(zip(resolvers, summaries))
+
+# --- Target Sweep ---
+SWEEP_PROTOCOLS = ('tcp', 'udp', 'icmp')
+
+def parse_sweep_targets(lines, default_port=443, default_protocol='tcp'):
+    """
+    Parses a target list. Each line is 'host', 'host:port', '[v6addr]:port', optionally
+    followed by '/tcp', '/udp' or '/icmp', or a CSV row 'host,port,protocol'. Blank lines
+    and '#' comments are skipped.
+    :return: List of (host, port, protocol) tuples.
+    """
+    targets = []
+    for line_number, line in enumerate(lines, start=1):
+        line = line.split('#', 1)[0].strip()
+        if not line:
+            continue
+        if ',' in line:
+            fields = [field.strip() for field in line.split(',')]
+            host = fields[0]
+            port = int(fields[1]) if len(fields) > 1 and fields[1] else default_port
+            protocol = fields[2].lower() if len(fields) > 2 and fields[2] else default_protocol
+        else:
+            endpoint, _, protocol = line.partition('/')
+            host, port = parse_probe_target(endpoint, default_port)
+            protocol = protocol.lower() or default_protocol
+        if protocol not in SWEEP_PROTOCOLS:
+            raise ValueError(f"line {line_number}: unknown protocol '{protocol}'")
+        targets.append((host, port, protocol))
+    return targets
+
+async def sweep_one(host, port, protocol, timeout, count):
+    endpoint = f"[{host}]:{port}" if ':' in host else f"{host}:{port}"
+    record = {'target': f"{endpoint}/{protocol}", 'latency_ms': None, 'error_class': 'ok'}
+    try:
+        family, address = await resolve_address(host, port)
+    except OSError as e:
+        record['error_class'] = classify_socket_error(e)
+        return record
+    if protocol == 'icmp':
+        if not icmp_datagram_available(family):
+            record['error_class'] = 'unsupported'
+            return record
+        rtts, error = await icmp_probe_target(address, family, count, 0.0, timeout, lambda: None)
+        lost_as = classify_socket_error(error) if error is not None else 'timeout'
+        samples = [(rtt, 'ok' if rtt is not None else lost_as) for rtt in rtts]
+    else:
+        probe = tcp_connect_probe if protocol == 'tcp' else udp_probe
+        samples = [await probe(address, family, timeout) for _ in range(count)]
+    rtts = [rtt for rtt, _ in samples if rtt is not None]
+    if rtts:
+        record['latency_ms'] = round(min(rtts), 3)
+    record['error_class'] = samples[-1][1] if not rtts else next(outcome for rtt, outcome in samples if rtt is not None)
+    return record
+
+def raise_file_limit():
+    """
+    Raises the soft open-file limit to the hard limit (at most 2^20 when the hard limit
+    is unlimited) where the platform allows it, leaving the hard limit as it was.
+    :return: The usable soft limit.
+    """
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        target = 1 << 20 if hard == resource.RLIM_INFINITY else hard
+        if soft == resource.RLIM_INFINITY:
+            return target
+        if soft < target:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+            soft = target
+        return soft
+    except (ImportError, ValueError, OSError):
+        return 512  # Conservative default where RLIMIT_NOFILE cannot be queried (Windows)
+
+def sweep_worker(chunk, timeout, concurrency, count):
+    """
+    Process-pool entry point: probes one share of the targets from its own event loop,
+    with at most 'concurrency' sockets open (capped below the file-descriptor limit).
+    """
+    limit = max(1, min(concurrency, raise_file_limit() - 64))
+
+    async def run_chunk():
+        slots = asyncio.Semaphore(limit)
+
+        async def bounded(target):
+            async with slots:
+                return await sweep_one(*target, timeout, count)
+
+        return await asyncio.gather(*(bounded(target) for target in chunk))
+
+    return asyncio.run(run_chunk())
+
+def run_sweep(targets, workers=0, concurrency=1000, timeout=1.0, count=1):
+    """
+    Probes every (host, port, protocol) target, splitting the list across a process pool.
+    :param workers: Worker processes; 0 uses one per CPU. With 1 the sweep runs in-process.
+    :param concurrency: Sockets open at once in each worker.
+    :return: Aggregated report with per-target latency and error class, counts per class
+             and latency percentiles across the reachable targets.
+    """
+    workers = workers or os.cpu_count() or 1
+    workers = max(1, min(workers, len(targets)))
+    start_time = time.perf_counter()
+    chunks = [targets[index::workers] for index in range(workers)]
+    if workers == 1:
+        records = sweep_worker(targets, timeout, concurrency, count)
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            chunk_records = list(pool.map(sweep_worker, chunks, [timeout] * workers,
+                                          [concurrency] * workers, [count] * workers))
+        # Restore the input order from the interleaved chunks
+        records = [None] * len(targets)
+        for index, chunk in enumerate(chunk_records):
+            records[index::workers] = chunk
+    duration = time.perf_counter() - start_time
+
+    by_class = {}
+    for record in records:
+        by_class[record['error_class']] = by_class.get(record['error_class'], 0) + 1
+    return {'targets': len(records),
+            'workers': workers,
+            'duration_s': round(duration, 3),
+            'targets_per_second': round(len(records) / duration, 1) if duration else None,
+            'by_class': by_class,
+            'latency': summarize_latencies([record['latency_ms'] for record in records if record['latency_ms'] is not None]),
+            'results': records}
+
+# --- Throughput Engine ---
+# Every stream is its own TCP connection. The client opens it with THROUGHPUT_HEADER naming
+# the direction, duration and sample interval. For a download the server sends until the
+# duration is up and closes. For an upload the client sends, then half-closes, and the
+# server replies with its per-interval byte counts. The receiving side always takes the
+# measurement, so data still sitting in socket buffers is never counted as delivered.
+THROUGHPUT_HEADER = struct.Struct("!4sB3xdd")  # magic, direction, padding, duration, interval
+THROUGHPUT_MAGIC = b'NDT1'
+THROUGHPUT_DOWNLOAD = 1
+THROUGHPUT_UPLOAD = 2
+THROUGHPUT_BLOCK_SIZE = 1 << 20
+THROUGHPUT_MAX_DURATION = 120.0
+
+throughput_payloads = {}  # block size -> {'file', 'fd', 'view'}
+
+def get_throughput_payload(block_size=THROUGHPUT_BLOCK_SIZE):
+    """
+    Returns the send buffer for a block size, created once per process. The block is random
+    so compressing links cannot inflate the result. Where os.sendfile exists the block is
+    also written to a temporary file, so sends go from the page cache to the socket
+    without passing through Python.
+    """
+    payload = throughput_payloads.get(block_size)
+    if payload is None:
+        view = memoryview(os.urandom(block_size))
+        source, fd = None, None
+        if hasattr(os, 'sendfile'):
+            import tempfile
+            source = tempfile.TemporaryFile()
+            source.write(view)
+            source.flush()
+            fd = source.fileno()
+        payload = throughput_payloads[block_size] = {'file': source, 'fd': fd, 'view': view}
+    return payload
+
+def send_block(sock, payload):
+    """Sends up to one payload block and returns the number of bytes the kernel accepted."""
+    if payload['fd'] is None:
+        return sock.send(payload['view'])
+    while True:
+        try:
+            return os.sendfile(sock.fileno(), payload['fd'], 0, len(payload['view']))
+        except BlockingIOError:
+            # Sockets with a timeout are non-blocking underneath; wait for buffer space
+            import select
+            if not select.select([], [sock], [], sock.gettimeout())[1]:
+                raise socket.timeout("timed out sending throughput data")
+
+def send_until(sock, payload, deadline):
+    sent = 0
+    while time.perf_counter() < deadline:
+        sent += send_block(sock, payload)
+    return sent
+
+def receive_samples(sock, buffer, interval, slots, started):
+    """
+    Reads into a preallocated buffer until the peer closes, adding the bytes to the
+    interval they arrived in. Bytes arriving after the last interval are read but not counted.
+    :return: array('d') of bytes received per interval.
+    """
+    samples = array('d', bytes(8 * slots))
+    while True:
+        received = sock.recv_into(buffer)
+        if not received:
+            return samples
+        slot = int((time.perf_counter() - started) / interval)
+        if slot < slots:
+            samples[slot] += received
+
+def recv_exact(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("connection closed by throughput server")
+        data += chunk
+    return bytes(data)
+
+def throughput_stream(address, family, direction, duration, interval, block_size, barrier, timeout):
+    """Runs one client stream and returns the per-interval byte counts measured by the receiver."""
+    slots = max(1, round(duration / interval))
+    with socket.socket(family, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(address)
+        barrier.wait()  # Start every stream at the same moment so the intervals line up
+        started = time.perf_counter()
+        sock.sendall(THROUGHPUT_HEADER.pack(THROUGHPUT_MAGIC, direction, slots * interval, interval))
+        if direction == THROUGHPUT_DOWNLOAD:
+            return receive_samples(sock, bytearray(block_size), interval, slots, started)
+        send_until(sock, get_throughput_payload(block_size), started + slots * interval)
+        sock.shutdown(socket.SHUT_WR)
+        count, = struct.unpack("!I", recv_exact(sock, 4))
+        return array('d', struct.unpack(f"!{count}d", recv_exact(sock, 8 * count)))
+
+def run_throughput(host, port=5201, direction='download', streams=4, duration=10.0, warmup=2.0,
+                   interval=1.0, block_size=THROUGHPUT_BLOCK_SIZE, timeout=5.0):
+    """
+    Measures throughput against a throughput server with parallel TCP streams.
+    :param direction: 'download' (server to client) or 'upload'.
+    :param warmup: Seconds at the start, while TCP ramps up, left out of the result.
+    :param interval: Length of each reported sample in seconds.
+    :return: Dictionary with 'mbps' (10^6 bits per second over the measured window), total
+             'bytes', and 'intervals_mbps' holding one sample per interval including warm-up.
+    """
+    direction_code = THROUGHPUT_DOWNLOAD if direction == 'download' else THROUGHPUT_UPLOAD
+    family, _, _, _, address = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)[0]
+    barrier = threading.Barrier(streams, timeout=timeout)
+    with ThreadPoolExecutor(max_workers=streams) as executor:
+        futures = [executor.submit(throughput_stream, address, family, direction_code, duration, interval,
+                                   block_size, barrier, timeout) for _ in range(streams)]
+        stream_samples = []
+        for future in futures:
+            try:
+                stream_samples.append(future.result())
+            except Exception:
+                barrier.abort()  # Release streams still waiting for a peer that failed to connect
+                raise
+
+    slots = max(len(samples) for samples in stream_samples)
+    totals = [sum(samples[slot] for samples in stream_samples if slot < len(samples)) for slot in range(slots)]
+    skip = min(math.ceil(warmup / interval), slots - 1)
+    measured = totals[skip:]
+    return {'direction': direction,
+            'streams': streams,
+            'bytes': int(sum(totals)),
+            'mbps': round(sum(measured) * 8 / (len(measured) * interval) / 1e6, 2),
+            'warmup_s': skip * interval,
+            'intervals_mbps': [round(total * 8 / interval / 1e6, 2) for total in totals]}
+
+def create_throughput_server(host='0.0.0.0', port=5201, block_size=THROUGHPUT_BLOCK_SIZE, timeout=10.0):
+    """
+    Creates the server side of the throughput test. The caller runs it with serve_forever(),
+    usually on a thread, and stops it with shutdown().
+    """
+    import socketserver
+
+    class ThroughputHandler(socketserver.BaseRequestHandler):
+        def handle(self):
+            sock = self.request
+            sock.settimeout(timeout)
+            try:
+                magic, direction, duration, interval = THROUGHPUT_HEADER.unpack(recv_exact(sock, THROUGHPUT_HEADER.size))
+                if magic != THROUGHPUT_MAGIC or not 0 < duration <= THROUGHPUT_MAX_DURATION or interval <= 0:
+                    logging.error("Rejected throughput request from %s", self.client_address[0])
+                    return
+                started = time.perf_counter()
+                if direction == THROUGHPUT_DOWNLOAD:
+                    send_until(sock, get_throughput_payload(block_size), started + duration)
+                    sock.shutdown(socket.SHUT_WR)
+                else:
+                    slots = max(1, round(duration / interval))
+                    samples = receive_samples(sock, bytearray(block_size), interval, slots, started)
+                    sock.sendall(struct.pack(f"!I{slots}d", slots, *samples))
+            except OSError as e:
+                # Clients close download streams as soon as they have their samples
+                logging.debug("Throughput stream from %s ended: %s", self.client_address[0], e)
+
+    class ThroughputServer(socketserver.ThreadingTCPServer):
+        address_family = socket.AF_INET6 if ':' in host else socket.AF_INET
+        allow_reuse_address = True
+        daemon_threads = True
+
+    server = ThroughputServer((host, port), ThroughputHandler)
+    logging.info("Throughput server listening on %s:%s", host, server.server_address[1])
+    return server
+
+# --- Latency Under Load ---
+# The link is loaded with the Throughput engine while RTT probes run on an event loop in
+# the calling thread. The streams spend their time in sendfile() and recv_into(), which
+# release the GIL, so the probe loop keeps its schedule. How late its timers fire is
+# measured alongside the probes, so local starvation shows up in the report and is not
+# mistaken for queueing on the link.
+LOOP_LAG_INTERVAL = 0.01
+BUFFERBLOAT_GRADES = ((5, 'A+'), (30, 'A'), (60, 'B'), (200, 'C'), (400, 'D'))  # Added ms below which a grade applies
+
+def trimmed_mean(sketch, fraction=0.9):
+    """Mean of the samples up to the given quantile, from the sketch buckets (ms)."""
+    if not sketch.count:
+        return None
+    keep = max(1, math.ceil(fraction * sketch.count))
+    total, seen = 0.0, 0
+    for index in sorted(sketch.buckets):
+        taken = min(sketch.buckets[index], keep - seen)
+        total += taken * min(max(sketch.bucket_value(index), sketch.min), sketch.max)
+        seen += taken
+        if seen >= keep:
+            break
+    return total / seen
+
+def responsiveness_rpm(sketch):
+    """Round trips per minute at the 90% trimmed mean RTT, as in the IETF responsiveness draft."""
+    mean = trimmed_mean(sketch)
+    return round(60000 / mean) if mean else None
+
+def bufferbloat_grade(added_ms):
+    if added_ms is None:
+        return None
+    return next((grade for limit, grade in BUFFERBLOAT_GRADES if added_ms < limit), 'F')
+
+async def measure_responsiveness(target, count, interval, timeout, method, port, delay=0.0):
+    """
+    Probes one target 'count' times, after waiting 'delay' seconds, while sampling how
+    late the event loop wakes up.
+    :return: (RTT LatencySketch, loop lag LatencySketch) in milliseconds.
+    """
+    loop = asyncio.get_running_loop()
+    lag = LatencySketch()
+
+    async def watch_loop_lag():
+        while True:
+            expected = loop.time() + LOOP_LAG_INTERVAL
+            await asyncio.sleep(LOOP_LAG_INTERVAL)
+            lag.add((loop.time() - expected) * 1000)
+
+    await asyncio.sleep(delay)
+    sketches = {}
+    watcher = asyncio.ensure_future(watch_loop_lag())
+    try:
+        await probe_targets([target], count, interval, timeout, method, port,
+                            on_sketch=lambda name, sketch: sketches.setdefault(name, sketch))
+    finally:
+        watcher.cancel()
+    return sketches[target], lag
+
+def run_latency_under_load(host, port, target, directions=('download', 'upload'), streams=4, duration=10.0,
+                           warmup=2.0, idle_duration=3.0, interval=0.1, timeout=1.0, method='auto', probe_port=443,
+                           on_phase=None):
+    """
+    Measures RTT to target with the link idle and then during each Throughput direction.
+    Probing starts once the streams are past their warm-up and runs until they stop.
+    :param host: Throughput server providing the load.
+    :param target: Probe target as for probe_targets, separate from the Throughput server
+                   so the probes measure the loaded path rather than the server's own queues.
+    :param probe_port: Port used by the TCP and UDP probe methods when target names none.
+    :param on_phase: Optional callback invoked with each phase name as it starts.
+    :return: {phase: {'latency': LatencySketch, 'loop_lag': LatencySketch, 'mbps': float}},
+             with 'idle' first and no 'mbps' for it.
+    """
+    phases = {}
+    if on_phase:
+        on_phase('idle')
+    with tracer.span('idle'):
+        sketch, lag = run_until_deadline(measure_responsiveness(
+            target, max(1, round(idle_duration / interval)), interval, timeout, method, probe_port))
+    phases['idle'] = {'latency': sketch, 'loop_lag': lag}
+    record_partial(**{'Idle Latency': sketch.summary()})
+
+    loaded_seconds = max(interval, duration - warmup)
+    for direction in directions:
+        if on_phase:
+            on_phase(direction)
+        with tracer.span(direction), ThreadPoolExecutor(max_workers=1) as executor:
+            load = executor.submit(run_throughput, host, port, direction, streams, duration, warmup, timeout=timeout * 5)
+            sketch, lag = run_until_deadline(measure_responsiveness(
+                target, max(1, round(loaded_seconds / interval)), interval, timeout, method, probe_port, delay=warmup))
+            measurement = load.result()
+        phases[direction] = {'latency': sketch, 'loop_lag': lag, 'mbps': measurement['mbps']}
+        record_partial(**{direction.capitalize(): measurement['mbps'],
+                          f"{direction.capitalize()} Latency": sketch.summary()})
+    return phases
+
+# --- HTTP Probe ---
+HTTP_PHASES = ('dns_ms', 'connect_ms', 'tls_ms', 'ttfb_ms', 'total_ms')
+
+class HttpConnectionPool:
+    """
+    Keep-alive connections for the HTTP probe, kept for the life of the process so that
+    repeated probes of a host (monitor mode) reuse a connection instead of paying for DNS,
+    TCP and TLS again. The TLS session of each host is remembered too, so a connection the
+    server has since closed is replaced with a resumed handshake rather than a full one.
+    """
+    def __init__(self, max_idle_per_host=2, idle_timeout=50.0, context=None):
+        """
+        :param context: ssl.SSLContext for https connections; the default verifies
+                        certificates against the system store.
+        """
+        self.max_idle_per_host = max_idle_per_host
+        self.idle_timeout = idle_timeout
+        self._idle = {}          # (scheme, host, port) -> [(connection, released_at)]
+        self._tls_sessions = {}  # (scheme, host, port) -> ssl.SSLSession
+        self._context = context
+        self._lock = threading.Lock()
+
+    def acquire(self, key):
+        """Returns an idle connection for the key, or None when a new one is needed."""
+        with self._lock:
+            idle = self._idle.get(key, [])
+            while idle:
+                connection, released_at = idle.pop()
+                if time.monotonic() - released_at < self.idle_timeout:
+                    return connection
+                connection.close()
+        return None
+
+    def release(self, key, connection):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append((connection, time.monotonic()))
+                return
+        connection.close()
+
+    def connect(self, key, timeout):
+        """
+        Opens a new connection, timing each phase.
+        :return: (http.client connection, phase timings in ms, whether TLS was resumed).
+        """
+        import http.client
+        scheme, host, port = key
+        phases = {}
+        start = time.perf_counter()
+        family, _, proto, _, address = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)[0]
+        connect_start = time.perf_counter()
+        phases['dns_ms'] = (connect_start - start) * 1000
+        sock = socket.socket(family, socket.SOCK_STREAM, proto)
+        try:
+            sock.settimeout(timeout)
+            sock.connect(address)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            tls_start = time.perf_counter()
+            phases['connect_ms'] = (tls_start - connect_start) * 1000
+            resumed = False
+            if scheme == 'https':
+                sock = self.ssl_context().wrap_socket(sock, server_hostname=host, session=self._tls_sessions.get(key))
+                phases['tls_ms'] = (time.perf_counter() - tls_start) * 1000
+                resumed = sock.session_reused
+                connection = http.client.HTTPSConnection(host, port, timeout=timeout, context=self.ssl_context())
+            else:
+                connection = http.client.HTTPConnection(host, port, timeout=timeout)
+        except BaseException:
+            sock.close()
+            raise
+        connection.sock = sock  # Already connected, so http.client will not connect again
+        return connection, phases, resumed
+
+    def remember_session(self, key, connection):
+        """Keeps the TLS session for resumption. TLS 1.3 tickets arrive after the handshake,
+        so this is called once a response has been read."""
+        session = getattr(connection.sock, 'session', None)
+        if session is not None:
+            with self._lock:
+                self._tls_sessions[key] = session
+
+    def ssl_context(self):
+        if self._context is None:
+            import ssl
+            self._context = ssl.create_default_context()
+        return self._context
+
+    def close(self):
+        with self._lock:
+            for idle in self._idle.values():
+                for connection, _ in idle:
+                    connection.close()
+            self._idle.clear()
+
+http_pool = HttpConnectionPool()
+
+def http_request(url, timeout=5.0, pool=None):
+    """
+    Sends a GET through the connection pool.
+    :return: Dictionary with 'status', 'body', 'reused' (warm connection), 'tls_resumed'
+             and the phase timings in ms. DNS, connect and TLS are only present for cold
+             connections; 'ttfb_ms' runs from sending the request to the response headers.
+    """
+    import http.client
+    from urllib.parse import urlsplit
+    pool = pool or http_pool
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise ValueError(f"not an http(s) URL: {url}")
+    key = (parts.scheme, parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80))
+    path = parts.path or '/'
+    if parts.query:
+        path += '?' + parts.query
+
+    connection = pool.acquire(key)
+    while True:
+        reused = connection is not None
+        start = time.perf_counter()
+        if reused:
+            sample, resumed = {}, False
+        else:
+            connection, sample, resumed = pool.connect(key, timeout)
+        request_start = time.perf_counter()
+        try:
+            connection.request('GET', path, headers={'User-Agent': 'network-diagnostics'})
+            response = connection.getresponse()
+            first_byte = time.perf_counter()
+            body = response.read()
+        except (http.client.RemoteDisconnected, ConnectionError) as e:
+            connection.close()
+            if not reused:
+                raise
+            # The server closed the idle connection; retry once on a fresh one
+            logging.debug("Pooled connection to %s was closed by the server: %s", key[1], e)
+            connection = None
+            continue
+        except BaseException:
+            connection.close()
+            raise
+        break
+    end = time.perf_counter()
+
+    if not reused and key[0] == 'https':
+        pool.remember_session(key, connection)
+    if response.will_close:
+        connection.close()
+    else:
+        pool.release(key, connection)
+    sample.update({'ttfb_ms': (first_byte - request_start) * 1000, 'total_ms': (end - start) * 1000})
+    return {'status': response.status, 'body': body, 'reused': reused, 'tls_resumed': resumed,
+            **{phase: round(sample[phase], 3) for phase in HTTP_PHASES if phase in sample}}
+
+def average_phases(samples):
+    if not samples:
+        return None
+    return {phase: round(sum(sample[phase] for sample in samples) / len(samples), 3)
+            for phase in HTTP_PHASES if phase in samples[0]}
+
+def probe_url(url, count=2, timeout=5.0, pool=None, on_sketch=None):
+    """
+    Requests a URL several times in a row, so the first request of a run may be cold and
+    the rest reuse its connection. Phase timings are averaged separately for cold and
+    warm requests.
+    :param on_sketch: Optional callback invoked with (url, LatencySketch of the request
+                      times, failed requests counting as lost).
+    """
+    samples, error = [], None
+    sketch = LatencySketch()
+    for _ in range(count):
+        try:
+            samples.append(http_request(url, timeout, pool))
+            sketch.add(samples[-1]['total_ms'])
+        except Exception as e:
+            error = str(e)
+            sketch.add(None)
+    if on_sketch:
+        on_sketch(url, sketch)
+    summary = {'requests': count,
+               'errors': count - len(samples),
+               'status': samples[-1]['status'] if samples else None,
+               'cold': average_phases([sample for sample in samples if not sample['reused']]),
+               'warm': average_phases([sample for sample in samples if sample['reused']]),
+               'tls_resumed': any(sample['tls_resumed'] for sample in samples)}
+    if error:
+        summary['error'] = error
+    return summary
+
+def probe_urls(urls, count=2, timeout=5.0, max_concurrency=8, pool=None, on_sketch=None):
+    """Probes the URLs concurrently and returns {url: summary} in the order given."""
+    with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(urls)))) as executor:
+        summaries = list(executor.map(lambda url: probe_url(url, count, timeout, pool, on_sketch), urls))
+    return dict(zip(urls, summaries))
+
+# --- Socket Table ---
+SOCKET_PROTOCOLS = ('tcp', 'tcp6', 'udp', 'udp6')
+# Kernel socket states, indexed by the 'st' column of /proc/net/tcp
+SOCKET_STATES = ('UNKNOWN', 'ESTABLISHED', 'SYN_SENT', 'SYN_RECV', 'FIN_WAIT1', 'FIN_WAIT2', 'TIME_WAIT',
+                 'CLOSE', 'CLOSE_WAIT', 'LAST_ACK', 'LISTEN', 'CLOSING', 'NEW_SYN_RECV')
+STATE_CODES = {name: code for code, name in enumerate(SOCKET_STATES)}
+STATE_CODES.update({'LISTENING': 10, 'FIN_WAIT_1': 4, 'FIN_WAIT_2': 5, 'SYN_RECEIVED': 3, 'CLOSED': 7})
+UDP_UNCONNECTED = 7  # The kernel reports unconnected UDP sockets as CLOSE
+
+def decode_proc_address(hex_address):
+    """Converts a /proc/net address (hex, 32-bit words in host byte order) to text."""
+    raw = bytes.fromhex(hex_address)
+    if sys.byteorder == 'little':
+        raw = b''.join(raw[index:index + 4][::-1] for index in range(0, len(raw), 4))
+    return socket.inet_ntop(socket.AF_INET if len(raw) == 4 else socket.AF_INET6, raw)
+
+def socket_state_name(protocol, state):
+    if protocol >= 2 and state == UDP_UNCONNECTED:
+        return 'UNCONN'
+    return SOCKET_STATES[state] if state < len(SOCKET_STATES) else 'UNKNOWN'
+
+class SocketTable:
+    """
+    A snapshot of the socket table held in parallel columns: arrays for the protocol,
+    state, ports and inode, plus one endpoint string per socket ('<protocol> local:port
+    remote:port', with addresses in their source form: hex for /proc, text for netstat).
+    The endpoint string is the connection's identity for diffs, and its addresses are only
+    decoded for the handful of rows that get reported.
+    """
+    def __init__(self, source='proc'):
+        self.source = source
+        self.captured_at = time.perf_counter()  # Only ever compared with another snapshot
+        self.protocols = array('B')
+        self.states = array('B')
+        self.local_ports = array('H')
+        self.remote_ports = array('H')
+        self.inodes = array('Q')
+        self.endpoints = []
+        self._keys = None
+
+    def __len__(self):
+        return len(self.protocols)
+
+    def append(self, protocol, state, local_address, local_port, remote_address, remote_port, inode=0):
+        self.protocols.append(protocol)
+        self.states.append(state)
+        self.local_ports.append(local_port)
+        self.remote_ports.append(remote_port)
+        self.inodes.append(inode)
+        self.endpoints.append(f"{protocol} {local_address}:{local_port} {remote_address}:{remote_port}")
+        self._keys = None
+
+    def keys(self):
+        """{endpoint: row} for every socket in the snapshot."""
+        if self._keys is None:
+            self._keys = dict(zip(self.endpoints, range(len(self))))
+        return self._keys
+
+    def connection(self, row):
+        """One row as a readable dictionary."""
+        decode = decode_proc_address if self.source == 'proc' else str
+
+        def endpoint(text, port):
+            address = decode(text.rpartition(':')[0])
+            return f"[{address}]:{port}" if ':' in address else f"{address}:{port}"
+
+        _, local, remote = self.endpoints[row].split(' ')
+        return {'protocol': SOCKET_PROTOCOLS[self.protocols[row]],
+                'local': endpoint(local, self.local_ports[row]),
+                'remote': endpoint(remote, self.remote_ports[row]),
+                'state': socket_state_name(self.protocols[row], self.states[row])}
+
+    def state_counts(self):
+        """{'tcp': {'ESTABLISHED': n, ...}, ...}; tcp6 and udp6 are folded into tcp and udp."""
+        counts = {}
+        for (protocol, state), count in Counter(zip(self.protocols, self.states)).items():
+            name = socket_state_name(protocol, state)
+            family = counts.setdefault(SOCKET_PROTOCOLS[protocol].rstrip('6'), {})
+            family[name] = family.get(name, 0) + count
+        return counts
+
+    def remote_port_counts(self, top=10):
+        """Connected sockets per remote port, busiest first."""
+        counts = Counter(self.remote_ports)
+        counts.pop(0, None)  # Listening and unconnected sockets
+        return dict(counts.most_common(top))
+
+    def diff(self, previous, sample_limit=10):
+        """Connections opened and closed since an earlier snapshot, with a sample of each."""
+        current_keys, previous_keys = self.keys(), previous.keys()
+        opened = current_keys.keys() - previous_keys.keys()
+        closed = previous_keys.keys() - current_keys.keys()
+        return {'interval_s': round(self.captured_at - previous.captured_at, 3),
+                'opened': len(opened),
+                'closed': len(closed),
+                'opened_sample': [self.connection(current_keys[key]) for key in sorted(opened)[:sample_limit]],
+                'closed_sample': [previous.connection(previous_keys[key]) for key in sorted(closed)[:sample_limit]]}
+
+    def summary(self, previous=None):
+        summary = {'Source': self.source,
+                   'Sockets': len(self),
+                   'States': self.state_counts(),
+                   'Remote Ports': self.remote_port_counts()}
+        if previous is not None:
+            summary['Changes'] = self.diff(previous)
+        return summary
+
+# sl, local address:port, remote address:port, state, tx:rx queue, timer, retransmits, uid, timeout, inode
+PROC_SOCKET_LINE = None
+
+def read_proc_socket_table(directory='/proc/net'):
+    """
+    Reads tcp, tcp6, udp and udp6 from /proc/net into a SocketTable with one regular
+    expression pass per file. Addresses are never resolved to names; a missing file
+    (IPv6 disabled) is skipped.
+    """
+    global PROC_SOCKET_LINE
+    if PROC_SOCKET_LINE is None:
+        import re
+        PROC_SOCKET_LINE = re.compile(r'^ *\d+: ([0-9A-F]+:([0-9A-F]{4}) [0-9A-F]+:([0-9A-F]{4})) ([0-9A-F]{2}) '
+                                      r'\S+ \S+ \S+ +\d+ +\d+ (\d+)', re.MULTILINE)
+    table = SocketTable('proc')
+    for protocol, name in enumerate(SOCKET_PROTOCOLS):
+        try:
+            with open(os.path.join(directory, name), 'r', encoding='ascii') as file:
+                rows = PROC_SOCKET_LINE.findall(file.read())
+        except OSError:
+            continue
+        if not rows:
+            continue
+        endpoints, local_ports, remote_ports, states, inodes = zip(*rows)
+        prefix = f"{protocol} "
+        table.endpoints.extend([prefix + endpoint for endpoint in endpoints])
+        table.local_ports.extend([int(port, 16) for port in local_ports])
+        table.remote_ports.extend([int(port, 16) for port in remote_ports])
+        table.states.extend([int(state, 16) for state in states])
+        table.inodes.extend([int(inode) for inode in inodes])
+        table.protocols.extend(bytes([protocol]) * len(rows))
+    return table
+
+def split_netstat_endpoint(endpoint):
+    """Splits '10.0.0.1:443', '[::1]:80', '*:*' or the macOS form '10.0.0.1.443' into (address, port)."""
+    separator = '.' if sys.platform == 'darwin' else ':'
+    address, _, port = endpoint.rpartition(separator)
+    return address.strip('[]') or '*', int(port) if port.isdigit() else 0
+
+def parse_netstat_line(table, line):
+    """Adds the socket on one line of 'netstat -an' output (Windows, macOS or Linux net-tools) to a SocketTable."""
+    fields = line.split()
+    if len(fields) < 3 or not fields[0].lower().startswith(('tcp', 'udp')):
+        return
+    # Unix netstat has Recv-Q and Send-Q columns before the addresses
+    offset = 3 if fields[1].isdigit() and fields[2].isdigit() else 1
+    if len(fields) < offset + 2:
+        return
+    local_address, local_port = split_netstat_endpoint(fields[offset])
+    remote_address, remote_port = split_netstat_endpoint(fields[offset + 1])
+    is_udp = fields[0].lower().startswith('udp')
+    is_ipv6 = fields[0].endswith('6') or local_address.count(':') > 1
+    state = fields[offset + 2].upper() if len(fields) > offset + 2 else ''
+    table.append(2 * is_udp + is_ipv6, STATE_CODES.get(state, UDP_UNCONNECTED if is_udp else 0),
+                 local_address, local_port, remote_address, remote_port)
+
+def parse_netstat_output(output):
+    """Parses 'netstat -an' output into a SocketTable."""
+    table = SocketTable('netstat')
+    for line in output.splitlines():
+        parse_netstat_line(table, line)
+    return table
+
+# --- Interface Inventory ---
+# Counter columns of /proc/net/dev: receive bytes, packets, errs, drop, then transmit from column 8
+INTERFACE_COUNTERS = {'rx_bytes': 0, 'rx_packets': 1, 'rx_errors': 2, 'rx_dropped': 3,
+                      'tx_bytes': 8, 'tx_packets': 9, 'tx_errors': 10, 'tx_dropped': 11}
+RTF_GATEWAY = 0x2
+SIOCGIFADDR = 0x8915
+SIOCGIFNETMASK = 0x891B
+RTM_NEWADDR = 20
+RTM_GETADDR = 22
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+NETLINK_HEADER = struct.Struct("=IHHII")  # length, type, flags, sequence, port id
+IFADDR_MESSAGE = struct.Struct("=BBBBI")  # family, prefix length, flags, scope, interface index
+ROUTE_ATTRIBUTE = struct.Struct("=HH")    # length, type
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+
+def read_sysfs_value(path):
+    try:
+        with open(path, 'r') as file:
+            return file.read().strip()
+    except OSError:
+        return None  # Absent, or not meaningful for this interface (speed of a virtual link)
+
+def read_interface_counters(directory='/proc/net'):
+    """Byte, packet, error and drop counters for every interface, from one read of /proc/net/dev."""
+    counters = {}
+    try:
+        with open(os.path.join(directory, 'dev'), 'r') as file:
+            lines = file.read().splitlines()[2:]
+    except OSError:
+        return counters
+    for line in lines:
+        name, _, values = line.partition(':')
+        values = values.split()
+        counters[name.strip()] = {counter: int(values[column]) for counter, column in INTERFACE_COUNTERS.items()}
+    return counters
+
+def read_default_routes(directory='/proc/net'):
+    """IPv4 and IPv6 default routes from /proc/net/route and /proc/net/ipv6_route."""
+    routes = []
+    try:
+        with open(os.path.join(directory, 'route'), 'r') as file:
+            for line in file.read().splitlines()[1:]:
+                fields = line.split()
+                if len(fields) >= 8 and fields[1] == '00000000' and fields[7] == '00000000' and int(fields[3], 16) & RTF_GATEWAY:
+                    routes.append({'family': 'ipv4', 'interface': fields[0],
+                                   'gateway': decode_proc_address(fields[2]), 'metric': int(fields[6])})
+    except OSError:
+        pass
+    try:
+        with open(os.path.join(directory, 'ipv6_route'), 'r') as file:
+            for line in file:
+                fields = line.split()
+                # Unlike /proc/net/tcp6, addresses here are in network byte order
+                if len(fields) >= 10 and fields[1] == '00' and int(fields[0], 16) == 0 and int(fields[8], 16) & RTF_GATEWAY:
+                    routes.append({'family': 'ipv6', 'interface': fields[9],
+                                   'gateway': socket.inet_ntop(socket.AF_INET6, bytes.fromhex(fields[4])),
+                                   'metric': int(fields[5], 16)})
+    except OSError:
+        pass
+    return routes
+
+def read_resolver_config(path='/etc/resolv.conf'):
+    """Name servers and search domains from resolv.conf, when the platform has one."""
+    config = {'nameservers': [], 'search': []}
+    try:
+        with open(path, 'r') as file:
+            for line in file:
+                fields = line.split()
+                if len(fields) >= 2 and fields[0] == 'nameserver':
+                    config['nameservers'].append(fields[1])
+                elif fields and fields[0] in ('search', 'domain'):
+                    config['search'] = fields[1:]
+    except OSError:
+        pass
+    return config
+
+def ioctl_ipv4_address(name):
+    """Primary IPv4 address of an interface as 'address/prefix', or None."""
+    import fcntl
+    request = struct.pack('256s', name.encode()[:15])
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        try:
+            address = fcntl.ioctl(sock.fileno(), SIOCGIFADDR, request)[20:24]
+            netmask = fcntl.ioctl(sock.fileno(), SIOCGIFNETMASK, request)[20:24]
+        except OSError:
+            return None  # No IPv4 address assigned
+    return f"{socket.inet_ntoa(address)}/{bin(int.from_bytes(netmask, 'big')).count('1')}"
+
+def read_proc_addresses(names, directory='/proc/net'):
+    """Addresses per interface: IPv6 from /proc/net/if_inet6, the primary IPv4 address by ioctl."""
+    addresses = {name: [] for name in names}
+    for name in names:
+        ipv4 = ioctl_ipv4_address(name)
+        if ipv4:
+            addresses[name].append(ipv4)
+    try:
+        with open(os.path.join(directory, 'if_inet6'), 'r') as file:
+            for line in file:
+                fields = line.split()
+                if len(fields) >= 6:
+                    address = socket.inet_ntop(socket.AF_INET6, bytes.fromhex(fields[0]))
+                    addresses.setdefault(fields[5], []).append(f"{address}/{int(fields[2], 16)}")
+    except OSError:
+        pass
+    return addresses
+
+def netlink_addresses():
+    """
+    Every address (including IPv4 secondaries, which ioctl cannot see) with one
+    RTM_GETADDR dump over a netlink socket. Raises OSError where netlink is unavailable.
+    """
+    addresses = {}
+    with socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, 0) as sock:  # 0 is NETLINK_ROUTE
+        sock.settimeout(1.0)
+        body = IFADDR_MESSAGE.pack(socket.AF_UNSPEC, 0, 0, 0, 0)
+        sock.send(NETLINK_HEADER.pack(NETLINK_HEADER.size + len(body), RTM_GETADDR, 0x301, 1, 0) + body)  # REQUEST | DUMP
+        while True:
+            data = sock.recv(65536)
+            offset = 0
+            while offset + NETLINK_HEADER.size <= len(data):
+                length, message_type, _, _, _ = NETLINK_HEADER.unpack_from(data, offset)
+                if message_type == NLMSG_DONE:
+                    return addresses
+                if message_type == NLMSG_ERROR:
+                    raise OSError("netlink address dump failed")
+                if message_type == RTM_NEWADDR:
+                    family, prefix, _, _, index = IFADDR_MESSAGE.unpack_from(data, offset + NETLINK_HEADER.size)
+                    attributes = {}
+                    position = offset + NETLINK_HEADER.size + IFADDR_MESSAGE.size
+                    while position + ROUTE_ATTRIBUTE.size <= offset + length:
+                        attribute_length, attribute_type = ROUTE_ATTRIBUTE.unpack_from(data, position)
+                        if attribute_length < ROUTE_ATTRIBUTE.size:
+                            break
+                        attributes[attribute_type] = data[position + ROUTE_ATTRIBUTE.size:position + attribute_length]
+                        position += (attribute_length + 3) & ~3
+                    # IFA_LOCAL is the interface's own address; IFA_ADDRESS is the peer on point-to-point links
+                    raw = attributes.get(IFA_LOCAL) or attributes.get(IFA_ADDRESS)
+                    if raw:
+                        try:
+                            name = socket.if_indextoname(index)
+                        except OSError:
+                            name = str(index)
+                        addresses.setdefault(name, []).append(f"{socket.inet_ntop(family, raw)}/{prefix}")
+                offset += (length + 3) & ~3
+                if not length:
+                    break
+
+def collect_interface_inventory(use_netlink=True, sys_directory='/sys/class/net', proc_directory='/proc/net'):
+    """
+    Reads interfaces (state, MTU, MAC, speed, link flap count, addresses and counters),
+    default routes and resolver configuration without spawning a process.
+    """
+    names = sorted(os.listdir(sys_directory))
+    addresses = None
+    if use_netlink:
+        try:
+            addresses = netlink_addresses()
+        except (OSError, AttributeError) as e:  # AttributeError: no AF_NETLINK on this platform
+            logging.debug("Netlink unavailable, reading addresses from /proc: %s", e)
+    if addresses is None:
+        addresses = read_proc_addresses(names, proc_directory)
+    counters = read_interface_counters(proc_directory)
+
+    interfaces = {}
+    for name in names:
+        base = os.path.join(sys_directory, name)
+        mtu, speed, flaps = (read_sysfs_value(os.path.join(base, leaf)) for leaf in ('mtu', 'speed', 'carrier_changes'))
+        interfaces[name] = {'state': read_sysfs_value(os.path.join(base, 'operstate')),
+                            'mtu': int(mtu) if mtu else None,
+                            'mac': read_sysfs_value(os.path.join(base, 'address')),
+                            'speed_mbps': int(speed) if speed and int(speed) > 0 else None,
+                            'carrier_changes': int(flaps) if flaps else None,
+                            'addresses': sorted(addresses.get(name, [])),
+                            'counters': counters.get(name, {})}
+    return {'captured_at': time.monotonic(),
+            'interfaces': interfaces,
+            'default_routes': read_default_routes(proc_directory),
+            'resolvers': read_resolver_config()}
+
+def diff_interface_inventory(previous, current):
+    """
+    Compares two inventories.
+    :return: (changes, rates). 'changes' only holds what differs: interfaces added or
+             removed, address churn, state and MTU changes, link flaps, default route and
+             resolver changes. 'rates' has per-interface bits and packets per second and
+             error and drop counts over the interval.
+    """
+    elapsed = max(current['captured_at'] - previous['captured_at'], 1e-9)
+    before, after = previous['interfaces'], current['interfaces']
+    changes, rates = {}, {}
+    if after.keys() - before.keys():
+        changes['interfaces_added'] = sorted(after.keys() - before.keys())
+    if before.keys() - after.keys():
+        changes['interfaces_removed'] = sorted(before.keys() - after.keys())
+
+    for name in sorted(after.keys() & before.keys()):
+        old, new = before[name], after[name]
+        interface_changes = {}
+        if set(new['addresses']) - set(old['addresses']):
+            interface_changes['addresses_added'] = sorted(set(new['addresses']) - set(old['addresses']))
+        if set(old['addresses']) - set(new['addresses']):
+            interface_changes['addresses_removed'] = sorted(set(old['addresses']) - set(new['addresses']))
+        for field in ('state', 'mtu', 'mac', 'speed_mbps'):
+            if old[field] != new[field]:
+                interface_changes[field] = [old[field], new[field]]
+        if old['carrier_changes'] is not None and new['carrier_changes'] is not None and new['carrier_changes'] > old['carrier_changes']:
+            interface_changes['link_flaps'] = new['carrier_changes'] - old['carrier_changes']
+        if interface_changes:
+            changes[name] = interface_changes
+
+        deltas = {counter: new['counters'][counter] - old['counters'][counter]
+                  for counter in INTERFACE_COUNTERS if counter in new['counters'] and counter in old['counters']}
+        if deltas and min(deltas.values()) >= 0:  # A negative delta means the counters were reset
+            rates[name] = {'rx_bps': round(deltas['rx_bytes'] * 8 / elapsed, 1),
+                           'tx_bps': round(deltas['tx_bytes'] * 8 / elapsed, 1),
+                           'rx_pps': round(deltas['rx_packets'] / elapsed, 1),
+                           'tx_pps': round(deltas['tx_packets'] / elapsed, 1),
+                           'errors': deltas['rx_errors'] + deltas['tx_errors'],
+                           'drops': deltas['rx_dropped'] + deltas['tx_dropped']}
+
+    if previous['default_routes'] != current['default_routes']:
+        changes['default_routes'] = current['default_routes']
+    if previous['resolvers'] != current['resolvers']:
+        changes['resolvers'] = current['resolvers']
+    return changes, rates
+
+# --- Result Cache ---
+class ResultCache:
+    """
+    Values that rarely change between passes (the public IP, the chosen Speedtest server,
+    DNS answers for probe targets), each kept for a TTL and labelled with tags so a group
+    can be discarded at once: 'dns' after a DNS Flush or a resolver change, 'interface'
+    when addresses, link states or default routes change. With persistence on, entries
+    are saved to a JSON file after each pass and reused after a restart; expiry uses wall
+    clock time for that reason.
+    """
+    def __init__(self):
+        self.enabled = True
+        self.persist = False
+        self.path = None
+        self.ttls = {}
+        self._entries = {}
+        self._loaded_path = None
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    def configure(self, cache_settings):
+        self.enabled = cache_settings.get('enabled', True)
+        self.persist = cache_settings.get('persist', True)
+        self.ttls = cache_settings.get('ttls', {})
+        self.path = Path(__file__).parent / cache_settings.get('path', 'Results/cache.json') if self.persist else None
+
+    def ttl(self, name, default=300):
+        return float(self.ttls.get(name, default))
+
+    def _load(self):
+        """Reads the persisted entries the first time the cache is used with a given file."""
+        if self.path is None or self._loaded_path == self.path:
+            return
+        self._loaded_path = self.path
+        try:
+            with open(self.path, 'r') as file:
+                stored = json.load(file)
+            now = time.time()
+            for key, entry in stored.items():
+                if key not in self._entries and (entry['expires'] is None or entry['expires'] > now):
+                    self._entries[key] = entry
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, TypeError, KeyError, AttributeError) as e:
+            logging.warning("Ignoring unreadable result cache %s: %s", self.path, e)
+
+    def get(self, key):
+        """Returns the live entry ({'value', 'stored_at', 'expires', 'tags'}) for key, or None."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            self._load()
+            entry = self._entries.get(key)
+            if entry is not None and entry['expires'] is not None and entry['expires'] <= time.time():
+                del self._entries[key]
+                self._dirty = True
+                entry = None
+            return entry
+
+    def put(self, key, value, ttl, tags=()):
+        """Stores a JSON-serializable value for ttl seconds (None keeps it until invalidated; 0 stores nothing)."""
+        if not self.enabled or ttl == 0 or deadline_cancelled():
+            return
+        now = time.time()
+        with self._lock:
+            self._load()
+            self._entries[key] = {'value': value, 'stored_at': now, 'expires': None if ttl is None else now + ttl,
+                                  'tags': list(tags)}
+            self._dirty = True
+
+    def invalidate(self, tag):
+        """Discards every entry labelled with tag and returns how many there were."""
+        with self._lock:
+            self._load()
+            stale = [key for key, entry in self._entries.items() if tag in entry['tags']]
+            for key in stale:
+                del self._entries[key]
+            self._dirty = self._dirty or bool(stale)
+        if stale:
+            logging.info("Invalidated %s cached '%s' entries", len(stale), tag)
+        return len(stale)
+
+    def save(self):
+        """Writes the entries to the cache file if they changed since the last save."""
+        with self._lock:
+            if not self._dirty or self.path is None:
+                return
+            entries = dict(self._entries)
+            self._dirty = False
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            write_json_atomically(self.path, entries)
+        except (OSError, TypeError) as e:
+            logging.error("Error saving the result cache: %s", e)
+
+result_cache = ResultCache()
+
+def cache_lookup(key):
+    """Returns (entry or None, report) where report is the {'hit', 'age_s'} entry for a result's 'Cache' field."""
+    entry = result_cache.get(key)
+    if entry is None:
+        return None, {'hit': False}
+    return entry, {'hit': True, 'age_s': round(time.time() - entry['stored_at'], 1)}
+
+def detect_network_change(inventory=None):
+    """
+    Compares the interfaces, default routes and resolvers with those seen last time (also
+    across restarts, through the persisted cache) and invalidates the 'interface' or
+    'dns' entries when they differ. Without an inventory, just the fields compared are
+    read where that is cheap (/sys and netlink on Linux); elsewhere the TTLs alone bound
+    how stale an entry can get.
+    :return: The tags that were invalidated.
+    """
+    if inventory is None:
+        if not os.path.isdir('/sys/class/net'):
+            return []
+        with tracer.span('network_check'):
+            names = sorted(os.listdir('/sys/class/net'))
+            try:
+                addresses = netlink_addresses()
+            except (OSError, AttributeError):
+                addresses = read_proc_addresses(names)
+            inventory = {'interfaces': {name: {'state': read_sysfs_value(f"/sys/class/net/{name}/operstate"),
+                                               'addresses': sorted(addresses.get(name, []))} for name in names},
+                         'default_routes': read_default_routes(),
+                         'resolvers': read_resolver_config()}
+    fingerprints = {
+        'interface': json.dumps([inventory['default_routes'],
+                                 {name: [interface['state'], interface['addresses']]
+                                  for name, interface in inventory['interfaces'].items()}], sort_keys=True),
+        'dns': json.dumps(inventory['resolvers'], sort_keys=True)}
+    changed = []
+    for tag, fingerprint in fingerprints.items():
+        entry = result_cache.get(f"fingerprint {tag}")
+        if entry is not None and entry['value'] != fingerprint:
+            result_cache.invalidate(tag)
+            changed.append(tag)
+        if entry is None or entry['value'] != fingerprint:
+            result_cache.put(f"fingerprint {tag}", fingerprint, None)
+    return changed
+
+# --- Network Diagnostics Tests ---
+def run_ping_test(progress, settings):
+    logging.debug("Ping test enabled, starting test")
+    ping_settings = settings.get('ping_settings', {})
+    targets = ping_settings.get('targets', ['8.8.8.8'])
+    count = int(ping_settings.get('count', 4))
+    ping_task = progress.add_task("Running Ping Test...", total=max(1, count * len(targets)))
+    start_time = time.perf_counter()
+    with tracer.span('probe'):
+        target_results = run_until_deadline(probe_targets(
+            targets,
+            count=count,
+            interval=float(ping_settings.get('interval', 0.2)),
+            timeout=float(ping_settings.get('timeout', 1.0)),
+            method=ping_settings.get('method', 'auto'),
+            port=int(ping_settings.get('port', 443)),
+            on_probe=lambda: progress.advance(ping_task),
+            on_sketch=lambda target, sketch: latency_statistics.merge('Ping Test', target, sketch)))
+    duration = time.perf_counter() - start_time
+    progress.update(ping_task, completed=max(1, count * len(targets)))
+    passed = bool(target_results) and all(summary['received'] > 0 for summary in target_results.values())
+    result = {'result': 'Passed' if passed else 'Failed',
+              'Targets': target_results,
+              'duration': str(timedelta(seconds=duration))}
+    statistics = latency_report('Ping Test', targets)
+    if statistics:
+        result['Statistics'] = statistics
+    print_status("Ping Test completed.", 'GREEN')
+    if passed:
+        logging.info("Ping Test completed successfully")
+    else:
+        logging.error("Ping Test failed")
+    return result
+
+def run_traceroute_test(progress, settings):
+    logging.debug("Traceroute test enabled, starting test")
+    traceroute_settings = settings.get('traceroute_settings', {})
+    target = traceroute_settings.get('target', '8.8.8.8')
+    max_hops = int(traceroute_settings.get('max_hops', 30))
+    probes_per_hop = int(traceroute_settings.get('probes_per_hop', 3))
+    timeout = float(traceroute_settings.get('timeout', 1.0))
+    traceroute_task = progress.add_task("Running Traceroute Test...", total=max_hops * probes_per_hop)
+
+    if native_traceroute_available():
+        start_time = time.perf_counter()
+        try:
+            with tracer.span('probe'):
+                trace = run_until_deadline(trace_route(target, max_hops=max_hops, probes_per_hop=probes_per_hop, timeout=timeout,
+                                                       on_hop=lambda ttl: progress.advance(traceroute_task)))
+            error = None
+        except OSError as e:
+            trace = {'destination': target, 'reached': False, 'hops': []}
+            error = str(e)
+        duration = time.perf_counter() - start_time
+    else:
+        hops = []
+
+        def on_tracert_line(line):
+            hop = parse_tracert_line(line)
+            if hop is None:
+                return False
+            hops.append(hop)
+            record_partial(Destination=target, Hops=hops)
+            progress.update(traceroute_task, advance=probes_per_hop,
+                            description=f"Running Traceroute Test: hop {hop['ttl']} {hop['address'] or '*'}")
+            return hop['address'] == target  # Nothing after the destination's hop is needed
+
+        traceroute_response = run_command_with_progress(
+            ["tracert", "-d", "-h", str(max_hops), "-w", str(int(timeout * 1000)), target], traceroute_task, progress,
+            on_line=on_tracert_line)
+        duration = traceroute_response['duration']
+        finished = traceroute_response['returncode'] == 0 or traceroute_response['stopped']
+        trace = {'destination': target, 'reached': finished and bool(hops), 'hops': hops}
+        error = traceroute_response['error']
+
+    progress.update(traceroute_task, completed=max_hops * probes_per_hop)
+    result = {'result': 'Passed' if trace['reached'] else 'Failed',
+              'Destination': trace['destination'],
+              'Hops': trace['hops'],
+              'duration': str(timedelta(seconds=duration))}
+    if error:
+        result['Error'] = error
+    print_status("Traceroute Test completed.", 'GREEN')
+    if trace['reached']:
+        logging.info("Traceroute Test completed successfully")
+    else:
+        logging.error("Traceroute Test failed")
+    return result
+
+interface_snapshots = {}  # The previous inventory, for changes between runs
+
+def run_ipconfig_test(progress, settings):
+    logging.debug("IP Configuration test enabled, starting test")
+    ipconfig_task = progress.add_task("Running IP Configuration Test...", total=100)
+    if not os.path.isdir('/sys/class/net'):
+        cached, cache_report = cache_lookup('ipconfig /all')
+        if cached is not None:
+            progress.update(ipconfig_task, completed=100)
+            print_status("IP Configuration Test completed (cached).", 'GREEN')
+            return {'result': 'Passed (cached)', 'Output': cached['value'], 'Cache': {'ipconfig /all': cache_report},
+                    'duration': '0:00:00'}
+        ipconfig_response = run_command_with_progress(["ipconfig", "/all"], ipconfig_task, progress)
+        duration = ipconfig_response['duration']
+        result = {'result': 'Passed' if ipconfig_response['returncode'] == 0 else 'Failed',
+                  'Output': ipconfig_response['stdout'], 'Cache': {'ipconfig /all': cache_report},
+                  'duration': str(timedelta(seconds=duration))}
+        if ipconfig_response['returncode'] == 0:
+            result_cache.put('ipconfig /all', ipconfig_response['stdout'], result_cache.ttl('IP Configuration', 60),
+                             tags=('interface',))
+        print_status("IP Configuration Test completed.", 'GREEN')
+        if ipconfig_response['returncode'] == 0:
+            logging.info("IP Configuration Test completed successfully")
+        else:
+            logging.error("IP Configuration Test failed")
+        return result
+
+    start_time = time.perf_counter()
+    with tracer.span('collect'):
+        inventory = collect_interface_inventory(settings.get('interface_settings', {}).get('netlink', True))
+    invalidated = detect_network_change(inventory)
+    previous = interface_snapshots.get('last')
+    interface_snapshots['last'] = inventory
+    result = {'result': 'Passed'}
+    if previous is None:
+        # First pass: the whole inventory. Later passes only report what changed.
+        result['Interfaces'] = {name: {field: value for field, value in interface.items() if field != 'counters'}
+                                for name, interface in inventory['interfaces'].items()}
+        result['Default Routes'] = inventory['default_routes']
+        result['Resolver Config'] = inventory['resolvers']
+    else:
+        with tracer.span('diff'):
+            result['Changes'], result['Rates'] = diff_interface_inventory(previous, inventory)
+    if invalidated:
+        result['Cache Invalidated'] = invalidated
+    progress.update(ipconfig_task, completed=100)
+    result['duration'] = str(timedelta(seconds=time.perf_counter() - start_time))
+    print_status("IP Configuration Test completed.", 'GREEN')
+    logging.info("IP Configuration Test completed successfully: %s interfaces, changes: %s",
+                 len(inventory['interfaces']), result.get('Changes') or 'none')
+    return result
+
+def run_public_ip_test(progress, settings):
+    logging.debug("Current Public IP test enabled, starting test")
+    current_ip_task = progress.add_task("Retrieving Current Public IP...", total=100)
+    http_settings = settings.get('http_settings', {})
+    start_time = time.perf_counter()
+    detect_network_change()
+    cached, cache_report = cache_lookup('public_ip')
+    if cached is not None:
+        public_ip, error = cached['value'], None
+    else:
+        try:
+            with tracer.span('request'):
+                response = http_request(http_settings.get('public_ip_url', 'https://api.ipify.org'),
+                                        float(http_settings.get('timeout', 5.0)))
+            public_ip = response['body'].decode('ascii', 'replace').strip()
+            error = None if response['status'] == 200 and public_ip else f"HTTP {response['status']}"
+        except Exception as e:
+            error = str(e)
+        if error is None:
+            result_cache.put('public_ip', public_ip, result_cache.ttl('Current Public IP'), tags=('interface',))
+    duration = time.perf_counter() - start_time
+    progress.update(current_ip_task, completed=100)
+    if error is None:
+        result = {'result': 'Completed', 'IP': public_ip, 'Cache': {'public_ip': cache_report},
+                  'duration': str(timedelta(seconds=duration))}
+        print_status("Current Public IP Test completed.", 'GREEN')
+    else:
+        result = {'result': 'Failed', 'Error': error,
+                  'duration': str(timedelta(seconds=duration))}
+        print_status("Failed to retrieve Current Public IP.", 'LIGHTRED_EX')
+    if 'IP' in result:
+        logging.info("Current Public IP Test completed successfully")
+    else:
+        logging.error("Current Public IP Test failed: %s", error)
+    return result
+
+def run_dns_flush_test(progress, settings):
+    logging.debug("DNS Flush test enabled, starting test")
+    dnsflush_task = progress.add_task("Running DNS Flush...", total=100)
+    dns_flush_response = run_command_with_progress(["ipconfig", "/flushdns"], dnsflush_task, progress)
+    duration = dns_flush_response['duration']
+    result = {'result': 'Passed' if dns_flush_response['returncode'] == 0 else 'Failed',
+              'duration': str(timedelta(seconds=duration))}
+    if dns_flush_response['returncode'] == 0:
+        # Cached DNS answers would hide what the flush is meant to expose
+        result['Cache Invalidated'] = {'dns': result_cache.invalidate('dns')}
+    print_status("DNS Flush completed.", 'GREEN')
+    if dns_flush_response['returncode'] == 0:
+        logging.info("DNS Flush completed successfully")
+    else:
+        logging.error("DNS Flush failed")
+    return result
+
+def run_dns_test(progress, settings):
+    logging.debug("Nslookup test enabled, starting test")
+    dns_settings = settings.get('dns_settings', {})
+    resolvers = dns_settings.get('resolvers') or system_resolvers() or ['8.8.8.8', '1.1.1.1']
+    names = dns_settings.get('names', ['google.com'])
+    record_types = dns_settings.get('record_types', ['A', 'AAAA'])
+    rounds = int(dns_settings.get('rounds', 3))
+    total_queries = max(1, len(resolvers) * len(names) * len(record_types) * rounds)
+    nslookup_task = progress.add_task("Running Nslookup Test...", total=total_queries)
+
+    async def measure():
+        # System lookups go first so they see the cache state the DNS Flush left behind
+        with tracer.span('system_lookup'):
+            system_timings = await time_system_lookups(names)
+        with tracer.span('benchmark'):
+            resolver_results = await benchmark_dns(resolvers, names, record_types, rounds,
+                                                   timeout=float(dns_settings.get('timeout', 2.0)),
+                                                   max_outstanding=int(dns_settings.get('max_outstanding', 256)),
+                                                   on_query=lambda: progress.advance(nslookup_task),
+                                                   on_sketch=lambda resolver, sketch: latency_statistics.merge(
+                                                       'Nslookup Test', resolver, sketch))
+        return system_timings, resolver_results
+
+    start_time = time.perf_counter()
+    system_timings, resolver_results = run_until_deadline(measure())
+    duration = time.perf_counter() - start_time
+    progress.update(nslookup_task, completed=total_queries)
+
+    passed = all(summary['answered'] > 0 for summary in resolver_results.values())
+    result = {'result': 'Passed' if passed else 'Failed',
+              'Resolvers': resolver_results,
+              'System Lookup': system_timings,
+              'duration': str(timedelta(seconds=duration))}
+    statistics = latency_report('Nslookup Test', resolvers)
+    if statistics:
+        result['Statistics'] = statistics
+    print_status("Nslookup Test completed.", 'GREEN')
+    if passed:
+        logging.info("Nslookup Test completed successfully")
+    else:
+        logging.error("Nslookup Test failed")
+    return result
+
+socket_table_snapshots = {}  # The previous Netstat snapshot, for diffs between runs
+
+def run_netstat_test(progress, settings):
+    logging.debug("Netstat test enabled, starting test")
+    netstat_task = progress.add_task("Running Netstat...", total=100)
+    start_time = time.perf_counter()
+    if os.path.exists('/proc/net/tcp'):
+        with tracer.span('collect'):
+            table = read_proc_socket_table()
+        progress.update(netstat_task, completed=100)
+    else:
+        # '-n' keeps netstat from resolving every remote address by reverse DNS. Sockets are
+        # parsed as the lines arrive, so the table is complete as soon as netstat exits.
+        table = SocketTable('netstat')
+        netstat_response = run_command_with_progress(["netstat", "-an"], netstat_task, progress,
+                                                     on_line=lambda line: parse_netstat_line(table, line))
+        if netstat_response['returncode'] != 0:
+            error = netstat_response['error'] or netstat_response['stderr'].strip() or f"netstat exited with {netstat_response['returncode']}"
+            print_status("Netstat failed.", 'LIGHTRED_EX')
+            logging.error("Netstat failed: %s", error)
+            return {'result': 'Failed', 'Error': error,
+                    'duration': str(timedelta(seconds=netstat_response['duration']))}
+    previous = socket_table_snapshots.get('last')
+    socket_table_snapshots['last'] = table
+    duration = time.perf_counter() - start_time
+    with tracer.span('summarize'):
+        summary = table.summary(previous)
+    result = {'result': 'Passed', **summary, 'duration': str(timedelta(seconds=duration))}
+    print_status("Netstat completed.", 'GREEN')
+    logging.info("Netstat completed successfully: %s sockets from %s", len(table), table.source)
+    return result
+
+def run_speedtest_test(progress, settings):
+    logging.debug("Speedtest enabled, starting test")
+    speedtest_task = progress.add_task("Running Speedtest...", total=100)
+
+    import speedtest
+    deadline = current_deadline()
+    with tracer.span('server_selection'):
+        # The socket timeout bounds every request, and a cancelled test sets the shutdown
+        # event, which stops the download and upload threads between requests
+        st = speedtest.Speedtest(timeout=float(settings.get('speedtest_settings', {}).get('timeout', 10)),
+                                 shutdown_event=deadline.cancelled if deadline else None)
+        # Picking the best server pings dozens of candidates; later runs (also after a restart)
+        # only re-check the one chosen first, until the network changes or the entry expires
+        detect_network_change()
+        cached, cache_report = cache_lookup('speedtest_server')
+        best_server = st.get_best_server([cached['value']] if cached else None)
+        if cached is None:
+            result_cache.put('speedtest_server', best_server, result_cache.ttl('Speedtest', 86400), tags=('interface',))
+    progress.update(speedtest_task, advance=10, description="Preparing Speedtest...")
+
+    start_time = time.perf_counter()  # Start time measurement
+
+    # Perform download test
+    with tracer.span('download'):
+        st.download(threads=None)
+    record_partial(Download=st.results.download / 1e6, Ping=st.results.ping)
+    progress.update(speedtest_task, advance=45, description="Running Speedtest: Download")  # Update after download
+
+    # Perform upload test
+    with tracer.span('upload'):
+        st.upload(threads=None)
+    progress.update(speedtest_task, advance=45, description="Running Speedtest: Upload")  # Update after upload
+
+    end_time = time.perf_counter()  # End time measurement
+    duration = end_time - start_time  # Calculate total duration
+
+    progress.update(speedtest_task, completed=100, description="Speedtest completed")  # Update to full after upload
+
+    speedtest_results = st.results.dict()
+    # The library reports one ping per run; the statistics give its distribution over runs
+    server_name = f"{best_server.get('sponsor', '')} ({best_server.get('host', '')})"
+    latency_statistics.merge('Speedtest', server_name, LatencySketch.from_samples([speedtest_results['ping']]))
+    result = {
+        "result": "Completed",
+        "Download": speedtest_results['download'] / 1e6,  # bits/s to Mbps (10^6 bits per second)
+        "Upload": speedtest_results['upload'] / 1e6,
+        "Ping": speedtest_results['ping'],
+        'Cache': {'speedtest_server': cache_report},
+        'duration': str(timedelta(seconds=duration))
+    }
+    statistics = latency_report('Speedtest', [server_name])
+    if statistics:
+        result['Statistics'] = statistics
+    print_status("Speedtest completed.", 'GREEN')
+    if 'result' in result and result['result'] == "Completed":
+        logging.info("Speedtest completed successfully")
+    else:
+        logging.error("Speedtest failed")
+    return result
+
+def run_http_probe_test(progress, settings):
+    logging.debug("HTTP Probe enabled, starting test")
+    http_settings = settings.get('http_settings', {})
+    urls = http_settings.get('urls', ['https://api.ipify.org'])
+    http_task = progress.add_task("Running HTTP Probe...", total=len(urls))
+    start_time = time.perf_counter()
+    with tracer.span('probe'):
+        summaries = probe_urls(urls,
+                               count=int(http_settings.get('requests', 2)),
+                               timeout=float(http_settings.get('timeout', 5.0)),
+                               max_concurrency=int(http_settings.get('max_concurrency', 8)),
+                               on_sketch=lambda url, sketch: latency_statistics.merge('HTTP Probe', url, sketch))
+    duration = time.perf_counter() - start_time
+    progress.update(http_task, completed=len(urls))
+    failed = [url for url, summary in summaries.items() if summary['errors'] == summary['requests']]
+    result = {'result': 'Failed' if failed else 'Passed',
+              'URLs': summaries,
+              'duration': str(timedelta(seconds=duration))}
+    statistics = latency_report('HTTP Probe', urls)
+    if statistics:
+        result['Statistics'] = statistics
+    if failed:
+        print_status(f"HTTP Probe failed for {len(failed)} of {len(urls)} URLs.", 'LIGHTRED_EX')
+        logging.error("HTTP Probe failed for: %s", ', '.join(failed))
+    else:
+        print_status("HTTP Probe completed.", 'GREEN')
+        logging.info("HTTP Probe completed successfully")
+    return result
+
+def run_throughput_test(progress, settings):
+    logging.debug("Throughput test enabled, starting test")
+    throughput_settings = settings.get('throughput_settings', {})
+    server = throughput_settings.get('server')
+    if not server:
+        raise ValueError("no throughput server configured (set 'server' in throughput_settings)")
+    host, port = parse_probe_target(server, int(throughput_settings.get('port', 5201)))
+    directions = throughput_settings.get('directions', ['download', 'upload'])
+    throughput_task = progress.add_task("Running Throughput Test...", total=len(directions))
+
+    start_time = time.perf_counter()
+    result = {'result': 'Completed', 'Streams': int(throughput_settings.get('streams', 4))}
+    for direction in directions:
+        progress.update(throughput_task, description=f"Running Throughput Test: {direction.capitalize()}")
+        with tracer.span(direction):
+            measurement = run_throughput(host, port, direction,
+                                         streams=result['Streams'],
+                                         duration=float(throughput_settings.get('duration', 10)),
+                                         warmup=float(throughput_settings.get('warmup', 2)),
+                                         interval=float(throughput_settings.get('interval', 1.0)))
+        result[direction.capitalize()] = measurement['mbps']
+        result[f"{direction.capitalize()} Intervals"] = measurement['intervals_mbps']
+        record_partial(**result)
+        progress.update(throughput_task, advance=1)
+    result['duration'] = str(timedelta(seconds=time.perf_counter() - start_time))
+
+    progress.update(throughput_task, description="Throughput Test completed")
+    print_status("Throughput Test completed.", 'GREEN')
+    logging.info("Throughput test against %s completed: download %s Mbps, upload %s Mbps",
+                 server, result.get('Download'), result.get('Upload'))
+    return result
+
+def run_latency_under_load_test(progress, settings):
+    logging.debug("Latency Under Load test enabled, starting test")
+    throughput_settings = settings.get('throughput_settings', {})
+    load_settings = settings.get('latency_under_load_settings', {})
+    server = throughput_settings.get('server')
+    if not server:
+        raise ValueError("no throughput server configured (set 'server' in throughput_settings)")
+    host, port = parse_probe_target(server, int(throughput_settings.get('port', 5201)))
+    target = load_settings.get('probe_target')
+    if not target:
+        raise ValueError("no probe target configured (set 'probe_target' in latency_under_load_settings "
+                         "to an ICMP or UDP echo host other than the throughput server)")
+    directions = load_settings.get('directions', ['download', 'upload'])
+    load_task = progress.add_task("Running Latency Under Load Test...", total=len(directions) + 1)
+
+    def start_phase(phase):
+        if phase != 'idle':
+            progress.advance(load_task)
+        progress.update(load_task, description=f"Running Latency Under Load Test: {phase.capitalize()}")
+
+    start_time = time.perf_counter()
+    phases = run_latency_under_load(host, port, target, directions,
+                                    streams=int(load_settings.get('streams', throughput_settings.get('streams', 4))),
+                                    duration=float(load_settings.get('duration', 10)),
+                                    warmup=float(load_settings.get('warmup', 2)),
+                                    idle_duration=float(load_settings.get('idle_duration', 3)),
+                                    interval=float(load_settings.get('probe_interval', 0.1)),
+                                    timeout=float(load_settings.get('probe_timeout', 1.0)),
+                                    method=load_settings.get('probe_method', 'auto'),
+                                    probe_port=int(load_settings.get('probe_port', 443)),
+                                    on_phase=start_phase)
+    progress.update(load_task, completed=len(directions) + 1, description="Latency Under Load Test completed")
+
+    idle = phases['idle']['latency']
+    idle_mean = trimmed_mean(idle)
+    loaded = LatencySketch()
+    result = {'result': 'Completed', 'Idle Latency': idle.summary(), 'Idle RPM': responsiveness_rpm(idle)}
+    added = {}
+    for direction in directions:
+        sketch = phases[direction]['latency']
+        loaded.merge(sketch)
+        loaded_mean = trimmed_mean(sketch)
+        result[direction.capitalize()] = phases[direction]['mbps']
+        result[f"{direction.capitalize()} Latency"] = sketch.summary()
+        if idle_mean is not None and loaded_mean is not None:
+            added[direction] = round(max(0.0, loaded_mean - idle_mean), 3)
+    for phase, data in phases.items():
+        latency_statistics.merge('Latency Under Load', phase, data['latency'])
+    result.update({'Added Latency': added,
+                   'RPM': responsiveness_rpm(loaded),
+                   'Grade': bufferbloat_grade(max(added.values())) if added else None,
+                   'Loop Lag p99': {phase: data['loop_lag'].percentiles(('p99',))['p99'] for phase, data in phases.items()},
+                   'duration': str(timedelta(seconds=time.perf_counter() - start_time))})
+    if not idle.count or not loaded.count:
+        result['result'] = 'Failed'
+        result['Error'] = f"no replies from probe target {target}"
+    statistics = latency_report('Latency Under Load', phases)
+    if statistics:
+        result['Statistics'] = statistics
+
+    if result['result'] == 'Completed':
+        print_status("Latency Under Load Test completed.", 'GREEN')
+        logging.info("Latency under load against %s: grade %s, %s RPM, added latency %s",
+                     server, result['Grade'], result['RPM'], added)
+    else:
+        print_status("Latency Under Load Test failed.", 'LIGHTRED_EX')
+        logging.error("Latency Under Load Test failed: %s", result['Error'])
+    return result
+
+# --- Test Registry ---
+# Outcomes that count as a pass; 'Passed (cached)' reports a result served from the ResultCache.
+PASSED_RESULTS = ('Passed', 'Passed (cached)', 'Completed')
+
+# Tests in display order. 'cli_name' selects the test on the command line; 'after' lists
+# tests that must finish first when both are enabled.
+NETWORK_TESTS = [
+    {'name': 'Ping', 'cli_name': 'ping', 'result_key': 'Ping Test', 'runner': run_ping_test, 'after': []},
+    {'name': 'Traceroute', 'cli_name': 'traceroute', 'result_key': 'Traceroute Test', 'runner': run_traceroute_test, 'after': []},
+    {'name': 'IP Configuration', 'cli_name': 'ipconfig', 'result_key': 'IP Configuration', 'runner': run_ipconfig_test, 'after': []},
+    {'name': 'Current Public IP', 'cli_name': 'publicip', 'result_key': 'Current Public IP', 'runner': run_public_ip_test, 'after': []},
+    {'name': 'DNS Flush', 'cli_name': 'dnsflush', 'result_key': 'DNS Flush', 'runner': run_dns_flush_test, 'after': []},
+    {'name': 'Nslookup', 'cli_name': 'dns', 'result_key': 'Nslookup Test', 'runner': run_dns_test, 'after': ['DNS Flush']},
+    {'name': 'HTTP Probe', 'cli_name': 'http', 'result_key': 'HTTP Probe', 'runner': run_http_probe_test, 'after': []},
+    {'name': 'Netstat', 'cli_name': 'netstat', 'result_key': 'Netstat', 'runner': run_netstat_test, 'after': []},
+    {'name': 'Speedtest', 'cli_name': 'speedtest', 'result_key': 'Speedtest', 'runner': run_speedtest_test, 'after': []},
+    {'name': 'Throughput', 'cli_name': 'throughput', 'result_key': 'Throughput Test', 'runner': run_throughput_test, 'after': []},
+    {'name': 'Latency Under Load', 'cli_name': 'bufferbloat', 'result_key': 'Latency Under Load',
+     'runner': run_latency_under_load_test, 'after': []},
+]
+
+# --- Test Scheduler ---
+def run_scheduled_test(test, progress, settings, deadline=None):
+    """
+    Runs a single registered test, turning an unexpected exception into a 'Failed' result
+    so one broken test cannot take down the rest of the pass. The time spent in each
+    traced phase (spawn, command, probe, parse, ...) is attached as 'Phases', in ms,
+    along with the test's 'total'.
+    :param deadline: TestDeadline the test's commands and event loops are bound to. Once it
+                     is cancelled the test's progress updates, cache writes and latency
+                     statistics are dropped, since its result has already been reported.
+    """
+    start_ns = time.perf_counter_ns()
+    logging.debug("%s test started", test['name'], extra={'test': test['name'], 'phase': 'start'})
+    tracer.begin_test()
+    test_deadlines.current = deadline
+    if deadline is not None:
+        progress = DeadlineProgress(progress, deadline)
+    try:
+        result = call_profiled(test['runner'], progress, settings)
+    except Exception as e:
+        duration = (time.perf_counter_ns() - start_ns) / 1e9
+        logging.error("%s test raised an error: %s", test['name'], e,
+                      extra={'test': test['name'], 'phase': 'error', 'duration_ms': round(duration * 1000, 3)})
+        result = {'result': 'Failed', 'Error': str(e), 'duration': str(timedelta(seconds=duration))}
+        try:
+            print_status(f"{test['name']} failed.", 'LIGHTRED_EX')
+        except Exception as console_error:  # The console (or colorama) must not turn a failed test into a failed pass
+            logging.debug("Could not report the %s failure on the console: %s", test['name'], console_error)
+    finally:
+        test_deadlines.current = None
+    end_ns = time.perf_counter_ns()
+    result['Phases'] = {**tracer.end_test(), 'total': round((end_ns - start_ns) / 1e6, 3)}
+    tracer.add(test['name'], start_ns, end_ns, 'test', args={'result': result.get('result')})
+    logging.debug("%s test finished: %s", test['name'], result.get('result'),
+                  extra={'test': test['name'], 'phase': 'finish', 'duration_ms': result['Phases']['total']})
+    return result
+
+def test_time_limit(name, scheduler_settings):
+    """Seconds the named test may run for under 'test_timeouts' (its own entry, else 'default'); None for no limit."""
+    limits = scheduler_settings.get('test_timeouts', {})
+    seconds = limits.get(name, limits.get('default'))
+    return float(seconds) if seconds else None
+
+class TestWorkers:
+    """
+    Daemon threads that run scheduled tests, kept between passes. Unlike a thread pool with
+    a fixed size, a worker still stuck in a test the scheduler has given up on never delays
+    later tests (another thread is started instead) and never holds up the program's exit.
+    """
+    def __init__(self):
+        self._tasks = queue.SimpleQueue()
+        self._idle = 0
+        self._lock = threading.Lock()
+
+    def submit(self, function, *args):
+        future = Future()
+        with self._lock:
+            start_worker = self._idle == 0
+            if not start_worker:
+                self._idle -= 1
+        self._tasks.put((future, function, args))
+        if start_worker:
+            threading.Thread(target=self._work, name='test-worker', daemon=True).start()
+        return future
+
+    def _work(self):
+        while True:
+            future, function, args = self._tasks.get()
+            try:
+                future.set_result(function(*args))
+            except BaseException as e:
+                future.set_exception(e)
+            del future, function, args  # Drop references to the finished test while idle
+            with self._lock:
+                self._idle += 1
+
+test_workers = TestWorkers()
+
+def timeout_result(deadline, reason):
+    """A 'Timeout' result carrying whatever the test recorded with record_partial() before it was cut off."""
+    try:
+        partial = copy.deepcopy(deadline.partial)
+    except Exception:
+        partial = {}  # The worker changed it mid-copy; report the timeout without it
+    return {'result': 'Timeout', **partial, 'Error': reason,
+            'duration': str(timedelta(seconds=time.perf_counter() - deadline.started))}
+
+def start_test(test, progress, settings):
+    """Starts a test on a worker thread under its 'test_timeouts' limit; returns (future, deadline)."""
+    logging.debug("Scheduling %s test", test['name'])
+    deadline = TestDeadline(test['name'], test_time_limit(test['name'], settings.get('scheduler_settings', {})))
+    return test_workers.submit(run_scheduled_test, test, progress, settings, deadline), deadline
+
+def report_result(test, result, settings):
+    """Streams a finished test's result to the configured exporters and the metrics endpoint."""
+    with tracer.span('report', 'report', test=test['name']):
+        export_result(test['result_key'], result, settings)
+        publish_metrics(test['result_key'], result)
+
+def cancel_test(test, deadline, reason):
+    """Cancels a running test and returns its 'Timeout' result."""
+    deadline.cancel()
+    logging.error("%s test cancelled: %s", test['name'], reason, extra={'test': test['name'], 'phase': 'timeout'})
+    print_status(f"{test['name']} timed out.", 'LIGHTRED_EX')
+    return timeout_result(deadline, reason)
+
+def schedule_tests(test_names, settings, progress):
+    """
+    Runs the named tests concurrently and returns their results in registry order.
+    :param test_names: Names of the tests to run (keys of 'test_preferences').
+    :param settings: Settings dictionary; 'scheduler_settings' controls concurrency and time limits.
+    :param progress: Progress object from Rich library.
+
+    At most 'max_concurrency' tests run at once. A test listed in 'exclusive_tests' only
+    starts once nothing else is running and nothing else starts until it finishes; while
+    it waits, the tests queued behind it keep starting, so it never blocks the queue. A test
+    never starts before the enabled tests in its 'after' list have finished. Each result
+    is streamed to the configured exporters and the metrics endpoint as soon as its test
+    finishes.
+
+    A test still running after its 'test_timeouts' limit is cancelled and reported as
+    'Timeout' with its partial results. With 'timeout_policy' 'continue' the rest of the
+    pass goes on; with 'stop' the tests still running are cancelled too and those not yet
+    started are reported as 'Skipped'. Reaching 'pass_timeout' always does the latter, so
+    a pass never takes longer than its limit.
+    """
+    scheduler_settings = settings.get('scheduler_settings', {})
+    max_concurrency = max(1, int(scheduler_settings.get('max_concurrency', 4)))
+    exclusive_tests = set(scheduler_settings.get('exclusive_tests', ['Speedtest']))
+    stop_on_timeout = scheduler_settings.get('timeout_policy', 'continue') == 'stop'
+    pass_timeout = float(scheduler_settings.get('pass_timeout', 0) or 0)
+    pass_deadline = time.perf_counter() + pass_timeout if pass_timeout else math.inf
+    result_cache.configure(settings.get('cache_settings', {}))
+    latency_statistics.configure(settings.get('statistics_settings', {}))
+
+    pending = [test for test in NETWORK_TESTS if test['name'] in test_names]
+    enabled_names = {test['name'] for test in pending}
+    finished = set()
+    collected = {}
+    running = {}  # future -> (test, deadline)
+    stop_reason = None
+
+    def report(test, result):
+        finished.add(test['name'])
+        collected[test['result_key']] = result
+        report_result(test, result, settings)
+
+    def cut_off(future, reason):
+        test, deadline = running.pop(future)
+        report(test, cancel_test(test, deadline, reason))
+
+    while pending or running:
+        exclusive_running = any(test['name'] in exclusive_tests for test, _ in running.values())
+        for test in list(pending):
+            if stop_reason or exclusive_running or len(running) >= max_concurrency:
+                break
+            if any(dep in enabled_names and dep not in finished for dep in test['after']):
+                continue
+            if test['name'] in exclusive_tests:
+                if running:
+                    continue  # Waits for in-flight tests to drain; the tests behind it may still start
+                exclusive_running = True
+            pending.remove(test)
+            future, deadline = start_test(test, progress, settings)
+            running[future] = (test, deadline)
+
+        if not running:
+            if pending and not stop_reason:
+                logging.error("Unable to schedule tests: %s", [test['name'] for test in pending])
+            break
+
+        wake_at = min([pass_deadline] + [deadline.expires for _, deadline in running.values()])
+        done, _ = wait(running, timeout=None if wake_at == math.inf else max(0.0, wake_at - time.perf_counter()),
+                       return_when=FIRST_COMPLETED)
+        for future in done:
+            test, _ = running.pop(future)
+            report(test, future.result())
+
+        now = time.perf_counter()
+        if now >= pass_deadline and not stop_reason:
+            stop_reason = f"the pass reached its {pass_timeout:g} s time limit"
+            for future in list(running):
+                cut_off(future, stop_reason)
+        for future, (test, deadline) in list(running.items()):
+            if now >= deadline.expires:
+                cut_off(future, f"exceeded its {deadline.seconds:g} s time limit")
+                if stop_on_timeout and not stop_reason:
+                    stop_reason = f"{test['name']} timed out"
+                    for other in list(running):
+                        cut_off(other, f"cancelled because {stop_reason}")
+
+    for test in pending:
+        reason = f"not started because {stop_reason}" if stop_reason else "its dependencies never finished"
+        collected[test['result_key']] = {'result': 'Skipped', 'Error': reason, 'duration': 'N/A'}
+
+    with tracer.span('flush_exporters', 'report'):
+        flush_exporters(settings)
+        result_cache.save()
+        latency_statistics.save()
+    return {test['result_key']: collected[test['result_key']]
+            for test in NETWORK_TESTS if test['result_key'] in collected}
+
+def run_network_tests(settings):
+    from rich.progress import Progress, BarColumn, TextColumn, TimeElapsedColumn
+    logging.info("Starting network diagnostics tests")
+    clear_screen()
+    print("Starting network tests...")
+    tests = settings.get('test_preferences', {})  # Retrieve enabled tests from settings
+    enabled_tests = [test['name'] for test in NETWORK_TESTS if tests.get(test['name'], 'Disabled') == 'Enabled']
+
+    with Progress(
+        TextColumn("{task.description}", justify="right"),
+        BarColumn(bar_width=20),
+        TextColumn("{task.percentage:>3.0f}%"),
+        TimeElapsedColumn()
+    ) as progress:
+        results = schedule_tests(enabled_tests, settings, progress)
+
+    if results:
+        show_completion_notification(results, settings)
+    logging.info("Network diagnostics tests completed")
+    return results
+
+# --- Headless Progress ---
+class HeadlessProgress:
+    """Accepts the same calls as rich's Progress and draws nothing, for unattended runs."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._next_task = 0
+
+    def add_task(self, description, total=100, **kwargs):
+        with self._lock:
+            self._next_task += 1
+            return self._next_task
+
+    def update(self, task, **kwargs):
+        pass
+
+    def advance(self, task, advance=1):
+        pass
+
+# --- Monitoring Mode ---
+MONITOR_STOP_POLL = 0.5  # Longest wait before noticing a stop_event set from another thread
+
+def run_monitor(settings, stop_event=None, on_results=None, settings_loader=None):
+    """
+    Runs tests unattended, each on its own fixed interval, until SIGTERM/SIGINT or stop_event.
+    :param settings: Settings dictionary; 'monitor_settings' holds the per-test intervals.
+    :param stop_event: Optional threading.Event that ends the loop when set.
+    :param on_results: Optional callback receiving {result key: result} as each test finishes.
+    :param settings_loader: Optional callable (such as load_settings) asked for current
+                            settings whenever tests come due, so test settings edited while
+                            the monitor runs take effect without a restart. The intervals
+                            are fixed when the monitor starts.
+
+    Each test starts on a worker as soon as it is due, so a slow test never holds up the
+    ticks of the others; 'scheduler_settings' still bounds concurrency and run time. A due
+    test listed in 'exclusive_tests' waits for the running tests to finish and nothing new
+    starts meanwhile, so frequent tests cannot starve it.
+
+    Tick n of a test is due at start + n * interval, so run time never shifts the schedule,
+    and a test is only rescheduled once its run finishes, so it never overlaps itself. Ticks
+    missed while it was running or waiting are made up as soon as possible, at most
+    'max_catch_up' of them per test; older ones are skipped and logged. Stopping cancels
+    the running tests through their deadlines. Only the latest result of each test is
+    kept, so memory stays flat however long the monitor runs.
+    """
+    monitor_settings = settings.get('monitor_settings', {})
+    intervals = {name: float(seconds) for name, seconds in monitor_settings.get('intervals', {}).items()
+                 if seconds and any(test['name'] == name for test in NETWORK_TESTS)}
+    max_catch_up = max(1, int(monitor_settings.get('max_catch_up', 3)))
+    stop_event = stop_event or threading.Event()
+    wakeup = threading.Event()  # Set when a test finishes or a signal arrives
+
+    def request_stop(signum, frame):
+        stop_event.set()
+        wakeup.set()
+
+    if threading.current_thread() is threading.main_thread():
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signal_number, request_stop)
+
+    if not intervals:
+        logging.error("Monitoring mode has no tests to run; check 'monitor_settings.intervals'")
+        return {}
+
+    logging.info("Starting monitoring mode: %s", intervals)
+    print_status(f"Monitoring {', '.join(intervals)} (Ctrl+C or SIGTERM to stop)")
+    progress = HeadlessProgress()
+    tests = {test['name']: test for test in NETWORK_TESTS if test['name'] in intervals}
+    start = time.perf_counter()
+    due_heap = [(start, name) for name in tests]
+    heapq.heapify(due_heap)
+    waiting = []  # (due time, name) of due tests not started yet
+    running = {}  # future -> (test, deadline, due time)
+    latest = {}
+    result_cache.configure(settings.get('cache_settings', {}))
+    latency_statistics.configure(settings.get('statistics_settings', {}))
+
+    def complete(test, result, due_time):
+        latest[test['result_key']] = result
+        report_result(test, result, settings)
+        print_status(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')} {test['result_key']}: {result.get('result', 'N/A')} ({result.get('duration', 'N/A')})")
+        if on_results:
+            on_results({test['result_key']: result})
+
+        interval = intervals[test['name']]
+        next_due = due_time + interval
+        missed = int((time.perf_counter() - next_due) // interval)
+        if missed >= max_catch_up:
+            skipped = missed - max_catch_up + 1
+            next_due += skipped * interval
+            logging.warning("%s fell %s ticks behind; skipping %s", test['name'], missed + 1, skipped)
+        heapq.heappush(due_heap, (next_due, test['name']))
+
+    while not stop_event.is_set():
+        now = time.perf_counter()
+        if due_heap and due_heap[0][0] <= now:
+            while due_heap and due_heap[0][0] <= now:
+                waiting.append(heapq.heappop(due_heap))
+            if settings_loader:
+                settings = settings_loader() or settings
+                result_cache.configure(settings.get('cache_settings', {}))
+                latency_statistics.configure(settings.get('statistics_settings', {}))
+
+        scheduler_settings = settings.get('scheduler_settings', {})
+        max_concurrency = max(1, int(scheduler_settings.get('max_concurrency', 4)))
+        exclusive_tests = set(scheduler_settings.get('exclusive_tests', ['Speedtest']))
+        exclusive_running = any(test['name'] in exclusive_tests for test, _, _ in running.values())
+        for due_time, name in sorted(waiting):
+            if exclusive_running or len(running) >= max_concurrency:
+                break
+            if name in exclusive_tests:
+                if running:
+                    break  # Lets the running tests drain; nothing else starts before it
+                exclusive_running = True
+            waiting.remove((due_time, name))
+            future, deadline = start_test(tests[name], progress, settings)
+            future.add_done_callback(lambda _: wakeup.set())
+            running[future] = (tests[name], deadline, due_time)
+
+        wake_at = min([due_heap[0][0] if due_heap else math.inf]
+                      + [deadline.expires for _, deadline, _ in running.values()])
+        wakeup.wait(max(0.0, min(wake_at - time.perf_counter(), MONITOR_STOP_POLL)))
+        wakeup.clear()  # Before collecting, so a test finishing from here on wakes the next wait
+
+        now = time.perf_counter()
+        ended = 0
+        for future, (test, deadline, due_time) in list(running.items()):
+            if future.done():
+                result = future.result()
+            elif now >= deadline.expires:
+                result = cancel_test(test, deadline, f"exceeded its {deadline.seconds:g} s time limit")
+            else:
+                continue
+            del running[future]
+            complete(test, result, due_time)
+            ended += 1
+        if ended:
+            flush_exporters(settings)
+            result_cache.save()
+            latency_statistics.save()
 
-print("Package installation completed. Running the script...")
+    for test, deadline, _ in running.values():
+        logging.info("Cancelling %s test: monitoring stopped", test['name'])
+        deadline.cancel()
+    flush_exporters(settings)
+    result_cache.save()
+    latency_statistics.save()
+    logging.info("Monitoring mode stopped")
+    print_status("Monitoring stopped.")
+    return latest
 
-# --- Imports ---
-from datetime import datetime, timedelta
-from art import text2art
-import requests
-from plyer import notification
-import speedtest
-import colorama
-from colorama import Fore, Style
-import time
-from rich.progress import Progress, BarColumn, TextColumn, TimeElapsedColumn
-import threading
-import rich
-import art
-from pyshortcuts import make_shortcut
-from pathlib import Path
-   
-# --- Logging Setup ---
-import logging
-from pathlib import Path
-from datetime import datetime
+# --- Time-Series Store ---
+# One append-only file of float64 (timestamp, value) pairs per metric, plus 1-minute,
+# 1-hour and 1-day rollup files of (bucket start, count, sum, min, max) records.
+ROLLUP_RESOLUTIONS = {'1m': 60, '1h': 3600, '1d': 86400}
+RAW_FIELDS = 2
+ROLLUP_FIELDS = 5
+
+def duration_to_seconds(value):
+    """Converts a result 'duration' (str(timedelta) or a number) into float seconds."""
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        days, _, clock = str(value).rpartition(', ')
+        hours, minutes, seconds = clock.split(':')
+        day_count = int(days.split()[0]) if days else 0
+        return day_count * 86400 + int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    except (ValueError, IndexError):
+        return None
 
-# Disable logging
-logging.disable(logging.CRITICAL)
+def metric_slug(text):
+    return ''.join(character if character.isalnum() or character in '.-' else '_' for character in str(text).lower())
 
-# Get the directory of the current script
-script_directory = Path(__file__).parent
+def extract_metrics(results):
+    """Flattens a results dictionary into (series name, numeric value) pairs."""
+    metrics = []
+    for test, data in results.items():
+        if not isinstance(data, dict):
+            continue
+        prefix = metric_slug(test)
+        seconds = duration_to_seconds(data.get('duration'))
+        if seconds is not None:
+            metrics.append((f"{prefix}.duration_s", seconds))
+        metrics.append((f"{prefix}.passed", 1.0 if data.get('result') in PASSED_RESULTS else 0.0))
+        for target, summary in data.get('Targets', {}).items():
+            for field, name in (('avg', 'rtt_avg_ms'), ('min', 'rtt_min_ms'), ('max', 'rtt_max_ms'),
+                                ('jitter', 'jitter_ms'), ('loss', 'loss_pct')):
+                if summary.get(field) is not None:
+                    metrics.append((f"{prefix}.{metric_slug(target)}.{name}", float(summary[field])))
+        if data.get('Hops'):
+            metrics.append((f"{prefix}.hops", float(len(data['Hops']))))
+            if data['Hops'][-1].get('avg') is not None:
+                metrics.append((f"{prefix}.last_hop_rtt_ms", float(data['Hops'][-1]['avg'])))
+        for resolver, summary in data.get('Resolvers', {}).items():
+            for field in ('p50', 'p95', 'p99', 'timeouts'):
+                if summary.get(field) is not None:
+                    unit = '' if field == 'timeouts' else '_ms'
+                    metrics.append((f"{prefix}.{metric_slug(resolver)}.{field}{unit}", float(summary[field])))
+        for name, rates in data.get('Rates', {}).items():
+            for field, value in rates.items():
+                metrics.append((f"{prefix}.{metric_slug(name)}.{field}", float(value)))
+        for name, interface_changes in data.get('Changes', {}).items():
+            if isinstance(interface_changes, dict) and 'link_flaps' in interface_changes:
+                metrics.append((f"{prefix}.{metric_slug(name)}.link_flaps", float(interface_changes['link_flaps'])))
+        if 'Sockets' in data:
+            metrics.append((f"{prefix}.sockets", float(data['Sockets'])))
+            for family, states in data.get('States', {}).items():
+                for state, count in states.items():
+                    metrics.append((f"{prefix}.{family}_{state.lower()}", float(count)))
+        for url, summary in data.get('URLs', {}).items():
+            for state in ('cold', 'warm'):
+                for phase, value in (summary.get(state) or {}).items():
+                    metrics.append((f"{prefix}.{metric_slug(url)}.{state}_{phase}", float(value)))
+        for field, name in (('Download', 'download_mbps'), ('Upload', 'upload_mbps'), ('Ping', 'ping_ms')):
+            if isinstance(data.get(field), (int, float)):
+                metrics.append((f"{prefix}.{name}", float(data[field])))
+        for phase, value in data.get('Phases', {}).items():
+            metrics.append((f"{prefix}.phase_{metric_slug(phase)}_ms", float(value)))
+        if isinstance(data.get('RPM'), (int, float)):
+            metrics.append((f"{prefix}.rpm", float(data['RPM'])))
+        for direction, value in data.get('Added Latency', {}).items():
+            metrics.append((f"{prefix}.{direction}_added_latency_ms", float(value)))
+        for key, lookup in data.get('Cache', {}).items():
+            metrics.append((f"{prefix}.cache_{metric_slug(key)}_hit", 1.0 if lookup['hit'] else 0.0))
+        for name, report in data.get('Statistics', {}).items():
+            for window, summary in report['windows'].items():
+                for field, unit in (('p50', 'ms'), ('p99', 'ms'), ('p999', 'ms'), ('jitter', 'ms'), ('loss', 'pct')):
+                    if summary.get(field) is not None and summary['sent']:
+                        metrics.append((f"{prefix}.{metric_slug(name)}.{window}_{field}_{unit}", float(summary[field])))
+            for average, value in report['ewma'].items():
+                if value is not None:
+                    metrics.append((f"{prefix}.{metric_slug(name)}.ewma_{average}", float(value)))
+    return metrics
 
-# Create a Logs directory in the same directory as the script if not exists
-logs_directory = script_directory / 'Logs'
-if not logs_directory.exists():
-    logs_directory.mkdir()
+def merge_rollup_records(values):
+    """Merges adjacent rollup records that share a bucket start (partial buckets from restarts)."""
+    merged = array('d')
+    for index in range(0, len(values), ROLLUP_FIELDS):
+        start, count, total, low, high = values[index:index + ROLLUP_FIELDS]
+        if merged and merged[-ROLLUP_FIELDS] == start:
+            merged[-4] += count
+            merged[-3] += total
+            merged[-2] = min(merged[-2], low)
+            merged[-1] = max(merged[-1], high)
+        else:
+            merged.extend((start, count, total, low, high))
+    return merged
 
-# Get current date and time for the log file name
-current_time = datetime.now()
-log_filename = current_time.strftime("log-%m-%d-%Y-%H-%M.txt")  # Replaced ':' with '-'
+class DirectoryLock:
+    """
+    Exclusive lock on a '.lock' file, held by one process (and one thread) at a time, so
+    that several processes can share a store directory, e.g. 'monitor' alongside a 'run'
+    from cron.
+    """
+    def __init__(self, directory):
+        self.path = Path(directory) / '.lock'
+        self._thread_lock = threading.Lock()
+        self._file = None
 
-# Full path for the log file
-full_log_path = logs_directory / log_filename
+    def __enter__(self):
+        self._thread_lock.acquire()
+        try:
+            self._file = open(self.path, 'a+b')
+            if os.name == 'nt':
+                import msvcrt
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        except BaseException:
+            if self._file is not None:
+                self._file.close()
+            self._thread_lock.release()
+            raise
+        return self
 
-# Check if logging is enabled for the DEBUG level
-if logging.getLogger().isEnabledFor(logging.DEBUG):
-    # Configure logging
-    logging.basicConfig(
-        level=logging.DEBUG,
-        format="%(asctime)s %(levelname)s %(message)s",
-        datefmt="%Y-%m-%d %H:%M:%S",
-        handlers=[
-            logging.FileHandler(full_log_path, mode='a')  # Corrected to use the full_log_path variable
-        ]
-    )
+    def __exit__(self, *exc_info):
+        try:
+            if os.name == 'nt':
+                import msvcrt
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        finally:
+            self._file.close()
+            self._thread_lock.release()
 
-# --- Initialize colorama ---
-colorama.init(autoreset=True)
+def sort_records(values, fields):
+    """The records of a flat array in timestamp order (stable, so partial rollups keep their order)."""
+    timestamps = values[::fields]
+    if all(a <= b for a, b in zip(timestamps, timestamps[1:])):
+        return values
+    records = sorted((values[index:index + fields] for index in range(0, len(values), fields)), key=lambda r: r[0])
+    return array('d', [value for record in records for value in record])
 
-# --- Clear Screen Function ---
-def clear_screen():
-    logging.debug("Clearing the screen")
-    try:
-        if os.name == 'nt':
-            _ = os.system('cls')
+def bisect_record_file(file, count, fields, timestamp, right=False):
+    """Index of the first record in a sorted file whose timestamp is >= (or, with right, >) timestamp."""
+    record_bytes = fields * array('d').itemsize
+    low, high = 0, count
+    while low < high:
+        middle = (low + high) // 2
+        file.seek(middle * record_bytes)
+        found = array('d', file.read(array('d').itemsize))[0]
+        if found < timestamp or (right and found == timestamp):
+            low = middle + 1
         else:
-            _ = os.system('clear')
+            high = middle
+    return low
+
+class TimeSeriesStore:
+    """
+    Append-only metric store. Samples are buffered in memory and written by flush();
+    rollup buckets are written once they close, and close() writes the still-open ones
+    (readers merge the resulting partial records). Raw samples and 1-minute rollups are
+    dropped once older than their retention period.
+
+    Every file is kept in timestamp order, so reads can seek straight to their window.
+    Writers hold a lock shared by every process using the directory, and a batch older
+    than the end of its file (another process wrote in between) is merged into the tail.
+    """
+
+    def __init__(self, directory, retention_days=None, compaction_interval=3600):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.retention_days = {'raw': 7, '1m': 90, '1h': 0, '1d': 0, **(retention_days or {})}
+        self.compaction_interval = compaction_interval
+        self._pending = {}
+        self._open_buckets = {}
+        self._closed_buckets = {}
+        self._last_compaction = 0.0
+        self._lock = threading.Lock()
+        self._file_lock = DirectoryLock(self.directory)
+
+    def _path(self, series, resolution='raw'):
+        return self.directory / f"{metric_slug(series)}.{resolution}"
+
+    def append(self, series, value, timestamp=None):
+        timestamp = time.time() if timestamp is None else timestamp
+        with self._lock:
+            self._pending.setdefault(series, array('d')).extend((timestamp, value))
+            for resolution, width in ROLLUP_RESOLUTIONS.items():
+                bucket_start = timestamp - timestamp % width
+                bucket = self._open_buckets.get((series, resolution))
+                if bucket is not None and bucket[0] != bucket_start:
+                    self._closed_buckets.setdefault((series, resolution), array('d')).extend(bucket)
+                    bucket = None
+                if bucket is None:
+                    self._open_buckets[(series, resolution)] = array('d', (bucket_start, 1, value, value, value))
+                else:
+                    bucket[1] += 1
+                    bucket[2] += value
+                    bucket[3] = min(bucket[3], value)
+                    bucket[4] = max(bucket[4], value)
+
+    def append_results(self, results, timestamp=None):
+        timestamp = time.time() if timestamp is None else timestamp
+        for series, value in extract_metrics(results):
+            self.append(series, value, timestamp)
+
+    def flush(self, include_open_buckets=False):
+        with self._lock:
+            writes = [(self._path(series), values) for series, values in self._pending.items()]
+            if include_open_buckets:
+                for key, bucket in self._open_buckets.items():
+                    self._closed_buckets.setdefault(key, array('d')).extend(bucket)
+                self._open_buckets = {}
+            writes += [(self._path(*key), values) for key, values in self._closed_buckets.items()]
+            self._pending = {}
+            self._closed_buckets = {}
+        if writes:
+            with self._file_lock:
+                for path, values in writes:
+                    self._write_sorted(path, values, RAW_FIELDS if path.suffix == '.raw' else ROLLUP_FIELDS)
+        if time.time() - self._last_compaction >= self.compaction_interval:
+            self.compact()
+
+    def close(self):
+        self.flush(include_open_buckets=True)
+
+    def _write_sorted(self, path, values, fields):
+        """Appends records to a file, merging them into its tail when they are older than its end."""
+        if not values:
+            return
+        values = sort_records(values, fields)
+        record_bytes = fields * values.itemsize
+        with open(path, 'a+b') as file:
+            count = file.seek(0, os.SEEK_END) // record_bytes
+            file.truncate(count * record_bytes)  # Drops a record cut short by a crash mid-write
+            position = bisect_record_file(file, count, fields, values[0], right=True)
+            tail = array('d')
+            file.seek(position * record_bytes)
+            tail.frombytes(file.read())
+            if tail:
+                values = sort_records(tail + values, fields)
+                file.truncate(position * record_bytes)
+            file.seek(0, os.SEEK_END)
+            values.tofile(file)
+
+    def _load(self, path, start=None, end=None, fields=RAW_FIELDS):
+        """Records of a file between two timestamps, reading only that byte range."""
+        values = array('d')
+        record_bytes = fields * values.itemsize
+        try:
+            with open(path, 'rb') as file:
+                count = file.seek(0, os.SEEK_END) // record_bytes
+                first = bisect_record_file(file, count, fields, start) if start is not None else 0
+                last = bisect_record_file(file, count, fields, end, right=True) if end is not None else count
+                if last > first:
+                    file.seek(first * record_bytes)
+                    values.frombytes(file.read((last - first) * record_bytes))
+        except FileNotFoundError:
+            pass
+        return values
+
+    def compact(self, now=None):
+        """
+        Rewrites files whose oldest records fall outside their retention period, and sorts
+        any file found out of timestamp order (written by an older version).
+        """
+        now = time.time() if now is None else now
+        self._last_compaction = now
+        for resolution, days in self.retention_days.items():
+            if not days:
+                continue
+            fields = RAW_FIELDS if resolution == 'raw' else ROLLUP_FIELDS
+            cutoff = now - days * 86400
+            for path in self.directory.glob(f"*.{resolution}"):
+                with self._file_lock:
+                    stored = self._load(path, fields=fields)
+                    values = sort_records(stored, fields)
+                    if not values or (values is stored and values[0] >= cutoff):
+                        continue
+                    keep_from = bisect.bisect_left(values[::fields], cutoff) * fields
+                    temporary_path = path.with_name(path.name + '.tmp')
+                    with open(temporary_path, 'wb') as file:
+                        values[keep_from:].tofile(file)
+                    os.replace(temporary_path, path)
+                logging.debug("Compacted %s: dropped %s records", path.name, keep_from // fields)
+
+    def series(self):
+        return sorted({path.stem for path in self.directory.glob('*.raw')})
+
+    def read(self, series, start=None, end=None, resolution='1h'):
+        """
+        Reads one series between two epoch timestamps.
+        :param resolution: 'raw', '1m', '1h' or '1d'.
+        :return: For 'raw', {'timestamp': array, 'value': array}; for rollups,
+                 {'timestamp', 'count', 'sum', 'min', 'max'} arrays, one entry per bucket.
+        """
+        self.flush()
+        fields = RAW_FIELDS if resolution == 'raw' else ROLLUP_FIELDS
+        with self._file_lock:
+            window = self._load(self._path(series, resolution), start, end, fields)
+        if resolution != 'raw':
+            window = merge_rollup_records(window)
+        names = ('timestamp', 'value') if resolution == 'raw' else ('timestamp', 'count', 'sum', 'min', 'max')
+        return {name: window[offset::fields] for offset, name in enumerate(names)}
+
+    def summarize(self, series, start=None, end=None, resolution='1h'):
+        """Count, mean, min and max of a series over a period, computed from its rollups."""
+        columns = self.read(series, start, end, resolution)
+        count = sum(columns['count']) if resolution != 'raw' else len(columns['value'])
+        if not count:
+            return {'count': 0, 'avg': None, 'min': None, 'max': None}
+        if resolution == 'raw':
+            return {'count': count, 'avg': sum(columns['value']) / count,
+                    'min': min(columns['value']), 'max': max(columns['value'])}
+        return {'count': int(count), 'avg': sum(columns['sum']) / count,
+                'min': min(columns['min']), 'max': max(columns['max'])}
+
+timeseries_stores = {}
+
+def get_timeseries_store(settings):
+    """Returns the process-wide store for the configured directory, or None when disabled."""
+    timeseries_settings = settings.get('timeseries_settings', {})
+    if not timeseries_settings.get('enabled', True):
+        return None
+    directory = Path(__file__).parent / timeseries_settings.get('directory', 'Results/timeseries')
+    if directory not in timeseries_stores:
+        timeseries_stores[directory] = TimeSeriesStore(directory, timeseries_settings.get('retention_days'))
+        atexit.register(timeseries_stores[directory].close)
+    return timeseries_stores[directory]
+
+def record_results(results, settings):
+    """Appends a batch of results to the time-series store, if it is enabled."""
+    try:
+        store = get_timeseries_store(settings)
+        if store is not None and results:
+            store.append_results(results)
+            store.flush()
+            logging.debug("Recorded %s results in the time-series store", len(results))
     except Exception as e:
-        logging.error(f"Error clearing screen: {e}")
-    finally:
-        display_script_name()
-        
-# --- Create Shortcut ---
-def create_shortcut(shortcut_name):
-    logging.info(f"Creating shortcut: {shortcut_name}")
+        logging.error("Error recording results in the time-series store: %s", e)
+
+# --- Result Exporters ---
+def result_to_record(test, data, timestamp=None):
+    """
+    Converts one test result into a typed record: epoch 'timestamp', 'test', 'result',
+    'duration_s' (float seconds) and a flat 'metrics' dictionary of floats whose names
+    carry their unit (ms, pct, mbps, s).
+    """
+    prefix = metric_slug(test) + '.'
+    metrics = {series[len(prefix):]: value for series, value in extract_metrics({test: data})}
+    record = {'timestamp': time.time() if timestamp is None else timestamp,
+              'test': test,
+              'result': data.get('result', 'N/A') if isinstance(data, dict) else str(data),
+              'duration_s': metrics.pop('duration_s', None),
+              'metrics': metrics}
+    if isinstance(data, dict) and 'Error' in data:
+        record['error'] = str(data['Error'])
+    return record
+
+def record_rows(record):
+    """Narrow (timestamp, test, result, metric, value) rows for tabular formats."""
+    rows = [(record['timestamp'], record['test'], record['result'], 'duration_s', record['duration_s'])]
+    rows.extend((record['timestamp'], record['test'], record['result'], metric, value)
+                for metric, value in record['metrics'].items())
+    return rows
+
+class BufferedExporter:
+    """
+    Keeps one output file open for the life of the process and writes records in batches:
+    when 'batch_size' records are buffered, when the oldest is 'flush_interval' seconds
+    old, or when flush() is called at the end of a pass.
+    """
+    extension = ''
+    binary = False
+
+    def __init__(self, directory, batch_size=100, flush_interval=5.0):
+        self.path = Path(directory) / f"results.{self.extension}"
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.buffer = []
+        self.oldest = None
+        self.lock = threading.Lock()
+        is_new = not self.path.exists() or self.path.stat().st_size == 0
+        self.file = open(self.path, 'ab' if self.binary else 'a', **({} if self.binary else {'newline': '', 'encoding': 'utf-8'}))
+        if is_new:
+            self.write_header()
+
+    def write_header(self):
+        pass
+
+    def write(self, record):
+        with self.lock:
+            self.buffer.append(record)
+            self.oldest = self.oldest or time.monotonic()
+            due = len(self.buffer) >= self.batch_size or time.monotonic() - self.oldest >= self.flush_interval
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            records, self.buffer, self.oldest = self.buffer, [], None
+            if records:
+                self.write_batch(records)
+                self.file.flush()
+
+    def write_batch(self, records):
+        raise NotImplementedError
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+class JsonLinesExporter(BufferedExporter):
+    extension = 'jsonl'
+
+    def write_batch(self, records):
+        self.file.write(''.join(json.dumps(record, separators=(',', ':')) + '\n' for record in records))
+
+class CsvExporter(BufferedExporter):
+    extension = 'csv'
+    columns = ('timestamp', 'test', 'result', 'metric', 'value')
+
+    def write_header(self):
+        csv.writer(self.file).writerow(self.columns)
+
+    def write_batch(self, records):
+        csv.writer(self.file).writerows(row for record in records for row in record_rows(record))
+
+class ColumnarExporter(BufferedExporter):
+    """
+    Appends one self-describing block per batch:
+      b'NDC1', uint32 row count, uint16 column count, then for each column a uint8-length
+      name, a type byte ('d' float64 values, NaN for missing; 's' dictionary-encoded
+      strings: uint32 entry count, uint16-length UTF-8 entries, uint32 index per row).
+    All integers are little-endian.
+    """
+    extension = 'ndcol'
+    binary = True
+    columns = (('timestamp', 'd'), ('test', 's'), ('result', 's'), ('metric', 's'), ('value', 'd'))
+
+    def write_batch(self, records):
+        rows = [row for record in records for row in record_rows(record)]
+        block = [b'NDC1', struct.pack('<IH', len(rows), len(self.columns))]
+        for index, (name, kind) in enumerate(self.columns):
+            block.append(struct.pack('<B', len(name)) + name.encode() + kind.encode())
+            values = [row[index] for row in rows]
+            if kind == 'd':
+                column = array('d', (math.nan if value is None else value for value in values))
+                if sys.byteorder != 'little':
+                    column.byteswap()
+                block.append(column.tobytes())
+            else:
+                entries = list(dict.fromkeys(values))
+                lookup = {entry: position for position, entry in enumerate(entries)}
+                block.append(struct.pack('<I', len(entries)))
+                block.extend(struct.pack('<H', len(entry.encode())) + entry.encode() for entry in entries)
+                indices = array('I', (lookup[value] for value in values))
+                if sys.byteorder != 'little':
+                    indices.byteswap()
+                block.append(indices.tobytes())
+        self.file.write(b''.join(block))
+
+def read_columnar(path):
+    """Yields each block of a ColumnarExporter file as a dictionary of column lists."""
+    with open(path, 'rb') as file:
+        data = file.read()
+    offset = 0
+    while offset < len(data):
+        if data[offset:offset + 4] != b'NDC1':
+            raise ValueError(f"Corrupt columnar block at byte {offset}")
+        rows, column_count = struct.unpack_from('<IH', data, offset + 4)
+        offset += 10
+        block = {}
+        for _ in range(column_count):
+            name_length = data[offset]
+            name = data[offset + 1:offset + 1 + name_length].decode()
+            kind = chr(data[offset + 1 + name_length])
+            offset += 2 + name_length
+            if kind == 'd':
+                column = array('d', data[offset:offset + rows * 8])
+                if sys.byteorder != 'little':
+                    column.byteswap()
+                offset += rows * 8
+            else:
+                (entry_count,) = struct.unpack_from('<I', data, offset)
+                offset += 4
+                entries = []
+                for _ in range(entry_count):
+                    (length,) = struct.unpack_from('<H', data, offset)
+                    entries.append(data[offset + 2:offset + 2 + length].decode())
+                    offset += 2 + length
+                indices = array('I', data[offset:offset + rows * 4])
+                if sys.byteorder != 'little':
+                    indices.byteswap()
+                offset += rows * 4
+                column = [entries[index] for index in indices]
+            block[name] = list(column)
+        yield block
+
+EXPORTERS = {'jsonl': JsonLinesExporter, 'csv': CsvExporter, 'columnar': ColumnarExporter}
+active_exporters = {}
+active_exporters_lock = threading.Lock()
+
+def get_exporters(settings):
+    """Returns the process-wide exporters selected in 'export_settings' (empty when disabled)."""
+    export_settings = settings.get('export_settings', {})
+    if not export_settings.get('enabled', False):
+        return []
+    directory = Path(__file__).parent / export_settings.get('directory', 'Results/export')
+    exporters = []
+    with active_exporters_lock:
+        for name in export_settings.get('formats', ['jsonl']):
+            if name not in EXPORTERS:
+                logging.error("Unknown export format: %s", name)
+                continue
+            key = (name, directory)
+            if key not in active_exporters:
+                active_exporters[key] = EXPORTERS[name](directory,
+                                                        batch_size=int(export_settings.get('batch_size', 100)),
+                                                        flush_interval=float(export_settings.get('flush_interval', 5.0)))
+                atexit.register(active_exporters[key].close)
+            exporters.append(active_exporters[key])
+    return exporters
+
+def export_result(test, data, settings):
+    """Streams one finished test result to every enabled exporter."""
     try:
-        script_path = Path(__file__).resolve()
-        icon_path = script_path.parent / "icon.ico"
+        exporters = get_exporters(settings)
+        if exporters:
+            record = result_to_record(test, data)
+            for exporter in exporters:
+                exporter.write(record)
+    except Exception as e:
+        logging.error("Error exporting %s result: %s", test, e)
 
-        make_shortcut(
-            script=str(script_path),
-            name=shortcut_name,
-            icon=str(icon_path),
-            terminal=False,  
-            desktop=True,  
-        )
-        logging.info(f"Shortcut '{shortcut_name}' created successfully on the desktop.")
+def flush_exporters(settings):
+    try:
+        for exporter in get_exporters(settings):
+            exporter.flush()
     except Exception as e:
-        logging.error(f"Error in shortcut creation process: {e}")
+        logging.error("Error flushing exporters: %s", e)
 
-# --- Display Script Name ---
-def display_script_name():
-    title_color = colorama.Fore.LIGHTYELLOW_EX
-    author_color = colorama.Fore.MAGENTA
-    print(title_color + text2art("Network Diagnostics"), end='')
-    print(author_color + "By AztecViper\n")
-    
-# --- Progress Function ---
-def run_command_with_progress(command, progress_task, progress, update_interval=0.5):
+# --- Metrics Endpoint ---
+DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+def escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_metric_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label_value(value)}"' for name, value in labels) + '}'
+
+class MetricsRegistry:
     """
-    Runs a command in a separate thread and updates the progress bar periodically.
-    :param command: Command to be executed as a list.
-    :param progress_task: Task ID for the progress bar.
-    :param progress: Progress object from Rich library.
-    :param update_interval: Time interval (in seconds) for progress updates.
+    Latest and aggregated test metrics in the Prometheus text format. Every update
+    re-renders the exposition once into 'rendered', so a scrape only copies bytes.
     """
-    def command_thread():
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._families = {}
+        self.rendered = b''
+
+    def _family(self, name, kind, help_text, buckets=None):
+        return self._families.setdefault(name, {'kind': kind, 'help': help_text, 'buckets': buckets, 'series': {}})
+
+    def set_gauge(self, name, help_text, labels, value):
+        self._family(name, 'gauge', help_text)['series'][tuple(labels)] = float(value)
+
+    def inc_counter(self, name, help_text, labels, amount=1.0):
+        series = self._family(name, 'counter', help_text)['series']
+        series[tuple(labels)] = series.get(tuple(labels), 0.0) + amount
+
+    def observe(self, name, help_text, buckets, labels, value):
+        family = self._family(name, 'histogram', help_text, buckets)
+        state = family['series'].setdefault(tuple(labels), [0] * len(buckets) + [0.0, 0])
+        for index, bound in enumerate(buckets):
+            if value <= bound:
+                state[index] += 1
+        state[-2] += value
+        state[-1] += 1
+
+    def record_result(self, test, data, timestamp=None):
+        """Folds one test result into the metric families and re-renders the exposition."""
+        if not isinstance(data, dict):
+            return
+        with self._lock:
+            labels = [('test', test)]
+            passed = data.get('result') in PASSED_RESULTS
+            self.set_gauge('netdiag_test_up', "1 if the last run of the test passed, else 0.", labels, 1.0 if passed else 0.0)
+            self.inc_counter('netdiag_test_runs_total', "Test runs by outcome.", labels + [('result', data.get('result', 'N/A'))])
+            self.set_gauge('netdiag_test_last_run_timestamp_seconds', "Unix time the test last finished.", labels,
+                           time.time() if timestamp is None else timestamp)
+            seconds = duration_to_seconds(data.get('duration'))
+            if seconds is not None:
+                self.set_gauge('netdiag_test_last_duration_seconds', "Duration of the last run of the test.", labels, seconds)
+                self.observe('netdiag_test_duration_seconds', "Test durations.", DURATION_BUCKETS, labels, seconds)
+
+            for target, summary in data.get('Targets', {}).items():
+                target_labels = [('target', target)]
+                self.set_gauge('netdiag_ping_loss_ratio', "Fraction of probes lost in the last ping run.", target_labels,
+                               summary.get('loss', 100.0) / 100)
+                if summary.get('avg') is not None:
+                    self.set_gauge('netdiag_ping_rtt_seconds', "Average RTT of the last ping run.", target_labels, summary['avg'] / 1000)
+                    self.set_gauge('netdiag_ping_jitter_seconds', "RTT jitter of the last ping run.", target_labels, summary['jitter'] / 1000)
+                    self.observe('netdiag_ping_rtt_distribution_seconds', "Average RTT per ping run.", LATENCY_BUCKETS,
+                                 target_labels, summary['avg'] / 1000)
+
+            for resolver, summary in data.get('Resolvers', {}).items():
+                resolver_labels = [('resolver', resolver)]
+                # A 'percentile' label, not 'quantile': these are snapshots of one run, so they
+                # stay gauges rather than a summary with cumulative _sum and _count
+                for field in ('p50', 'p95', 'p99'):
+                    if summary.get(field) is not None:
+                        self.set_gauge('netdiag_dns_latency_seconds', "DNS query latency percentiles of the last run.",
+                                       resolver_labels + [('percentile', field)], summary[field] / 1000)
+                self.inc_counter('netdiag_dns_queries_total', "DNS queries sent.", resolver_labels, summary.get('queries', 0))
+                self.inc_counter('netdiag_dns_timeouts_total', "DNS queries that timed out.", resolver_labels, summary.get('timeouts', 0))
+                if summary.get('p50') is not None:
+                    self.observe('netdiag_dns_median_latency_distribution_seconds', "Median DNS latency per run.",
+                                 LATENCY_BUCKETS, resolver_labels, summary['p50'] / 1000)
+
+            for name, rates in data.get('Rates', {}).items():
+                for direction in ('rx', 'tx'):
+                    self.set_gauge('netdiag_interface_bits_per_second', "Interface traffic rate between the last two runs.",
+                                   [('interface', name), ('direction', direction)], rates[f"{direction}_bps"])
+                self.inc_counter('netdiag_interface_errors_total', "Interface errors seen between runs.",
+                                 [('interface', name)], rates['errors'])
+                self.inc_counter('netdiag_interface_drops_total', "Interface drops seen between runs.",
+                                 [('interface', name)], rates['drops'])
+            for name, interface_changes in data.get('Changes', {}).items():
+                if isinstance(interface_changes, dict) and 'link_flaps' in interface_changes:
+                    self.inc_counter('netdiag_interface_link_flaps_total', "Carrier changes seen between runs.",
+                                     [('interface', name)], interface_changes['link_flaps'])
+
+            for family, states in data.get('States', {}).items():
+                for state, count in states.items():
+                    self.set_gauge('netdiag_sockets', "Sockets by protocol and state in the last snapshot.",
+                                   [('protocol', family), ('state', state)], count)
+
+            for url, summary in data.get('URLs', {}).items():
+                for state in ('cold', 'warm'):
+                    for phase, value in (summary.get(state) or {}).items():
+                        self.set_gauge('netdiag_http_phase_seconds', "HTTP request phase timings of the last run.",
+                                       [('url', url), ('connection', state), ('phase', phase[:-3])], value / 1000)
+
+            if data.get('Hops'):
+                self.set_gauge('netdiag_traceroute_hops', "Hops to the traceroute destination.", labels, len(data['Hops']))
+
+            for field, direction in (('Download', 'download'), ('Upload', 'upload')):
+                if isinstance(data.get(field), (int, float)):
+                    self.set_gauge('netdiag_throughput_bits_per_second', "Throughput of the last run.",
+                                   labels + [('direction', direction)], data[field] * 1e6)
+            if isinstance(data.get('RPM'), (int, float)):
+                self.set_gauge('netdiag_responsiveness_rpm', "Round trips per minute with the link loaded.", labels, data['RPM'])
+            for direction, value in data.get('Added Latency', {}).items():
+                self.set_gauge('netdiag_added_latency_seconds', "Latency added by loading the link, per direction.",
+                               labels + [('direction', direction)], value / 1000)
+            for key, lookup in data.get('Cache', {}).items():
+                self.inc_counter('netdiag_cache_lookups_total', "Result cache lookups by outcome.",
+                                 labels + [('key', key), ('result', 'hit' if lookup['hit'] else 'miss')])
+            for name, report in data.get('Statistics', {}).items():
+                series_labels = labels + [('target', name)]
+                for window, summary in report['windows'].items():
+                    if not summary['sent']:
+                        continue
+                    window_labels = series_labels + [('window', window)]
+                    for field in SUMMARY_PERCENTILES:
+                        if summary[field] is not None:
+                            self.set_gauge('netdiag_latency_seconds', "Latency percentiles over a rolling window.",
+                                           window_labels + [('percentile', field)], summary[field] / 1000)
+                    if summary['jitter'] is not None:
+                        self.set_gauge('netdiag_latency_jitter_seconds', "Latency jitter over a rolling window.",
+                                       window_labels, summary['jitter'] / 1000)
+                    self.set_gauge('netdiag_latency_loss_ratio', "Fraction of probes lost over a rolling window.",
+                                   window_labels, summary['loss'] / 100)
+                if report['ewma'].get('rtt_ms') is not None:
+                    self.set_gauge('netdiag_latency_ewma_seconds', "Exponentially weighted average latency.",
+                                   series_labels, report['ewma']['rtt_ms'] / 1000)
+            for phase, value in data.get('Phases', {}).items():
+                self.set_gauge('netdiag_test_phase_seconds', "Time spent in each phase of the last run of the test.",
+                               labels + [('phase', phase)], value / 1000)
+            self.rendered = self._render()
+
+    def _render(self):
+        lines = []
+        for name, family in sorted(self._families.items()):
+            lines.append(f"# HELP {name} {family['help']}")
+            lines.append(f"# TYPE {name} {family['kind']}")
+            for labels, value in sorted(family['series'].items()):
+                if family['kind'] != 'histogram':
+                    lines.append(f"{name}{format_metric_labels(labels)} {value:.12g}")
+                    continue
+                for bound, count in zip(family['buckets'], value):
+                    lines.append(f"{name}_bucket{format_metric_labels(labels + (('le', repr(bound)),))} {count}")
+                lines.append(f"{name}_bucket{format_metric_labels(labels + (('le', '+Inf'),))} {value[-1]}")
+                lines.append(f"{name}_sum{format_metric_labels(labels)} {value[-2]:.12g}")
+                lines.append(f"{name}_count{format_metric_labels(labels)} {value[-1]}")
+        return ('\n'.join(lines) + '\n').encode('utf-8')
+
+metrics_registry = None
+
+def publish_metrics(test, data):
+    """Feeds a finished test result to the metrics endpoint, when one is running."""
+    if metrics_registry is not None:
         try:
-            response = subprocess.run(command, capture_output=True, text=True)
-            if response.returncode != 0:
-                logging.warning(f"Command '{' '.join(command)}' returned a non-zero exit status: {response.returncode}")
-            else:
-                logging.debug(f"Command executed successfully: {' '.join(command)}")
-            progress.update(progress_task, completed=100)  # Mark as completed when command finishes
+            metrics_registry.record_result(test, data)
         except Exception as e:
-            logging.error(f"Error occurred while executing command: {' '.join(command)}. Error: {e}")
-            progress.update(progress_task, completed=100)  # Mark as completed even if there's an error
+            logging.error("Error updating metrics for %s: %s", test, e)
 
-    # Start the command execution in a separate thread
-    thread = threading.Thread(target=command_thread)
-    thread.start()
-
-    # Update progress in the main thread until the command thread completes
-    logging.info(f"Starting command: {' '.join(command)}")
-    while thread.is_alive():
-        time.sleep(update_interval)
-        progress.advance(progress_task)
+def start_metrics_server(settings, port=None):
+    """
+    Starts the HTTP metrics endpoint on a daemon thread if 'metrics_settings' enables it
+    (or a port is given). GET /metrics returns the pre-rendered exposition.
+    :return: The HTTP server, or None when disabled or already running.
+    """
+    global metrics_registry
+    metrics_settings = settings.get('metrics_settings', {})
+    if metrics_registry is not None or (port is None and not metrics_settings.get('enabled', False)):
+        return None
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    registry = MetricsRegistry()
 
-    logging.info(f"Command completed: {' '.join(command)}")
-    
-# --- Network Diagnostics Tests ---
-def run_network_tests(settings):
-    logging.info("Starting network diagnostics tests")
-    clear_screen()
-    print("Starting network tests...")
-    results = {}
-    tests = settings.get('test_preferences', {})  # Retrieve enabled tests from settings
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?', 1)[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.rendered
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
 
-    with Progress(
-        TextColumn("{task.description}", justify="right"),
-        BarColumn(bar_width=20),
-        TextColumn("{task.percentage:>3.0f}%"),
-        TimeElapsedColumn()
-    ) as progress:
-        
-        # Ping Test
-        if tests.get('Ping', 'Disabled') == 'Enabled':
-            logging.debug("Ping test enabled, starting test")
-            ping_task = progress.add_task("Running Ping Test...", total=100)
-            start_time = time.time()
-            run_command_with_progress(["ping", "-n", "4", "8.8.8.8"], ping_task, progress)
-            ping_response = subprocess.run(["ping", "-n", "4", "8.8.8.8"], capture_output=True, text=True)
-            duration = time.time() - start_time
-            results['Ping Test'] = {'result': 'Passed' if ping_response.returncode == 0 else 'Failed',
-                                    'duration': str(timedelta(seconds=duration))}
-            print(Fore.GREEN + "Ping Test completed.")
-            if ping_response.returncode == 0:
-                logging.info("Ping Test completed successfully")
-            else:
-                logging.error("Ping Test failed")
-
-        # Traceroute Test
-        if tests.get('Traceroute', 'Disabled') == 'Enabled':
-            logging.debug("Traceroute test enabled, starting test")
-            traceroute_task = progress.add_task("Running Traceroute Test...", total=100)
-            start_time = time.time()
-            run_command_with_progress(["tracert", "8.8.8.8"], traceroute_task, progress)
-            traceroute_response = subprocess.run(["tracert", "8.8.8.8"], capture_output=True, text=True)
-            duration = time.time() - start_time
-            results['Traceroute Test'] = {'result': 'Passed' if traceroute_response.returncode == 0 else 'Failed',
-                                          'duration': str(timedelta(seconds=duration))}
-            print(Fore.GREEN + "Traceroute Test completed.")
-            if traceroute_response.returncode == 0:
-                logging.info("Traceroute Test completed successfully")
-            else:
-                logging.error("Traceroute Test failed")
-    
-        # IP Configuration Test
-        if tests.get('IP Configuration', 'Disabled') == 'Enabled':
-            logging.debug("IP Configuration test enabled, starting test")
-            ipconfig_task = progress.add_task("Running IP Configuration Test...", total=100)
-            start_time = time.time()
-            run_command_with_progress(["ipconfig", "/all"], ipconfig_task, progress)
-            ipconfig_response = subprocess.run(["ipconfig", "/all"], capture_output=True, text=True)
-            duration = time.time() - start_time
-            results['IP Configuration'] = {'result': 'Passed' if ipconfig_response.returncode == 0 else 'Failed',
-                                           'duration': str(timedelta(seconds=duration))}
-            print(Fore.GREEN + "IP Configuration Test completed.")
-            if ipconfig_response.returncode == 0:
-                logging.info("IP Configuration Test completed successfully")
-            else:
-                logging.error("IP Configuration Test failed")
-
-        # Current Public IP Test
-        if tests.get('Current Public IP', 'Disabled') == 'Enabled':
-            logging.debug("Current Public IP test enabled, starting test")
-            current_ip_task = progress.add_task("Retrieving Current Public IP...", total=100)
-            start_time = time.time()
-            run_command_with_progress(["curl", "https://api.ipify.org"], current_ip_task, progress)
-            try:
-                public_ip = requests.get('https://api.ipify.org').text
-                duration = time.time() - start_time
-                results['Current Public IP'] = {'result': 'Completed', 'IP': public_ip,
-                                                'duration': str(datetime.timedelta(seconds=duration))}
-                print(Fore.GREEN + "Current Public IP Test completed.")
-            except Exception as e:
-                duration = time.time() - start_time
-                results['Current Public IP'] = {'result': 'Failed', 'Error': str(e),
-                                                'duration': str(timedelta(seconds=duration))}
-                print(Fore.LIGHTRED_EX + "Failed to retrieve Current Public IP.")
-            if 'IP' in results['Current Public IP']:
-                logging.info("Current Public IP Test completed successfully")
-            else:
-                logging.error("Current Public IP Test failed")
-
-        # DNS Flush Test
-        if tests.get('DNS Flush', 'Disabled') == 'Enabled':
-            logging.debug("DNS Flush test enabled, starting test")
-            dnsflush_task = progress.add_task("Running DNS Flush...", total=100)
-            start_time = time.time()
-            run_command_with_progress(["ipconfig", "/flushdns"], dnsflush_task, progress)
-            dns_flush_response = subprocess.run(["ipconfig", "/flushdns"], capture_output=True, text=True)
-            duration = time.time() - start_time
-            results['DNS Flush'] = {'result': 'Passed' if dns_flush_response.returncode == 0 else 'Failed',
-                                    'duration': str(timedelta(seconds=duration))}
-            print(Fore.GREEN + "DNS Flush completed.")
-            if dns_flush_response.returncode == 0:
-                logging.info("DNS Flush completed successfully")
-            else:
-                logging.error("DNS Flush failed")
-
-        # Nslookup Test
-        if tests.get('Nslookup', 'Disabled') == 'Enabled':
-            logging.debug("Nslookup test enabled, starting test")
-            nslookup_task = progress.add_task("Running Nslookup Test...", total=100)
-            start_time = time.time()
-            run_command_with_progress(["nslookup", "google.com"], nslookup_task, progress)
-            nslookup_response = subprocess.run(["nslookup", "google.com"], capture_output=True, text=True)
-            duration = time.time() - start_time
-            results['Nslookup Test'] = {'result': 'Passed' if nslookup_response.returncode == 0 else 'Failed',
-                                        'duration': str(timedelta(seconds=duration))}
-            print(Fore.GREEN + "Nslookup Test completed.")
-            if nslookup_response.returncode == 0:
-                logging.info("Nslookup Test completed successfully")
-            else:
-                logging.error("Nslookup Test failed")
-
-        # Netstat Test
-        if tests.get('Netstat', 'Disabled') == 'Enabled':
-            logging.debug("Netstat test enabled, starting test")
-            netstat_task = progress.add_task("Running Netstat...", total=100)
-            start_time = time.time()
-            run_command_with_progress(["netstat"], netstat_task, progress)
-            netstat_response = subprocess.run(["netstat"], capture_output=True, text=True)
-            duration = time.time() - start_time
-            results['Netstat'] = {'result': 'Passed' if netstat_response.returncode == 0 else 'Failed',
-                                  'duration': str(timedelta(seconds=duration))}
-            print(Fore.GREEN + "Netstat completed.")
-            if netstat_response.returncode == 0:
-                logging.info("Netstat completed successfully")
-            else:
-                logging.error("Netstat failed")
-
-       # Speedtest
-        if tests.get('Speedtest', 'Disabled') == 'Enabled':
-            logging.debug("Speedtest enabled, starting test")
-            speedtest_task = progress.add_task("Running Speedtest...", total=100)
-
-            st = speedtest.Speedtest()
-            st.get_best_server()
-            progress.update(speedtest_task, advance=10, description="Preparing Speedtest...")
-
-            start_time = time.time()  # Start time measurement
-
-            # Perform download test
-            st.download(threads=None)
-            progress.update(speedtest_task, advance=45, description="Running Speedtest: Download")  # Update after download
-
-            # Perform upload test
-            st.upload(threads=None)
-            progress.update(speedtest_task, advance=45, description="Running Speedtest: Upload")  # Update after upload
-
-            end_time = time.time()  # End time measurement
-            duration = end_time - start_time  # Calculate total duration
-
-            progress.update(speedtest_task, completed=100, description="Speedtest completed")  # Update to full after upload
-
-            speedtest_results = st.results.dict()
-            results['Speedtest'] = {
-                "result": "Completed",
-                "Download": speedtest_results['download'] / (1024 * 1024),  # Convert to Mbps
-                "Upload": speedtest_results['upload'] / (1024 * 1024),  # Convert to Mbps
-                "Ping": speedtest_results['ping'],
-                'duration': str(timedelta(seconds=duration))
-            }
-            print(Fore.GREEN + "Speedtest completed.")
-            if 'result' in results['Speedtest'] and results['Speedtest']['result'] == "Completed":
-                logging.info("Speedtest completed successfully")
-            else:
-                logging.error("Speedtest failed")
+        def log_message(self, format, *args):
+            pass
 
-    if results:
-        show_completion_notification(results)
-    logging.info("Network diagnostics tests completed")
-    return results
+    host = metrics_settings.get('host', '127.0.0.1')
+    port = int(metrics_settings.get('port', 9469) if port is None else port)
+    try:
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+    except OSError as e:
+        logging.error("Could not start metrics endpoint on %s:%s: %s", host, port, e)
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-endpoint', daemon=True).start()
+    metrics_registry = registry
+    logging.info("Metrics endpoint listening on http://%s:%s/metrics", host, server.server_address[1])
+    return server
 
 # --- Display Summary Management ---
+def format_rtt_summary(summary):
+    if not summary.get('received'):
+        return f"no replies ({summary.get('loss', 100.0)}% loss)"
+    return (f"min/avg/max {summary['min']:.1f}/{summary['avg']:.1f}/{summary['max']:.1f} ms, "
+            f"jitter {summary['jitter']:.1f} ms, loss {summary['loss']}%")
+
+def format_latency_window(summary):
+    if not summary.get('received'):
+        return f"no replies in {summary.get('sent', 0)} probes"
+    return (f"p50/p90/p99/p99.9 {summary['p50']:.1f}/{summary['p90']:.1f}/{summary['p99']:.1f}/{summary['p999']:.1f} ms, "
+            f"jitter {summary['jitter']:.1f} ms, loss {summary['loss']}% over {summary['sent']} probes")
+
+def format_dns_summary(summary):
+    if not summary.get('answered'):
+        return f"no answers ({summary.get('timeouts', 0)} timeouts)"
+    return (f"p50/p95/p99 {summary['p50']:.1f}/{summary['p95']:.1f}/{summary['p99']:.1f} ms, "
+            f"{summary['answered']}/{summary['queries']} answered, {summary['timeouts']} timeouts")
+
+def format_http_summary(summary):
+    if summary.get('errors') == summary.get('requests'):
+        return f"failed: {summary.get('error', 'no response')}"
+    parts = [f"HTTP {summary['status']}"]
+    cold = summary.get('cold')
+    if cold:
+        phases = ', '.join(f"{phase[:-3]} {cold[phase]:.1f}" for phase in HTTP_PHASES[:-1] if phase in cold)
+        parts.append(f"cold {cold['total_ms']:.1f} ms ({phases})")
+    if summary.get('warm'):
+        parts.append(f"warm {summary['warm']['total_ms']:.1f} ms (ttfb {summary['warm']['ttfb_ms']:.1f})")
+    return ', '.join(parts)
+
 def display_summary(results):
     logging.info("Displaying network diagnostic summary")
     print("\n===== Network Diagnostic Summary =====")
@@ -340,6 +4177,79 @@ def display_summary(results):
                 print(f"  Upload Speed: {upload_speed:.2f} Mbps")
                 print(f"  Ping: {ping} ms")
 
+            # Throughput Test speeds, for whichever directions ran
+            if test == 'Throughput Test' and result == "Completed":
+                for direction in ('Download', 'Upload'):
+                    if direction in data:
+                        print(f"  {direction} Speed: {data[direction]:.2f} Mbps over {data.get('Streams')} streams")
+
+            # Idle and loaded latency for the Latency Under Load test
+            if test == 'Latency Under Load' and 'Idle Latency' in data:
+                print(f"  Grade: {data.get('Grade') or 'N/A'}, responsiveness {data.get('RPM') or 'N/A'} RPM "
+                      f"(idle {data.get('Idle RPM') or 'N/A'} RPM)")
+                print(f"  Idle: {format_latency_window(data['Idle Latency'])}")
+                for direction in ('Download', 'Upload'):
+                    if f"{direction} Latency" in data:
+                        added = data.get('Added Latency', {}).get(direction.lower())
+                        print(f"  {direction} at {data[direction]:.2f} Mbps: {format_latency_window(data[f'{direction} Latency'])}"
+                              + (f", +{added:.1f} ms" if added is not None else ""))
+
+            # Per-target latency for the Ping Test
+            if test == 'Ping Test':
+                for target, summary in data.get('Targets', {}).items():
+                    print(f"  {target}: {format_rtt_summary(summary)}")
+
+            # Hop list for the Traceroute Test
+            if test == 'Traceroute Test':
+                for hop in data.get('Hops', []):
+                    print(f"  {hop['ttl']:>2}  {hop['address'] or '*':<39} {format_rtt_summary(hop)}")
+
+            # Resolver latency for the Nslookup Test
+            if test == 'Nslookup Test':
+                for resolver, summary in data.get('Resolvers', {}).items():
+                    print(f"  {resolver}: {format_dns_summary(summary)}")
+
+            # Interfaces on the first pass of IP Configuration, then only changes and rates
+            if test == 'IP Configuration':
+                for line in data.get('Output', '').splitlines():  # ipconfig /all where there is no /sys/class/net
+                    if line.strip():
+                        print(f"  {line.strip()}")
+                for name, interface in data.get('Interfaces', {}).items():
+                    print(f"  {name}: {interface['state']}, mtu {interface['mtu']}"
+                          + ''.join(f", {address}" for address in interface['addresses']))
+                for route in data.get('Default Routes', []):
+                    print(f"  Default route ({route['family']}): via {route['gateway']} on {route['interface']}")
+                if data.get('Resolver Config', {}).get('nameservers'):
+                    print(f"  Name servers: {', '.join(data['Resolver Config']['nameservers'])}")
+                if 'Changes' in data:
+                    print(f"  Changes since last run: {json.dumps(data['Changes']) if data['Changes'] else 'none'}")
+                for name, rates in data.get('Rates', {}).items():
+                    if rates['rx_bps'] or rates['tx_bps'] or rates['errors'] or rates['drops']:
+                        print(f"  {name}: rx {rates['rx_bps'] / 1e6:.2f} Mbps, tx {rates['tx_bps'] / 1e6:.2f} Mbps, "
+                              f"{rates['errors']} errors, {rates['drops']} drops")
+
+            # Socket counts for Netstat
+            if test == 'Netstat' and 'Sockets' in data:
+                print(f"  Sockets: {data['Sockets']} ({data['Source']})")
+                for family, states in data.get('States', {}).items():
+                    print(f"  {family}: " + ', '.join(f"{state} {count}" for state, count in sorted(states.items())))
+                if data.get('Remote Ports'):
+                    print("  Busiest remote ports: " + ', '.join(f"{port} ({count})" for port, count in data['Remote Ports'].items()))
+                if 'Changes' in data:
+                    print(f"  Since last run ({data['Changes']['interval_s']} s): "
+                          f"{data['Changes']['opened']} opened, {data['Changes']['closed']} closed")
+
+            # Cold and warm request timings for the HTTP Probe
+            if test == 'HTTP Probe':
+                for url, summary in data.get('URLs', {}).items():
+                    print(f"  {url}: {format_http_summary(summary)}")
+
+            # Latency over the shortest rolling window, for the tests that keep statistics
+            for name, report in data.get('Statistics', {}).items():
+                for window, summary in list(report['windows'].items())[:1]:
+                    if summary['sent']:
+                        print(f"  {name}, last {window}: {format_latency_window(summary)}")
+
             # Print a divider after each test summary except the last one
             if index < len(results) - 1:
                 print("--------------------------------------\n")
@@ -375,6 +4285,27 @@ def post_test_menu(results):
                     print(f"Upload Speed: {upload_speed:.2f} Mbps")
                     print(f"Ping: {ping} ms")
 
+                if test == 'Throughput Test' and result == "Completed":
+                    for direction in ('Download', 'Upload'):
+                        if direction in data:
+                            print(f"{direction} Speed: {data[direction]:.2f} Mbps")
+
+                # Per-target latency for the Ping Test
+                if test == 'Ping Test':
+                    for target, summary in data.get('Targets', {}).items():
+                        print(f"{target}: {format_rtt_summary(summary)}")
+
+                # Hop count for the Traceroute Test
+                if test == 'Traceroute Test':
+                    print(f"Hops: {len(data.get('Hops', []))}")
+
+                if test == 'HTTP Probe':
+                    for url, summary in data.get('URLs', {}).items():
+                        print(f"{url}: {format_http_summary(summary)}")
+
+                if test == 'Netstat' and 'Sockets' in data:
+                    print(f"Sockets: {data['Sockets']}")
+
                 # Print a divider after each test summary except the last one
                 if index < len(results) - 1:
                     print("--------------------------------------")
@@ -451,21 +4382,20 @@ def save_results(results, settings):
             print(f"Results successfully saved at {file_name}\n")
             logging.info("Results saved successfully")
         except Exception as e:
-            logging.error(f"Error saving results: {e}")
+            logging.error("Error saving results: %s", e)
     elif not logging_enabled:
         logging.info("Logging is disabled, not saving results.")
     else:
         logging.info("Saving results is disabled in settings.")
     
 # --- Display Notifications ---
-def show_completion_notification(results):
+def show_completion_notification(results, settings):
     logging.info("Preparing to display completion notification")
     try:
-        # Load the notification settings
-        settings = load_settings()
         notification_enabled = settings.get('notification_settings', {}).get('enabled', False)
 
         if notification_enabled:
+            from plyer import notification
             message_parts = []
             
             # Handling Speedtest results
@@ -491,7 +4421,7 @@ def show_completion_notification(results):
         logging.info("Notification displayed successfully")
 
     except Exception as e:
-        logging.error(f"Error displaying notification: {e}")
+        logging.error("Error displaying notification: %s", e)
 
 # Note: The `before_download`, `before_upload`, `after_download`, and `after_upload` are placeholders here and should be replaced with actual speed values from the speedtest results.
 
@@ -522,42 +4452,158 @@ def manage_settings():
         save_settings(settings)
         logging.info("Settings management completed successfully")
     except Exception as e:
-        logging.error(f"Error in settings management: {e}")
+        logging.error("Error in settings management: %s", e)
 # --- Load Settings ---
-def load_settings():
-    logging.info("Loading settings")
-    try:
-        settings_file = 'settings.json'
-        if os.path.exists(settings_file):
-            with open(settings_file, 'r') as file:
-                logging.info("Settings loaded successfully")
-                return json.load(file)
-        return {}
-    except Exception as e:
-        logging.error(f"Error loading settings: {e}")
+SETTINGS_PATH = Path(__file__).resolve().parent / 'settings.json'
+settings_cache = {'key': None, 'settings': None}
+settings_lock = threading.Lock()
+
+def check_setting(name, value, default):
+    """
+    Checks one value against the shape of its default: a number for a number (int and
+    float are interchangeable), a list whose entries all have the type of the default's
+    entries (strings when the default is empty), an object whose entries each match the
+    default's entry of the same name (or, for names the default lacks, its first entry),
+    and otherwise the default's type. An invalid object entry the default also has is
+    replaced by the default's; other invalid entries are dropped.
+    :return: (valid, value with invalid object entries removed, list of problems).
+    """
+    invalid = (False, None, [f"'{name}' has an invalid value {value!r}; using the default"])
+    if isinstance(default, bool):
+        return (True, value, []) if isinstance(value, bool) else invalid
+    if isinstance(default, (int, float)):
+        return (True, value, []) if isinstance(value, (int, float)) and not isinstance(value, bool) else invalid
+    if isinstance(default, list):
+        if not isinstance(value, list):
+            return invalid
+        entry_default = default[0] if default else ''
+        return (True, value, []) if all(check_setting(name, entry, entry_default)[0] for entry in value) else invalid
+    if isinstance(default, dict):
+        if not isinstance(value, dict):
+            return invalid
+        checked, problems = {}, []
+        for key, entry in value.items():
+            entry_default = default.get(key, next(iter(default.values()), None))
+            if entry_default is None:
+                checked[key] = entry
+                continue
+            valid, entry, entry_problems = check_setting(f"{name}.{key}", entry, entry_default)
+            problems += entry_problems
+            if valid:
+                checked[key] = entry
+            elif key in default:
+                checked[key] = copy.deepcopy(default[key])
+        return True, checked, problems
+    return (True, value, []) if isinstance(value, type(default)) else invalid
+
+def validate_settings(settings):
+    """
+    Checks settings against DEFAULT_SETTINGS, which doubles as the schema: every section
+    must be an object and every known key, down to list entries and nested objects, must
+    have the shape of its default (see check_setting). Invalid values are dropped, so the
+    default applies, and unknown sections and keys are kept.
+    :return: (validated settings, list of problems).
+    """
+    if not isinstance(settings, dict):
+        return {}, ["settings must be a JSON object"]
+    validated, problems = {}, []
+    for section, values in settings.items():
+        defaults = DEFAULT_SETTINGS.get(section)
+        if defaults is None:
+            validated[section] = values
+            continue
+        if not isinstance(values, dict):
+            problems.append(f"'{section}' must be an object")
+            continue
+        validated[section] = {}
+        for key, value in values.items():
+            if section == 'test_preferences':
+                valid = value in ('Enabled', 'Disabled')
+                key_problems = [] if valid else [f"'{section}.{key}' has an invalid value {value!r}; using the default"]
+            elif key in defaults:
+                valid, value, key_problems = check_setting(f"{section}.{key}", value, defaults[key])
+            else:
+                valid, key_problems = True, []
+            problems += key_problems
+            if valid:
+                validated[section][key] = value
+    return validated, problems
+
+def load_settings(path=None):
+    """
+    Returns the settings, parsing and validating the file only when its inode, mtime or
+    size has changed since the last call; otherwise a copy of the cached settings is
+    returned for the cost of one stat(). If a changed file cannot be parsed, the last good
+    settings stay in use.
+    :param path: Settings file; defaults to settings.json next to this script.
+    """
+    path = Path(path) if path else SETTINGS_PATH
+    try:
+        stat = os.stat(path)
+    except OSError:
         return {}
+    key = (str(path), stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    with settings_lock:
+        if settings_cache['key'] != key:
+            logging.info("Loading settings from %s", path)
+            try:
+                with open(path, 'r') as file:
+                    settings, problems = validate_settings(json.load(file))
+            except (OSError, ValueError) as e:
+                logging.error("Error loading settings: %s", e)
+                return copy.deepcopy(settings_cache['settings']) if settings_cache['key'] and settings_cache['key'][0] == str(path) else {}
+            for problem in problems:
+                logging.error("Invalid setting in %s: %s", path.name, problem)
+            settings_cache.update(key=key, settings=settings)
+            logging.info("Settings loaded successfully")
+        return copy.deepcopy(settings_cache['settings'])
 
 # --- Save Settings ---
-def save_settings(settings):
+def write_json_atomically(path, data, indent=None):
+    """
+    Writes JSON to a temporary file in the same directory, then renames it over path, so
+    a concurrent reader sees either the old or the new file and never a partial one.
+    Raises OSError (or TypeError for unserializable data) after removing the temporary file.
+    """
+    import tempfile
+    path = Path(path)
+    descriptor, temporary_path = tempfile.mkstemp(prefix=f".{path.stem}-", suffix='.tmp', dir=path.parent)
+    try:
+        with os.fdopen(descriptor, 'w') as file:
+            json.dump(data, file, indent=indent)
+            file.flush()
+            os.fsync(file.fileno())
+        if path.exists():
+            os.chmod(temporary_path, path.stat().st_mode & 0o7777)
+        os.replace(temporary_path, path)
+    except BaseException:
+        try:
+            os.unlink(temporary_path)
+        except OSError:
+            pass
+        raise
+
+def save_settings(settings, path=None):
+    """Writes the settings atomically (see write_json_atomically)."""
     logging.info("Saving settings")
     try:
-        with open('settings.json', 'w') as file:
-            json.dump(settings, file, indent=4)
+        write_json_atomically(Path(path) if path else SETTINGS_PATH, settings, indent=4)
         logging.info("Settings saved successfully")
     except Exception as e:
-        logging.error(f"Error saving settings: {e}")
+        logging.error("Error saving settings: %s", e)
 
 # --- Test Preferences Management ---
 def manage_test_preferences(current_preferences):
     logging.info("Managing test preferences")
     try:
-        tests = ['Ping', 'Traceroute', 'IP Configuration', 'DNS Flush', 'Nslookup', 'Netstat', 'Speedtest']
+        tests = ['Ping', 'Traceroute', 'IP Configuration', 'DNS Flush', 'Nslookup', 'HTTP Probe', 'Netstat', 'Speedtest', 'Throughput',
+                 'Latency Under Load']
         while True:
             clear_screen()
             print("\n==================== Test Preferences ====================")
             for i, test in enumerate(tests, start=1):
                 enabled_status = current_preferences.get(test, 'Disabled') == 'Enabled'
-                color = colorama.Fore.GREEN if enabled_status else colorama.Fore.RED
+                color = Fore.GREEN if enabled_status else Fore.RED
                 status = 'Enabled' if enabled_status else 'Disabled'
                 print(f"{color}{i}. {test} - {status}")
             print("0. Back")
@@ -574,7 +4620,7 @@ def manage_test_preferences(current_preferences):
         logging.info("Test preferences updated")
         return current_preferences
     except Exception as e:
-        logging.error(f"Error managing test preferences: {e}")
+        logging.error("Error managing test preferences: %s", e)
         return current_preferences
 
 # --- Logging Settings Management ---
@@ -600,10 +4646,9 @@ def manage_logging_settings(current_logging):
                 break
 
         logging.info("Logging settings updated")
-        save_settings(current_logging)  # Save the updated logging settings
-        return current_logging
+        return current_logging  # manage_settings saves the whole settings file
     except Exception as e:
-        logging.error(f"Error managing logging settings: {e}")
+        logging.error("Error managing logging settings: %s", e)
         return current_logging
     
 # --- Notification Settings Management ---
@@ -631,7 +4676,7 @@ def manage_notification_settings(current_notifications):
         logging.info("Notification settings updated")
         return current_notifications
     except Exception as e:
-        logging.error(f"Error managing notification settings: {e}")
+        logging.error("Error managing notification settings: %s", e)
         return current_notifications
 
 # --- Save Summaries Management ---
@@ -659,7 +4704,7 @@ def manage_save_summaries_settings(current_settings):
         logging.info("Save summaries settings updated")
         return current_settings
     except Exception as e:
-        logging.error(f"Error managing save summaries settings: {e}")
+        logging.error("Error managing save summaries settings: %s", e)
         return current_settings
     
 # --- Main Menu Logic ---
@@ -683,6 +4728,7 @@ def main_menu():
 
                 display_summary(results)  # Always display the summary
                 save_results(results, global_settings)  # Save results based on settings
+                record_results(results, global_settings)  # Append metrics to the time-series store
 
                 continue_to_main = post_test_menu(results)  # Show post-test menu and capture user's choice
 
@@ -700,15 +4746,142 @@ def main_menu():
                 logging.info("Exiting main menu")
                 break
         except Exception as e:
-            logging.error(f"Error in main menu: {e}")
+            logging.error("Error in main menu: %s", e)
 
 # --- Global Variable for Settings ---
-global_settings = {
+# Defaults for every section; validate_settings also uses them as the settings schema.
+DEFAULT_SETTINGS = {
     'test_preferences': {},
     'notification_settings': {'enabled': False},
     'save_summaries': {'enabled': False},
-    'logging_settings': {'enabled': True}
+    'logging_settings': {'enabled': True, 'level': 'DEBUG', 'format': 'text', 'rotation': 'size',
+                         'max_bytes': 10 * 1024 * 1024, 'backup_count': 5, 'when': 'midnight', 'compress': True},
+    'scheduler_settings': {'max_concurrency': 4, 'exclusive_tests': ['Speedtest', 'Throughput', 'Latency Under Load'],
+                           'test_timeouts': {'default': 120, 'Speedtest': 180}, 'pass_timeout': 600,
+                           'timeout_policy': 'continue'},
+    'ping_settings': {'targets': ['8.8.8.8'], 'count': 4, 'interval': 0.2, 'timeout': 1.0, 'method': 'auto', 'port': 443},
+    'traceroute_settings': {'target': '8.8.8.8', 'max_hops': 30, 'probes_per_hop': 3, 'timeout': 1.0},
+    'dns_settings': {'resolvers': [], 'names': ['google.com'], 'record_types': ['A', 'AAAA'], 'rounds': 3,
+                     'timeout': 2.0, 'max_outstanding': 256},
+    'monitor_settings': {'intervals': {'Ping': 5, 'IP Configuration': 10, 'Nslookup': 30, 'Traceroute': 300,
+                                       'Speedtest': 3600},
+                         'max_catch_up': 3},
+    'timeseries_settings': {'enabled': True, 'directory': 'Results/timeseries', 'retention_days': {'raw': 7, '1m': 90}},
+    'export_settings': {'enabled': False, 'formats': ['jsonl'], 'directory': 'Results/export', 'batch_size': 100,
+                        'flush_interval': 5.0},
+    'sweep_settings': {'workers': 0, 'concurrency': 1000, 'timeout': 1.0, 'count': 1, 'default_port': 443,
+                       'default_protocol': 'tcp'},
+    'metrics_settings': {'enabled': False, 'host': '127.0.0.1', 'port': 9469},
+    'interface_settings': {'netlink': True},
+    'http_settings': {'urls': ['https://api.ipify.org'], 'requests': 2, 'timeout': 5.0, 'max_concurrency': 8,
+                      'public_ip_url': 'https://api.ipify.org'},
+    'throughput_settings': {'server': '', 'port': 5201, 'streams': 4, 'duration': 10, 'warmup': 2, 'interval': 1.0,
+                            'directions': ['download', 'upload'], 'listen_host': '0.0.0.0'},
+    'latency_under_load_settings': {'probe_target': '8.8.8.8', 'probe_method': 'auto', 'probe_port': 443,
+                                    'probe_interval': 0.1, 'probe_timeout': 1.0,
+                                    'idle_duration': 3, 'duration': 10, 'warmup': 2, 'streams': 4,
+                                    'directions': ['download', 'upload']},
+    'speedtest_settings': {'timeout': 10.0},
+    'cache_settings': {'enabled': True, 'persist': True, 'path': 'Results/cache.json',
+                       'ttls': {'Current Public IP': 300, 'IP Configuration': 60, 'Speedtest': 86400, 'dns': 300}},
+    'statistics_settings': {'enabled': True, 'accuracy': 0.01, 'windows': {'5m': 300, '1h': 3600, '1d': 86400},
+                            'slots': 12, 'ewma_half_life': 300, 'persist': True, 'path': 'Results/latency_statistics.json'}
 }
+global_settings = copy.deepcopy(DEFAULT_SETTINGS)
+
+# --- Configure Logging ---
+class JsonLogFormatter(logging.Formatter):
+    """
+    One JSON object per line. Records logged with extra={'test': ..., 'phase': ...,
+    'duration_ms': ...} carry those fields too, so a log can be filtered by test and phase.
+    """
+    STRUCTURED_FIELDS = ('test', 'phase', 'duration_ms', 'command', 'returncode')
+
+    def format(self, record):
+        entry = {'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+                 'level': record.levelname,
+                 'thread': record.threadName,
+                 'message': record.getMessage()}
+        for field in self.STRUCTURED_FIELDS:
+            if hasattr(record, field):
+                entry[field] = getattr(record, field)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+def compress_rotated_log(source, destination):
+    """Rotator for the log handlers: gzips the finished file instead of renaming it."""
+    import gzip
+    import shutil
+    with open(source, 'rb') as plain, gzip.open(destination, 'wb') as compressed:
+        shutil.copyfileobj(plain, compressed)
+    os.remove(source)
+
+def build_log_handler(logging_settings, logs_directory):
+    """
+    File handler for the log listener. 'rotation' is 'size' (at 'max_bytes'), 'time'
+    (at 'when', e.g. 'midnight') or 'none'; with 'compress' rotated files are gzipped.
+    """
+    from logging.handlers import RotatingFileHandler, TimedRotatingFileHandler
+    log_format = logging_settings.get('format', 'text')
+    log_path = logs_directory / ('network_diagnostics.jsonl' if log_format == 'json' else 'network_diagnostics.log')
+    rotation = logging_settings.get('rotation', 'size')
+    backup_count = int(logging_settings.get('backup_count', 5))
+    if rotation == 'time':
+        handler = TimedRotatingFileHandler(log_path, when=logging_settings.get('when', 'midnight'),
+                                           backupCount=backup_count, encoding='utf-8')
+    elif rotation == 'size':
+        handler = RotatingFileHandler(log_path, maxBytes=int(logging_settings.get('max_bytes', 10 * 1024 * 1024)),
+                                      backupCount=backup_count, encoding='utf-8')
+    else:
+        handler = logging.FileHandler(log_path, mode='a', encoding='utf-8')
+    if rotation in ('size', 'time') and logging_settings.get('compress', True):
+        handler.namer = lambda name: name + '.gz'
+        handler.rotator = compress_rotated_log
+    if log_format == 'json':
+        handler.setFormatter(JsonLogFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s", datefmt="%Y-%m-%d %H:%M:%S"))
+    return handler
+
+log_listener = None
+
+def stop_log_listener():
+    """Drains the log queue and stops the listener thread."""
+    global log_listener
+    if log_listener is not None:
+        log_listener.stop()
+        log_listener = None
+
+atexit.register(stop_log_listener)
+
+def configure_logging(settings):
+    """
+    Routes logging through a queue: callers only enqueue records, and a background
+    listener thread formats them and does the file I/O (including rotation), so a slow
+    disk never holds up a probe. Calling it again replaces the previous configuration.
+    """
+    global log_listener
+    from logging.handlers import QueueHandler, QueueListener
+    root = logging.getLogger()
+    stop_log_listener()
+    for handler in root.handlers[:]:
+        if isinstance(handler, QueueHandler):
+            root.removeHandler(handler)
+
+    logging_settings = settings.get('logging_settings', {})
+    if not logging_settings.get('enabled', True):
+        root.setLevel(logging.CRITICAL)  # Disable logging when it's disabled in settings
+        return
+
+    logs_directory = Path(__file__).parent / 'Logs'
+    logs_directory.mkdir(exist_ok=True)
+    records = queue.SimpleQueue()
+    log_listener = QueueListener(records, build_log_handler(logging_settings, logs_directory))
+    log_listener.start()
+    root.addHandler(QueueHandler(records))
+    # Below this level logging calls return before building a record or formatting arguments
+    root.setLevel(getattr(logging, str(logging_settings.get('level', 'DEBUG')).upper(), logging.DEBUG))
 
 # --- Main Function ---
 def main(setup=False):
@@ -717,41 +4890,263 @@ def main(setup=False):
         create_shortcut("Network Diagnostics")
         install_required_packages()  # Pass setup argument here
     else:
-        display_script_name()
-        global_settings = load_settings()
+        global global_settings
+        global_settings = load_settings()  # main_menu() clears the screen, which shows the banner
 
         # Configure logging based on settings
-        logging_settings = global_settings.get('logging_settings', {})
-        logging_enabled = logging_settings.get('enabled', True)
-        if logging_enabled:
-            logs_directory = Path(__file__).parent / 'Logs'
-            if not logs_directory.exists():
-                logs_directory.mkdir()
-
-            current_time = datetime.now()
-            log_filename = current_time.strftime("log-%m-%d-%Y-%H-%M.txt")  # Replaced ':' with '-'
-            full_log_path = logs_directory / log_filename
-
-            logging.basicConfig(
-                level=logging.DEBUG,
-                format="%(asctime)s %(levelname)s %(message)s",
-                datefmt="%Y-%m-%d %H:%M:%S",
-                handlers=[
-                    logging.FileHandler(full_log_path, mode='a')
-                ]
-            )
-        else:
-            logging.basicConfig(level=logging.CRITICAL)  # Disable logging when it's disabled in settings
+        configure_logging(global_settings)
+        start_metrics_server(global_settings)
 
         main_menu()
     logging.info("Exiting script")
 
-if __name__ == '__main__':
-    import sys
+# --- Command-Line Interface ---
+def build_argument_parser():
+    import argparse
+    test_names = ', '.join(test['cli_name'] for test in NETWORK_TESTS)
+    parser = argparse.ArgumentParser(
+        prog='network_diagnostics.py',
+        description="Network diagnostics. Run without arguments for the interactive menu.")
+    parser.add_argument('--setup', action='store_true', help="create the desktop shortcut and install packages")
+    parser.add_argument('--monitor', action='store_true', help="same as the 'monitor' command")
+    subparsers = parser.add_subparsers(dest='command')
 
-    if len(sys.argv) > 1 and sys.argv[1] == '--setup':
-        main(setup=True)
+    run_parser = subparsers.add_parser('run', help="run tests once, without menus, and print the results")
+    run_parser.add_argument('--tests', help=f"comma-separated tests to run ({test_names}); "
+                                            "defaults to the tests enabled in settings.json")
+    run_parser.add_argument('--target', action='append',
+                            help="host (or host:port) for ping and traceroute; repeat for several ping targets")
+    run_parser.add_argument('--count', type=int, help="probes per ping target")
+    run_parser.add_argument('--resolver', action='append', help="DNS resolver to benchmark; may be repeated")
+    run_parser.add_argument('--concurrency', type=int, help="maximum tests running at once")
+    run_parser.add_argument('--format', choices=['json', 'jsonl', 'text'], default='json',
+                            help="json: one document; jsonl: one typed record per test; text: readable summary")
+
+    monitor_parser = subparsers.add_parser('monitor', help="run tests on their monitor_settings intervals until stopped")
+    monitor_parser.add_argument('--metrics-port', type=int, help="serve Prometheus metrics on this port")
+
+    for profiled_parser in (run_parser, monitor_parser):
+        profiled_parser.add_argument('--profile', choices=['cpu', 'memory'],
+                                     help="profile the run with cProfile (cpu) or tracemalloc (memory) and "
+                                          "write the statistics to the Results folder")
+        profiled_parser.add_argument('--trace', nargs='?', const='', metavar='PATH',
+                                     help="record per-phase timing spans and write them as a Chrome trace "
+                                          "(chrome://tracing, Perfetto); defaults to the Results folder")
+
+    sweep_parser = subparsers.add_parser('sweep', help="check reachability of many host:port endpoints")
+    sweep_parser.add_argument('targets_file', help="file with one 'host:port/protocol' (or 'host,port,protocol') per line")
+    sweep_parser.add_argument('--workers', type=int, help="worker processes (default: one per CPU)")
+    sweep_parser.add_argument('--concurrency', type=int, help="sockets open at once per worker")
+    sweep_parser.add_argument('--timeout', type=float, help="seconds to wait for each probe")
+    sweep_parser.add_argument('--count', type=int, help="probes per target")
+    sweep_parser.add_argument('--format', choices=['json', 'jsonl', 'text'], default='json',
+                              help="json: one report; jsonl: one line per target; text: readable summary")
+
+    serve_parser = subparsers.add_parser('serve-throughput', help="serve the far end of the Throughput test")
+    serve_parser.add_argument('--host', help="address to listen on (default: listen_host in throughput_settings)")
+    serve_parser.add_argument('--port', type=int, help="port to listen on (default: port in throughput_settings)")
+    return parser
+
+def parse_test_selection(selection):
+    """Maps a comma-separated list of CLI test names to registry names; raises ValueError on unknown names."""
+    by_cli_name = {test['cli_name']: test['name'] for test in NETWORK_TESTS}
+    chosen = []
+    for cli_name in (part.strip().lower() for part in selection.split(',') if part.strip()):
+        if cli_name not in by_cli_name:
+            raise ValueError(f"unknown test '{cli_name}' (choose from {', '.join(by_cli_name)})")
+        chosen.append(by_cli_name[cli_name])
+    return chosen
+
+def apply_cli_overrides(settings, arguments):
+    """Returns a copy of settings with the run command's options applied."""
+    settings = copy.deepcopy(settings)
+    if arguments.target:
+        settings.setdefault('ping_settings', {})['targets'] = arguments.target
+        settings.setdefault('traceroute_settings', {})['target'] = parse_probe_target(arguments.target[0], 0)[0]
+    if arguments.count is not None:
+        settings.setdefault('ping_settings', {})['count'] = arguments.count
+    if arguments.resolver:
+        settings.setdefault('dns_settings', {})['resolvers'] = arguments.resolver
+    if arguments.concurrency is not None:
+        settings.setdefault('scheduler_settings', {})['max_concurrency'] = arguments.concurrency
+    return settings
+
+def results_passed(results):
+    return bool(results) and all(isinstance(data, dict) and data.get('result') in PASSED_RESULTS
+                                 for data in results.values())
+
+def run_cli(arguments, settings, test_names=None):
+    """
+    Runs tests headlessly and writes the results to stdout.
+    :param test_names: Tests to run; defaults to the tests enabled in settings.
+    :return: Exit status: 0 when every test passed, 1 when any failed.
+    """
+    global console_output
+    settings = apply_cli_overrides(settings, arguments)
+    if not test_names:
+        preferences = settings.get('test_preferences', {})
+        test_names = [test['name'] for test in NETWORK_TESTS if preferences.get(test['name'], 'Disabled') == 'Enabled']
+
+    console_output = arguments.format == 'text'
+    logging.info("Running tests from the command line: %s", test_names)
+    results = schedule_tests(test_names, settings, HeadlessProgress())
+    record_results(results, settings)
+    passed = results_passed(results)
+
+    if arguments.format == 'json':
+        json.dump({'timestamp': time.time(), 'passed': passed, 'results': results}, sys.stdout, default=str)
+        sys.stdout.write('\n')
+    elif arguments.format == 'jsonl':
+        for test, data in results.items():
+            sys.stdout.write(json.dumps(result_to_record(test, data), default=str) + '\n')
     else:
-        global_settings = load_settings()
-        display_script_name()
-        main()
+        display_summary(results)
+    sys.stdout.flush()
+    return 0 if passed else 1
+
+def run_sweep_cli(arguments, settings):
+    """
+    Sweeps the targets file and writes the report to stdout.
+    :return: Exit status: 0 when every target answered, 1 otherwise.
+    """
+    sweep_settings = settings.get('sweep_settings', {})
+    with open(arguments.targets_file, 'r') as file:
+        targets = parse_sweep_targets(file, int(sweep_settings.get('default_port', 443)),
+                                      sweep_settings.get('default_protocol', 'tcp'))
+    logging.info("Sweeping %s targets from %s", len(targets), arguments.targets_file)
+    report = run_sweep(targets,
+                       workers=arguments.workers if arguments.workers is not None else int(sweep_settings.get('workers', 0)),
+                       concurrency=arguments.concurrency or int(sweep_settings.get('concurrency', 1000)),
+                       timeout=arguments.timeout or float(sweep_settings.get('timeout', 1.0)),
+                       count=arguments.count or int(sweep_settings.get('count', 1)))
+
+    if arguments.format == 'json':
+        json.dump(report, sys.stdout)
+        sys.stdout.write('\n')
+    elif arguments.format == 'jsonl':
+        for record in report['results']:
+            sys.stdout.write(json.dumps(record) + '\n')
+    else:
+        print(f"Swept {report['targets']} targets in {report['duration_s']} s with {report['workers']} workers "
+              f"({report['targets_per_second']} targets/s)")
+        for error_class, count in sorted(report['by_class'].items()):
+            print(f"  {error_class}: {count}")
+        if report['latency']['count']:
+            print(f"  latency p50/p95/p99: {report['latency']['p50']}/{report['latency']['p95']}/{report['latency']['p99']} ms")
+    sys.stdout.flush()
+    return 0 if report['by_class'].get('ok', 0) == report['targets'] else 1
+
+def results_folder_path(file_name):
+    folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Results')
+    os.makedirs(folder, exist_ok=True)
+    return os.path.join(folder, file_name)
+
+def run_profiled(mode, function, *args, **kwargs):
+    """
+    Calls function under cProfile ('cpu') or tracemalloc ('memory'), or plainly when mode
+    is None, and writes the statistics to the Results folder even if the call is interrupted.
+    CPU profiles include the tests run on scheduler threads (see call_profiled).
+    """
+    if not mode:
+        return function(*args, **kwargs)
+    stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    if mode == 'cpu':
+        import cProfile
+        import pstats
+        profiler = cProfile.Profile()
+        cpu_profiles['enabled'] = True
+        try:
+            return profiler.runcall(function, *args, **kwargs)
+        finally:
+            cpu_profiles['enabled'] = False
+            stats = pstats.Stats(profiler)
+            with cpu_profiles['lock']:
+                if cpu_profiles['stats'] is not None:
+                    stats.add(cpu_profiles['stats'])
+                cpu_profiles['stats'] = None
+            stats_path = results_folder_path(f"Profile_{stamp}.pstats")
+            stats.dump_stats(stats_path)
+            with open(results_folder_path(f"Profile_{stamp}.txt"), 'w') as file:
+                stats.stream = file
+                stats.sort_stats('cumulative').print_stats(60)
+            print(f"CPU profile saved at {stats_path}", file=sys.stderr)
+    import tracemalloc
+    tracemalloc.start(25)
+    try:
+        return function(*args, **kwargs)
+    finally:
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        report_path = results_folder_path(f"Profile_{stamp}_memory.txt")
+        with open(report_path, 'w') as file:
+            file.write(f"Current: {current / 1024:.1f} KiB, peak: {peak / 1024:.1f} KiB\n\n")
+            for statistic in snapshot.statistics('lineno')[:40]:
+                file.write(f"{statistic}\n")
+        print(f"Memory profile saved at {report_path}", file=sys.stderr)
+
+def run_traced(path, function, *args, **kwargs):
+    """Records tracer spans while function runs and exports them; path '' picks a name in the Results folder."""
+    if path is None:
+        return function(*args, **kwargs)
+    tracer.recording = True
+    try:
+        return function(*args, **kwargs)
+    finally:
+        tracer.recording = False
+        trace_path = path or results_folder_path(f"Trace_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+        tracer.export(trace_path)
+        print(f"Trace saved at {trace_path}", file=sys.stderr)
+
+def cli_main(argv=None):
+    parser = build_argument_parser()
+    arguments = parser.parse_args(argv)
+    if arguments.setup:
+        main(setup=True)
+        return 0
+    if arguments.command == 'run':
+        try:
+            test_names = parse_test_selection(arguments.tests) if arguments.tests else None
+        except ValueError as e:
+            parser.error(str(e))
+        settings = load_settings()
+        configure_logging(settings)
+        return run_traced(arguments.trace, run_profiled, arguments.profile, run_cli, arguments, settings, test_names)
+    if arguments.command == 'sweep':
+        settings = load_settings()
+        configure_logging(settings)
+        try:
+            return run_sweep_cli(arguments, settings)
+        except (OSError, ValueError) as e:
+            parser.error(f"cannot read targets: {e}")
+    if arguments.command == 'serve-throughput':
+        settings = load_settings()
+        configure_logging(settings)
+        throughput_settings = settings.get('throughput_settings', {})
+        host = arguments.host or throughput_settings.get('listen_host', '0.0.0.0')
+        port = arguments.port or int(throughput_settings.get('port', 5201))
+        try:
+            server = create_throughput_server(host, port)
+        except OSError as e:
+            parser.error(f"cannot listen on {host}:{port}: {e}")
+        print(f"Throughput server listening on {host}:{server.server_address[1]} (Ctrl+C to stop)")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        return 0
+    if arguments.command == 'monitor' or arguments.monitor:
+        settings = load_settings()
+        configure_logging(settings)
+        start_metrics_server(settings, getattr(arguments, 'metrics_port', None))
+        run_traced(getattr(arguments, 'trace', None), run_profiled, getattr(arguments, 'profile', None),
+                   run_monitor, settings, on_results=lambda results: record_results(results, settings),
+                   settings_loader=load_settings)
+        return 0
+    main()  # main() shows the banner and loads settings itself
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(cli_main())
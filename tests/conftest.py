@@ -0,0 +1,6 @@
+import sys
+from pathlib import Path
+
+REPO_DIRECTORY = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_DIRECTORY / 'benchmarks'))  # stubs.py, which puts the repository on the path
+sys.path.insert(0, str(REPO_DIRECTORY))
@@ -0,0 +1,646 @@
+import asyncio
+import copy
+import csv
+import json
+import math
+import random
+import sys
+import threading
+import time
+
+import pytest
+
+import network_diagnostics as nd
+from stubs import STUB_PUBLIC_IP, STUB_ROUTERS, NetworkConditions, StubNetwork, simulated_hop_transport, stub_ssl_context
+
+
+# --- Probe Engine ---
+@pytest.mark.parametrize('target, expected', [
+    ('example.com', ('example.com', 443)),
+    ('example.com:80', ('example.com', 80)),
+    ('[2001:db8::1]', ('2001:db8::1', 443)),
+    ('[2001:db8::1]:53', ('2001:db8::1', 53)),
+    ('2001:db8::1', ('2001:db8::1', 443)),
+    (' 10.0.0.1:8080 ', ('10.0.0.1', 8080)),
+])
+def test_parse_probe_target(target, expected):
+    host, port = nd.parse_probe_target(target, 443)
+    assert (host, int(port)) == expected
+
+
+@pytest.mark.parametrize('target', ['example.com:http', 'example.com:70000', '[::1]:x', 'example.com:'])
+def test_parse_probe_target_rejects_bad_ports(target):
+    with pytest.raises(ValueError, match='invalid port'):
+        nd.parse_probe_target(target, 443)
+
+
+def test_summarize_rtts():
+    summary = nd.summarize_rtts(5, [10.0, 12.0, 11.0, 15.0])
+    assert summary == {'sent': 5, 'received': 4, 'loss': 20.0, 'min': 10.0, 'avg': 12.0, 'max': 15.0,
+                       'jitter': round((2 + 1 + 4) / 3, 3)}
+
+
+def test_summarize_rtts_without_replies():
+    assert nd.summarize_rtts(3, []) == {'sent': 3, 'received': 0, 'loss': 100.0,
+                                        'min': None, 'avg': None, 'max': None, 'jitter': None}
+    assert nd.summarize_rtts(0, [])['loss'] == 0.0
+
+
+def test_probe_stub_echo_server():
+    with StubNetwork(NetworkConditions(latency_ms=5)) as network:
+        target = f"127.0.0.1:{network.ports['echo']}"
+        results = asyncio.run(nd.probe_targets([target], count=5, interval=0.01, timeout=1.0, method='udp'))
+    assert results[target]['received'] == 5
+    assert results[target]['loss'] == 0.0
+    assert results[target]['min'] >= 5
+
+
+def test_probe_stub_echo_server_with_loss():
+    with StubNetwork(NetworkConditions(loss_pct=100)) as network:
+        target = f"127.0.0.1:{network.ports['echo']}"
+        results = asyncio.run(nd.probe_targets([target], count=3, interval=0.01, timeout=0.2, method='udp'))
+    assert results[target]['received'] == 0
+    assert results[target]['loss'] == 100.0
+
+
+# --- Traceroute Engine ---
+def test_trace_route_reassembles_simulated_hops():
+    transport = simulated_hop_transport(NetworkConditions(latency_ms=20, jitter_ms=20), silent=(2,))
+    answered = []
+    trace = asyncio.run(nd.trace_route('127.0.0.1', max_hops=10, probes_per_hop=3, timeout=0.5, interval=0.001,
+                                       open_transport=transport, on_hop=answered.append))
+    assert trace['destination'] == '127.0.0.1'
+    assert trace['reached']
+    assert [hop['ttl'] for hop in trace['hops']] == list(range(1, STUB_ROUTERS + 2))
+    assert [hop['address'] for hop in trace['hops']] == ['10.0.1.1', None, '10.0.3.1', '127.0.0.1']
+    assert trace['hops'][1]['loss'] == 100.0
+    assert all(hop['sent'] == 3 and hop['received'] == 3 for index, hop in enumerate(trace['hops']) if index != 1)
+    assert answered.count(1) == 3 and 2 not in answered  # TTLs past the target answer too, and are cut off
+
+
+def test_trace_route_stops_at_max_hops():
+    trace = asyncio.run(nd.trace_route('127.0.0.1', max_hops=2, probes_per_hop=1, timeout=0.2,
+                                       open_transport=simulated_hop_transport(NetworkConditions())))
+    assert not trace['reached']
+    assert [hop['address'] for hop in trace['hops']] == ['10.0.1.1', '10.0.2.1']
+
+
+# --- Latency Statistics ---
+def test_sketch_quantiles_within_accuracy():
+    generator = random.Random(1)
+    samples = [generator.lognormvariate(3, 1) for _ in range(5000)]
+    sketch = nd.LatencySketch.from_samples(samples)
+    ordered = sorted(samples)
+    for name, fraction in nd.LATENCY_PERCENTILES.items():
+        exact = ordered[max(1, math.ceil(fraction * len(ordered))) - 1]
+        assert sketch.percentiles((name,))[name] == pytest.approx(exact, rel=0.011)
+    assert sketch.summary()['min'] == round(min(samples), 3)
+    assert sketch.summary()['max'] == round(max(samples), 3)
+
+
+def test_sketch_merge_matches_one_sketch():
+    first, second = [1.0, 2.0, None, 40.0], [3.0, 500.0, None, 7.5]
+    merged = nd.LatencySketch.from_samples(first).merge(nd.LatencySketch.from_samples(second))
+    whole = nd.LatencySketch.from_samples(first + second)
+    assert merged.buckets == whole.buckets
+    assert (merged.count, merged.lost, merged.min, merged.max) == (6, 2, 1.0, 500.0)
+    assert merged.percentiles(nd.SUMMARY_PERCENTILES) == whole.percentiles(nd.SUMMARY_PERCENTILES)
+
+
+def test_sketch_merge_rejects_other_accuracy():
+    with pytest.raises(ValueError):
+        nd.LatencySketch(0.01).merge(nd.LatencySketch(0.02))
+    converted = nd.LatencySketch.from_samples([10.0, 20.0], 0.02).with_accuracy(0.01)
+    assert nd.LatencySketch(0.01).merge(converted).count == 2
+
+
+def test_sketch_round_trip():
+    sketch = nd.LatencySketch.from_samples([0.5, 12.0, None, 250.0])
+    restored = nd.LatencySketch.from_dict(sketch.to_dict())
+    assert restored.to_dict() == sketch.to_dict()
+    assert restored.summary() == sketch.summary()
+    assert nd.LatencySketch.from_dict(nd.LatencySketch().to_dict()).summary()['received'] == 0
+
+
+# --- DNS Benchmark Engine ---
+def test_benchmark_dns_against_stub_resolver():
+    with StubNetwork(NetworkConditions(latency_ms=2)) as network:
+        resolver = f"127.0.0.1:{network.ports['dns']}"
+        summaries = asyncio.run(nd.benchmark_dns([resolver], ['localhost', 'example.com'], rounds=3, timeout=1.0))
+    summary = summaries[resolver]
+    assert (summary['queries'], summary['answered'], summary['timeouts'], summary['errors']) == (12, 12, 0, 0)
+    assert summary['cold']['count'] == 4 and summary['warm']['count'] == 8
+    assert summary['p50'] >= 2
+
+
+def test_benchmark_dns_counts_timeouts():
+    with StubNetwork(NetworkConditions(loss_pct=100)) as network:
+        resolver = f"127.0.0.1:{network.ports['dns']}"
+        summary = asyncio.run(nd.benchmark_dns([resolver], ['localhost'], rounds=2, timeout=0.2))[resolver]
+    assert (summary['queries'], summary['answered'], summary['timeouts']) == (4, 0, 4)
+    assert summary['p50'] is None
+
+
+def test_benchmark_dns_reports_unusable_resolver():
+    summary = asyncio.run(nd.benchmark_dns(['127.0.0.1:x'], ['localhost'], rounds=1))['127.0.0.1:x']
+    assert summary['errors'] == 2 and 'invalid port' in summary['error']
+
+
+# --- Throughput Engine ---
+@pytest.mark.parametrize('direction', ['download', 'upload'])
+def test_run_throughput_against_stub(direction):
+    with StubNetwork(NetworkConditions(bandwidth_mbps=40)) as network:
+        result = nd.run_throughput('127.0.0.1', network.ports['throughput'], direction, streams=2, duration=1.0,
+                                   warmup=0.25, interval=0.25, timeout=2.0)
+    assert result['direction'] == direction and result['streams'] == 2
+    assert len(result['intervals_mbps']) == 4 and result['warmup_s'] == 0.25
+    assert 20 <= result['mbps'] <= 44  # The stub's bandwidth limit, less what slow test machines lose
+
+
+# --- Latency Under Load ---
+def test_trimmed_mean_drops_the_slowest_tenth():
+    sketch = nd.LatencySketch.from_samples([10.0] * 9 + [1000.0])
+    assert nd.trimmed_mean(sketch) == pytest.approx(10.0, rel=0.01)
+    assert nd.trimmed_mean(nd.LatencySketch()) is None
+
+
+def test_responsiveness_rpm():
+    assert nd.responsiveness_rpm(nd.LatencySketch.from_samples([20.0] * 10)) == pytest.approx(3000, rel=0.01)
+    assert nd.responsiveness_rpm(nd.LatencySketch()) is None
+
+
+@pytest.mark.parametrize('added_ms, grade', [
+    (0, 'A+'), (4.9, 'A+'), (5, 'A'), (29, 'A'), (59, 'B'), (199, 'C'), (399, 'D'), (400, 'F'), (None, None),
+])
+def test_bufferbloat_grade(added_ms, grade):
+    assert nd.bufferbloat_grade(added_ms) == grade
+
+
+def test_latency_under_load_needs_a_probe_target():
+    settings = {'throughput_settings': {'server': '127.0.0.1'}, 'latency_under_load_settings': {'probe_target': ''}}
+    with pytest.raises(ValueError, match='probe target'):
+        nd.run_latency_under_load_test(nd.HeadlessProgress(), settings)
+
+
+# --- HTTP Probe ---
+@pytest.mark.parametrize('scheme', ['http', 'https'])
+def test_http_request_reuses_pooled_connection(scheme):
+    pool = nd.HttpConnectionPool(context=stub_ssl_context())
+    with StubNetwork() as network:
+        url = f"{scheme}://127.0.0.1:{network.ports[scheme]}/"
+        cold, warm = nd.http_request(url, 2.0, pool), nd.http_request(url, 2.0, pool)
+        pool.close()
+    assert cold['body'] == warm['body'] == STUB_PUBLIC_IP.encode('ascii')
+    assert not cold['reused'] and 'connect_ms' in cold
+    assert ('tls_ms' in cold) is (scheme == 'https')
+    assert warm['reused'] and not {'dns_ms', 'connect_ms', 'tls_ms'} & warm.keys()
+
+
+def test_http_request_resumes_tls_session():
+    pool = nd.HttpConnectionPool(context=stub_ssl_context())
+    with StubNetwork() as network:
+        url = f"https://127.0.0.1:{network.ports['https']}/"
+        full = nd.http_request(url, 2.0, pool)
+        pool.close()  # The next request needs a new connection, which resumes the session
+        resumed = nd.http_request(url, 2.0, pool)
+        pool.close()
+    assert not full['tls_resumed'] and not resumed['reused']
+    assert resumed['tls_resumed'] and 'tls_ms' in resumed
+
+
+# --- Socket Table ---
+PROC_TCP = """\
+  sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt   uid  timeout inode
+   0: 0100007F:0035 00000000:0000 0A 00000000:00000000 00:00000000 00000000   101        0 12345 1 0000000000000000 100 0 0 10 0
+   1: 0100007F:A1B2 0100007F:01BB 01 00000000:00000000 00:00000000 00000000  1000        0 23456 1 0000000000000000 20 4 30 10 -1
+"""
+PROC_UDP = """\
+  sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt   uid  timeout inode ref pointer drops
+ 100: 00000000:0044 00000000:0000 07 00000000:00000000 00:00000000 00000000     0        0 34567 2 0000000000000000 0
+"""
+
+
+@pytest.mark.skipif(sys.byteorder != 'little', reason="the sample addresses are little-endian")
+def test_read_proc_socket_table(tmp_path):
+    (tmp_path / 'tcp').write_text(PROC_TCP)
+    (tmp_path / 'udp').write_text(PROC_UDP)  # tcp6 and udp6 are missing, as with IPv6 disabled
+    table = nd.read_proc_socket_table(str(tmp_path))
+    assert len(table) == 3
+    assert list(table.inodes) == [12345, 23456, 34567]
+    assert table.connection(1) == {'protocol': 'tcp', 'local': '127.0.0.1:41394', 'remote': '127.0.0.1:443',
+                                   'state': 'ESTABLISHED'}
+    assert table.state_counts() == {'tcp': {'LISTEN': 1, 'ESTABLISHED': 1}, 'udp': {'UNCONN': 1}}
+    assert table.remote_port_counts() == {443: 1}
+
+
+def test_netstat_lines_match_the_proc_table():
+    table = nd.SocketTable('netstat')
+    for line in ['Active Connections', '  Proto  Local Address          Foreign Address        State',
+                 '  TCP    127.0.0.1:53           0.0.0.0:0              LISTENING',
+                 '  TCP    127.0.0.1:41394        127.0.0.1:443          ESTABLISHED',
+                 '  UDP    0.0.0.0:68             *:*']:
+        nd.parse_netstat_line(table, line)
+    assert table.state_counts() == {'tcp': {'LISTEN': 1, 'ESTABLISHED': 1}, 'udp': {'UNCONN': 1}}
+
+
+# --- Result Cache ---
+def test_result_cache_expires_entries():
+    cache = nd.ResultCache()
+    cache.configure({'persist': False})
+    cache.put('short', 1, ttl=0.05)
+    cache.put('long', 2, ttl=60)
+    cache.put('none', 3, ttl=0)
+    assert cache.get('short')['value'] == 1
+    time.sleep(0.1)
+    assert cache.get('short') is None and cache.get('none') is None
+    assert cache.get('long')['value'] == 2
+
+
+def test_result_cache_invalidates_by_tag():
+    cache = nd.ResultCache()
+    cache.configure({'persist': False})
+    cache.put('resolver', '1.1.1.1', ttl=None, tags=['dns'])
+    cache.put('public_ip', '203.0.113.7', ttl=None, tags=['interface', 'dns'])
+    cache.put('server', 'speedtest', ttl=None)
+    assert cache.invalidate('dns') == 2
+    assert cache.get('resolver') is None and cache.get('public_ip') is None
+    assert cache.get('server')['value'] == 'speedtest'
+    assert cache.invalidate('dns') == 0
+
+
+def test_result_cache_persists_live_entries(tmp_path):
+    settings = {'persist': True, 'path': str(tmp_path / 'cache.json')}
+    cache = nd.ResultCache()
+    cache.configure(settings)
+    cache.put('kept', 'value', ttl=60, tags=['dns'])
+    cache.put('expiring', 'value', ttl=0.05)
+    cache.save()
+    time.sleep(0.1)
+    restored = nd.ResultCache()
+    restored.configure(settings)
+    assert restored.get('kept')['tags'] == ['dns']
+    assert restored.get('expiring') is None
+
+
+def test_result_cache_drops_writes_of_cancelled_tests():
+    cache = nd.ResultCache()
+    cache.configure({'persist': False})
+    deadline = nd.TestDeadline('Ping')
+    deadline.cancel()
+    nd.test_deadlines.current = deadline
+    try:
+        cache.put('late', 'value', ttl=60)
+    finally:
+        nd.test_deadlines.current = None
+    assert cache.get('late') is None
+
+
+# --- Test Scheduler ---
+SCHEDULER_SETTINGS = {'cache_settings': {'persist': False}, 'statistics_settings': {'persist': False}}
+
+
+def registered_test(name, runner, after=()):
+    return {'name': name, 'cli_name': name.lower(), 'result_key': name, 'runner': runner, 'after': list(after)}
+
+
+@pytest.fixture
+def quiet(monkeypatch):
+    monkeypatch.setattr(nd, 'console_output', False)
+
+
+def sleeping_test(seconds, events=None, name=None):
+    def run(progress, settings):
+        if events is not None:
+            events.append(('start', name))
+        time.sleep(seconds)
+        if events is not None:
+            events.append(('end', name))
+        return {'result': 'Passed'}
+    return run
+
+
+def until_cancelled(progress, settings):
+    nd.record_partial(Progress='halfway')
+    nd.current_deadline().cancelled.wait(10)
+    return {'result': 'Passed'}
+
+
+def run_schedule(monkeypatch, tests, names=None, **scheduler_settings):
+    monkeypatch.setattr(nd, 'NETWORK_TESTS', tests)
+    settings = {**SCHEDULER_SETTINGS, 'scheduler_settings': scheduler_settings}
+    return nd.schedule_tests(names or [test['name'] for test in tests], settings, nd.HeadlessProgress())
+
+
+def test_schedule_runs_exclusive_test_alone(monkeypatch, quiet):
+    events = []
+    tests = [registered_test(name, sleeping_test(0.05, events, name)) for name in ('A', 'Exclusive', 'B', 'C')]
+    results = run_schedule(monkeypatch, tests, max_concurrency=4, exclusive_tests=['Exclusive'])
+    assert list(results) == ['A', 'Exclusive', 'B', 'C']
+    assert all(result['result'] == 'Passed' for result in results.values())
+    start, end = events.index(('start', 'Exclusive')), events.index(('end', 'Exclusive'))
+    assert end == start + 1  # Nothing started or finished while it ran
+    assert events.index(('start', 'B')) < start  # The tests behind it did not wait for it
+
+
+def test_schedule_honours_after(monkeypatch, quiet):
+    events = []
+    tests = [registered_test('Later', sleeping_test(0, events, 'Later'), after=['First']),
+             registered_test('First', sleeping_test(0.05, events, 'First'))]
+    run_schedule(monkeypatch, tests, max_concurrency=4)
+    assert events.index(('start', 'Later')) > events.index(('end', 'First'))
+    events.clear()
+    results = run_schedule(monkeypatch, tests, names=['Later'])  # A disabled dependency is not waited for
+    assert events == [('start', 'Later'), ('end', 'Later')] and list(results) == ['Later']
+
+
+def test_schedule_times_out_a_test_with_partial_results(monkeypatch, quiet):
+    tests = [registered_test('Slow', until_cancelled), registered_test('Fast', sleeping_test(0.2))]
+    started = time.perf_counter()
+    results = run_schedule(monkeypatch, tests, test_timeouts={'Slow': 0.1})
+    assert time.perf_counter() - started < 2
+    assert results['Slow']['result'] == 'Timeout' and results['Slow']['Progress'] == 'halfway'
+    assert '0.1 s time limit' in results['Slow']['Error']
+    assert results['Fast']['result'] == 'Passed'  # The default 'continue' policy lets the rest finish
+
+
+def test_schedule_stop_policy_cancels_the_pass(monkeypatch, quiet):
+    tests = [registered_test('Slow', until_cancelled), registered_test('Other', until_cancelled),
+             registered_test('Queued', sleeping_test(0))]
+    results = run_schedule(monkeypatch, tests, max_concurrency=2, timeout_policy='stop', test_timeouts={'Slow': 0.1})
+    assert results['Slow']['result'] == 'Timeout'
+    assert results['Other']['result'] == 'Timeout' and 'because Slow timed out' in results['Other']['Error']
+    assert results['Queued'] == {'result': 'Skipped', 'Error': 'not started because Slow timed out', 'duration': 'N/A'}
+
+
+def test_schedule_pass_timeout(monkeypatch, quiet):
+    tests = [registered_test('Slow', until_cancelled), registered_test('Queued', sleeping_test(0))]
+    results = run_schedule(monkeypatch, tests, max_concurrency=1, pass_timeout=0.1)
+    assert results['Slow']['result'] == 'Timeout' and '0.1 s time limit' in results['Slow']['Error']
+    assert results['Queued']['result'] == 'Skipped'
+
+
+def process_alive(pid):
+    try:
+        with open(f"/proc/{pid}/stat") as file:
+            return file.read().rpartition(')')[2].split()[0] not in ('Z', 'X')
+    except FileNotFoundError:
+        return False
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason="reads process states from /proc")
+def test_schedule_timeout_kills_the_process_group(monkeypatch, quiet):
+    child_pids = []
+    spawner = ("import subprocess, sys, time\n"
+               "child = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(30)'])\n"
+               "print(child.pid, flush=True)\n"
+               "time.sleep(30)\n")
+
+    def run(progress, settings):
+        outcome = nd.run_command_with_progress([sys.executable, '-c', spawner], 1, progress,
+                                               on_line=lambda line: child_pids.append(int(line)))
+        return {'result': 'Failed', 'Error': outcome['error']}
+
+    started = time.perf_counter()
+    results = run_schedule(monkeypatch, [registered_test('Command', run)], test_timeouts={'Command': 0.5})
+    assert results['Command']['result'] == 'Timeout'
+    assert time.perf_counter() - started < 5
+    assert child_pids
+    for _ in range(50):  # SIGKILL is asynchronous
+        if not process_alive(child_pids[0]):
+            break
+        time.sleep(0.05)
+    assert not process_alive(child_pids[0])  # The grandchild went down with its group
+
+
+# --- Monitoring Mode ---
+def test_monitor_keeps_ticking_while_a_slow_test_runs(monkeypatch, quiet):
+    fast_runs = []
+
+    def slow(progress, settings):
+        nd.current_deadline().cancelled.wait(10)  # Only returns once the monitor cancels it
+        return {'result': 'Passed'}
+
+    def fast(progress, settings):
+        fast_runs.append(time.perf_counter())
+        return {'result': 'Passed'}
+
+    monkeypatch.setattr(nd, 'NETWORK_TESTS', [registered_test('Slow', slow), registered_test('Fast', fast)])
+    settings = {'monitor_settings': {'intervals': {'Slow': 60, 'Fast': 0.05}}, 'scheduler_settings': {},
+                'cache_settings': {'persist': False}, 'statistics_settings': {'persist': False}}
+    stop_event, reported = threading.Event(), []
+    threading.Timer(0.5, stop_event.set).start()
+    started = time.perf_counter()
+    latest = nd.run_monitor(settings, stop_event, reported.append)
+    assert time.perf_counter() - started < 1.5  # Stopping cancels the slow test instead of waiting for it
+    assert len(fast_runs) >= 5
+    assert list(latest) == ['Fast'] and {key for results in reported for key in results} == {'Fast'}
+
+
+def test_monitor_runs_an_exclusive_test_alone(monkeypatch, quiet):
+    active, overlaps = set(), []
+
+    def runner(name):
+        def run(progress, settings):
+            active.add(name)
+            if len(active) > 1 and 'Exclusive' in active:
+                overlaps.append(set(active))
+            time.sleep(0.02)
+            active.discard(name)
+            return {'result': 'Passed'}
+        return run
+
+    monkeypatch.setattr(nd, 'NETWORK_TESTS', [registered_test(name, runner(name)) for name in ('A', 'B', 'Exclusive')])
+    settings = {'monitor_settings': {'intervals': {'A': 0.01, 'B': 0.01, 'Exclusive': 0.05}},
+                'scheduler_settings': {'exclusive_tests': ['Exclusive']},
+                'cache_settings': {'persist': False}, 'statistics_settings': {'persist': False}}
+    stop_event, reported = threading.Event(), []
+    threading.Timer(0.5, stop_event.set).start()
+    nd.run_monitor(settings, stop_event, reported.append)
+    assert not overlaps
+    assert sum('Exclusive' in results for results in reported) >= 3
+
+
+# --- Time-Series Store ---
+def test_timeseries_store_rollups(tmp_path):
+    store = nd.TimeSeriesStore(tmp_path)
+    hour = time.time() // 3600 * 3600 - 3600
+    for offset, value in ((0, 10.0), (30, 20.0), (90, 5.0), (10, 30.0)):  # The last one arrives out of order
+        store.append('ping.rtt', value, hour + offset)
+    store.close()
+    raw = store.read('ping.rtt', resolution='raw')
+    assert list(raw['timestamp']) == [hour, hour + 10, hour + 30, hour + 90]
+    minutes = store.read('ping.rtt', resolution='1m')
+    assert list(minutes['timestamp']) == [hour, hour + 60]
+    assert list(minutes['count']) == [3, 1] and list(minutes['sum']) == [60.0, 5.0]
+    assert (minutes['min'][0], minutes['max'][0]) == (10.0, 30.0)
+    assert store.summarize('ping.rtt') == {'count': 4, 'avg': 16.25, 'min': 5.0, 'max': 30.0}
+    assert list(store.read('ping.rtt', hour + 10, hour + 30, 'raw')['value']) == [30.0, 20.0]
+
+
+def test_timeseries_store_merges_partial_buckets(tmp_path):
+    hour = time.time() // 3600 * 3600 - 3600
+    for value in (1.0, 3.0):  # Two runs of the tool writing into the same open bucket
+        store = nd.TimeSeriesStore(tmp_path)
+        store.append('dns.p50', value, hour + value)
+        store.close()
+    assert store.summarize('dns.p50', resolution='1h') == {'count': 2, 'avg': 2.0, 'min': 1.0, 'max': 3.0}
+    assert len(store.read('dns.p50', resolution='1h')['timestamp']) == 1
+
+
+def test_timeseries_store_retention(tmp_path):
+    now = time.time()
+    store = nd.TimeSeriesStore(tmp_path, {'raw': 1, '1m': 2})
+    for age_days in (3, 1.5, 0.5):
+        store.append('ping.rtt', age_days, now - age_days * 86400)
+    store.close()
+    store.compact(now)
+    assert list(store.read('ping.rtt', resolution='raw')['value']) == [0.5]
+    assert list(store.read('ping.rtt', resolution='1m')['sum']) == [1.5, 0.5]
+    assert sum(store.read('ping.rtt', resolution='1d')['count']) == 3  # Kept forever by default
+
+
+def test_timeseries_store_records_results(tmp_path):
+    store = nd.TimeSeriesStore(tmp_path)
+    store.append_results({'Ping Test': {'result': 'Passed', 'duration': '0:00:01.500000',
+                                        'Targets': {'1.1.1.1': {'avg': 12.5, 'min': 10.0, 'max': 15.0}}}})
+    store.flush()
+    assert 'ping_test.duration_s' in store.series() and 'ping_test.passed' in store.series()
+    assert list(store.read('ping_test.duration_s', resolution='raw')['value']) == [1.5]
+
+
+# --- Result Exporters ---
+EXPORTED_RESULTS = {'Ping Test': {'result': 'Passed', 'duration': '0:00:02', 'Targets': {'1.1.1.1': {'avg': 12.5}}},
+                    'DNS Benchmark': {'result': 'Failed', 'duration': 3.25, 'Error': 'no resolvers'}}
+
+
+def export_all(exporter_class, directory, batch_size=100):
+    exporter = exporter_class(directory, batch_size=batch_size)
+    for test, data in EXPORTED_RESULTS.items():
+        exporter.write(nd.result_to_record(test, data, timestamp=1700000000.0))
+    exporter.close()
+    return exporter.path
+
+
+def test_result_to_record():
+    record = nd.result_to_record('DNS Benchmark', EXPORTED_RESULTS['DNS Benchmark'], timestamp=5.0)
+    assert record == {'timestamp': 5.0, 'test': 'DNS Benchmark', 'result': 'Failed', 'duration_s': 3.25,
+                      'metrics': {'passed': 0.0}, 'error': 'no resolvers'}
+
+
+def test_jsonl_and_csv_exporters(tmp_path):
+    lines = export_all(nd.JsonLinesExporter, tmp_path).read_text().splitlines()
+    assert [json.loads(line)['test'] for line in lines] == ['Ping Test', 'DNS Benchmark']
+    assert json.loads(lines[0])['metrics']['1.1.1.1.rtt_avg_ms'] == 12.5
+    export_all(nd.CsvExporter, tmp_path)
+    path = export_all(nd.CsvExporter, tmp_path)  # Appends to the same file
+    rows = list(csv.reader(path.read_text().splitlines()))
+    assert rows[0] == list(nd.CsvExporter.columns) and rows.count(rows[0]) == 1
+    assert len(rows) == 1 + 2 * 5  # Each export writes five (test, metric) rows
+
+
+def test_columnar_round_trip(tmp_path):
+    path = export_all(nd.ColumnarExporter, tmp_path, batch_size=1)
+    blocks = list(nd.read_columnar(path))
+    assert len(blocks) == 2  # One block per batch
+    first, second = blocks
+    assert set(first) == {'timestamp', 'test', 'result', 'metric', 'value'}
+    assert first['test'] == ['Ping Test'] * 3 and first['timestamp'] == [1700000000.0] * 3
+    assert dict(zip(first['metric'], first['value'])) == {'duration_s': 2.0, 'passed': 1.0, '1.1.1.1.rtt_avg_ms': 12.5}
+    assert second['result'] == ['Failed', 'Failed'] and second['value'] == [3.25, 0.0]
+
+
+def test_columnar_reader_rejects_corrupt_blocks(tmp_path):
+    path = tmp_path / 'results.ndcol'
+    path.write_bytes(b'NDC2' + bytes(6))
+    with pytest.raises(ValueError, match='Corrupt columnar block'):
+        list(nd.read_columnar(path))
+
+
+# --- Metrics Endpoint ---
+def test_metrics_registry_renders_exposition():
+    registry = nd.MetricsRegistry()
+    registry.record_result('Ping Test', {'result': 'Passed', 'duration': '0:00:00.500000',
+                                         'Targets': {'1.1.1.1': {'loss': 25.0, 'avg': 20.0, 'jitter': 2.0}}}, timestamp=10)
+    registry.record_result('Ping Test', {'result': 'Failed', 'duration': 3.0}, timestamp=20)
+    registry.record_result('DNS Benchmark', {'result': 'Passed', 'Resolvers': {
+        '1.1.1.1': {'p50': 10.0, 'p95': 20.0, 'p99': None, 'queries': 6, 'timeouts': 1}}})
+    lines = registry.rendered.decode().splitlines()
+    assert '# TYPE netdiag_test_runs_total counter' in lines
+    assert 'netdiag_test_runs_total{test="Ping Test",result="Passed"} 1' in lines
+    assert 'netdiag_test_runs_total{test="Ping Test",result="Failed"} 1' in lines
+    assert 'netdiag_test_up{test="Ping Test"} 0' in lines
+    assert 'netdiag_test_last_run_timestamp_seconds{test="Ping Test"} 20' in lines
+    assert 'netdiag_ping_loss_ratio{target="1.1.1.1"} 0.25' in lines
+    assert 'netdiag_dns_latency_seconds{resolver="1.1.1.1",percentile="p95"} 0.02' in lines
+    assert not any('percentile="p99"' in line for line in lines)
+    assert 'netdiag_test_duration_seconds_bucket{test="Ping Test",le="0.5"} 1' in lines
+    assert 'netdiag_test_duration_seconds_bucket{test="Ping Test",le="+Inf"} 2' in lines
+    assert 'netdiag_test_duration_seconds_sum{test="Ping Test"} 3.5' in lines
+    assert 'netdiag_test_duration_seconds_count{test="Ping Test"} 2' in lines
+
+
+def test_metric_label_values_are_escaped():
+    assert nd.format_metric_labels([('url', 'http://x/"a"\\b\n')]) == '{url="http://x/\\"a\\"\\\\b\\n"}'
+
+
+# --- Settings ---
+def test_validate_settings_keeps_valid_settings():
+    validated, problems = nd.validate_settings(copy.deepcopy(nd.DEFAULT_SETTINGS))
+    assert problems == []
+    assert validated == nd.DEFAULT_SETTINGS
+
+
+def test_validate_settings_drops_invalid_values():
+    settings = {'ping_settings': {'targets': ['1.1.1.1', 5], 'count': 'four', 'custom': 'kept'},
+                'test_preferences': {'Ping': 'Enabled', 'Netstat': 'Maybe'},
+                'cache_settings': {'enabled': 1, 'ttls': {'dns': 'soon', 'Custom': 30}},
+                'unknown_section': {'anything': True},
+                'logging_settings': 'verbose'}
+    validated, problems = nd.validate_settings(settings)
+    assert validated['ping_settings'] == {'custom': 'kept'}
+    assert validated['test_preferences'] == {'Ping': 'Enabled'}
+    assert validated['cache_settings'] == {'ttls': {'dns': nd.DEFAULT_SETTINGS['cache_settings']['ttls']['dns'],
+                                                    'Custom': 30}}
+    assert validated['unknown_section'] == {'anything': True}
+    assert 'logging_settings' not in validated
+    assert len(problems) == 6
+
+
+@pytest.mark.parametrize('value, default, valid', [
+    (True, False, True), (1, False, False), (2.5, 1, True), (True, 1, False),
+    (['a', 'b'], [], True), (['a', 1], ['x'], False), ('x', [], False), ('text', 'default', True),
+])
+def test_check_setting(value, default, valid):
+    assert nd.check_setting('name', value, default)[0] is valid
+
+
+# --- Command-Line Interface ---
+@pytest.fixture
+def cli_tests(monkeypatch, quiet):
+    outcomes = {'Ping': 'Passed', 'Nslookup': 'Passed'}
+    tests = [{**registered_test(name, lambda progress, settings, name=name: {'result': outcomes[name]}),
+              'cli_name': cli_name} for name, cli_name in (('Ping', 'ping'), ('Nslookup', 'dns'))]
+    monkeypatch.setattr(nd, 'NETWORK_TESTS', tests)
+    monkeypatch.setattr(nd, 'load_settings', lambda: {**SCHEDULER_SETTINGS, 'timeseries_settings': {'enabled': False}})
+    monkeypatch.setattr(nd, 'configure_logging', lambda settings: None)
+    return outcomes
+
+
+def test_cli_exits_zero_when_every_test_passes(cli_tests, capsys):
+    assert nd.cli_main(['run', '--tests', 'ping,dns']) == 0
+    report = json.loads(capsys.readouterr().out)
+    assert report['passed'] and list(report['results']) == ['Ping', 'Nslookup']
+
+
+def test_cli_exits_one_when_a_test_fails(cli_tests, capsys):
+    cli_tests['Nslookup'] = 'Failed'
+    assert nd.cli_main(['run', '--tests', 'ping,dns', '--format', 'jsonl']) == 1
+    assert len(capsys.readouterr().out.splitlines()) == 2
+    assert nd.cli_main(['run', '--tests', 'ping', '--format', 'jsonl']) == 0
+
+
+def test_cli_rejects_unknown_tests(cli_tests, capsys):
+    with pytest.raises(SystemExit) as exit_info:
+        nd.cli_main(['run', '--tests', 'ping,bogus'])
+    assert exit_info.value.code == 2
+    assert "unknown test 'bogus'" in capsys.readouterr().err